@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 21:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='notification_emails',
+            field=models.CharField(choices=[('instant', 'Email each notification'), ('digest', 'Daily digest email'), ('off', 'No emails')], default='instant', max_length=10),
+        ),
+    ]
@@ -7,6 +7,11 @@ class User(AbstractUser):
         ('advocate', 'Advocate'),
         ('admin', 'Admin'),
     )
+    NOTIFICATION_EMAIL_CHOICES = (
+        ('instant', 'Email each notification'),
+        ('digest', 'Daily digest email'),
+        ('off', 'No emails'),
+    )
     
     user_type = models.CharField(max_length=20, choices=USER_TYPE_CHOICES, default='client')
     phone = models.CharField(max_length=15, blank=True)
@@ -14,6 +19,7 @@ class User(AbstractUser):
     profile_picture = models.ImageField(upload_to='profiles/', blank=True, null=True)
     date_of_birth = models.DateField(null=True, blank=True)
     verified = models.BooleanField(default=False)
+    notification_emails = models.CharField(max_length=10, choices=NOTIFICATION_EMAIL_CHOICES, default='instant')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
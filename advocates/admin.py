@@ -1,11 +1,16 @@
 from django.contrib import admin
-from .models import Specialization, Advocate, AdvocateAvailability, AdvocateDocument
+from .models import Specialization, Language, Advocate, AdvocateAvailability, AdvocateDocument
 
 @admin.register(Specialization)
 class SpecializationAdmin(admin.ModelAdmin):
     list_display = ['name', 'icon']
     search_fields = ['name']
 
+@admin.register(Language)
+class LanguageAdmin(admin.ModelAdmin):
+    list_display = ['name', 'slug']
+    search_fields = ['name']
+
 @admin.register(Advocate)
 class AdvocateAdmin(admin.ModelAdmin):
     list_display = ['user', 'bar_council_id', 'experience', 'rating', 'total_cases', 'verified', 'is_available']
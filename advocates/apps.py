@@ -3,3 +3,6 @@ from django.apps import AppConfig
 
 class AdvocatesConfig(AppConfig):
     name = 'advocates'
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,153 @@
+"""
+Facet counts for the advocate filter sidebar.
+
+All facets are computed with one conditional-aggregate query. Each option
+is counted over the current result set with its own dimension's filter
+dropped, so picking "3-5 years" still shows how many advocates the other
+bands would give. Results are cached per normalised filter combination and
+invalidated through a version, kept in the shared cache, that
+``advocates.signals`` replaces when advocates change. Searches are counted
+afresh every time: which advocates match the text turns on bio, name and
+education edits that do not move facet buckets, and free text would add a
+cache entry per query.
+"""
+
+import hashlib
+import json
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+from django.utils.text import slugify
+
+from book_my_advocate.versions import new_version
+from .models import Advocate
+
+RATING_BUCKETS = (4, 3)
+
+FACET_CACHE_TIMEOUT = 300
+FACET_VERSION_KEY = 'advocate_facets:version'
+
+
+def normalise_filters(params):
+    """Return the facet filters from ``params`` with invalid values dropped."""
+    filters = {'search': ' '.join((params.get('search') or '').lower().split())}
+
+    try:
+        filters['specialization'] = int(params.get('specialization') or 0) or None
+    except ValueError:
+        filters['specialization'] = None
+
+    experience = params.get('experience')
+    filters['experience'] = experience if experience in dict(Advocate.EXPERIENCE_CHOICES) else None
+
+    filters['language'] = slugify(params.get('language') or '', allow_unicode=True) or None
+
+    try:
+        min_rating = Decimal(params.get('min_rating') or '')
+        filters['min_rating'] = str(min_rating) if 0 <= min_rating <= 5 else None
+    except InvalidOperation:
+        filters['min_rating'] = None
+    return filters
+
+
+def filter_conditions(filters):
+    """Map each facet dimension to the Q object it applies."""
+    return {
+        'specialization': Q(specializations__id=filters['specialization']) if filters['specialization'] else Q(),
+        'experience': Q(experience=filters['experience']) if filters['experience'] else Q(),
+        'min_rating': Q(rating__gte=filters['min_rating']) if filters['min_rating'] else Q(),
+        'language': Q(spoken_languages__slug=filters['language']) if filters['language'] else Q(),
+    }
+
+
+def _others(conditions, dimension):
+    combined = Q()
+    for name, condition in conditions.items():
+        if name != dimension:
+            combined &= condition
+    return combined
+
+
+def _facet_query(base_queryset, filters, specialization_ids):
+    queryset = Advocate.objects.filter(pk__in=base_queryset.values('pk'))
+    conditions = filter_conditions(filters)
+
+    aggregates = {}
+    for spec_id in specialization_ids:
+        aggregates[f'spec_{spec_id}'] = Count(
+            'id', distinct=True,
+            filter=Q(specializations__id=spec_id) & _others(conditions, 'specialization'),
+        )
+    for band, _ in Advocate.EXPERIENCE_CHOICES:
+        aggregates[f'exp_{band}'] = Count(
+            'id', distinct=True,
+            filter=Q(experience=band) & _others(conditions, 'experience'),
+        )
+    for bucket in RATING_BUCKETS:
+        aggregates[f'rating_{bucket}'] = Count(
+            'id', distinct=True,
+            filter=Q(rating__gte=bucket) & _others(conditions, 'min_rating'),
+        )
+    return queryset, aggregates
+
+
+def _facet_counts(row, specialization_ids):
+    return {
+        'specializations': {spec_id: row[f'spec_{spec_id}'] for spec_id in specialization_ids},
+        'experience': {band: row[f'exp_{band}'] for band, _ in Advocate.EXPERIENCE_CHOICES},
+        'rating': {bucket: row[f'rating_{bucket}'] for bucket in RATING_BUCKETS},
+    }
+
+
+def compute_facets(base_queryset, filters, specialization_ids):
+    """
+    Count every facet option over ``base_queryset`` (the result set before
+    facet filters) in a single query.
+    """
+    queryset, aggregates = _facet_query(base_queryset, filters, specialization_ids)
+    return _facet_counts(queryset.aggregate(**aggregates), specialization_ids)
+
+
+async def acompute_facets(base_queryset, filters, specialization_ids):
+    queryset, aggregates = _facet_query(base_queryset, filters, specialization_ids)
+    return _facet_counts(await queryset.aaggregate(**aggregates), specialization_ids)
+
+
+def _digest(filters):
+    return hashlib.md5(json.dumps(filters, sort_keys=True).encode()).hexdigest()
+
+
+def _cache_key(filters):
+    version = cache.get_or_set(FACET_VERSION_KEY, new_version, None)
+    return f'advocate_facets:{version}:{_digest(filters)}'
+
+
+def get_facets(base_queryset, filters, specialization_ids):
+    """Return cached facet counts for ``filters``, computing them on a miss."""
+    if filters['search']:
+        return compute_facets(base_queryset, filters, specialization_ids)
+    key = _cache_key(filters)
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_facets(base_queryset, filters, specialization_ids)
+        cache.set(key, facets, FACET_CACHE_TIMEOUT)
+    return facets
+
+
+async def aget_facets(base_queryset, filters, specialization_ids):
+    """``get_facets`` for async views."""
+    if filters['search']:
+        return await acompute_facets(base_queryset, filters, specialization_ids)
+    version = await cache.aget_or_set(FACET_VERSION_KEY, new_version, None)
+    key = f'advocate_facets:{version}:{_digest(filters)}'
+    facets = await cache.aget(key)
+    if facets is None:
+        facets = await acompute_facets(base_queryset, filters, specialization_ids)
+        await cache.aset(key, facets, FACET_CACHE_TIMEOUT)
+    return facets
+
+
+def invalidate():
+    """Drop every cached facet combination, in every worker, by replacing the version."""
+    cache.set(FACET_VERSION_KEY, new_version(), None)
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from advocates import search
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the advocate full-text search index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not search.is_enabled():
+            self.stdout.write(self.style.WARNING(
+                'Search index is not available on this database; nothing to do.'
+            ))
+            return
+        count = search.rebuild_index(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Indexed {count} advocates.'))
@@ -0,0 +1,59 @@
+from django.db import migrations
+
+# Kept here rather than imported from advocates.search, which may change
+# after this migration was written
+SEARCH_TABLE = 'advocates_advocate_search'
+
+
+def create_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        try:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+                "name, specializations, languages, bio, education, "
+                "tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        except Exception:
+            # SQLite built without FTS5: search falls back to icontains
+            return
+
+    Advocate = apps.get_model('advocates', 'Advocate')
+    rows = []
+    for advocate in Advocate.objects.select_related('user').prefetch_related('specializations'):
+        name = f"{advocate.user.first_name} {advocate.user.last_name}".strip() or advocate.user.username
+        rows.append((
+            advocate.pk,
+            name,
+            ' '.join(s.name for s in advocate.specializations.all()),
+            advocate.languages,
+            advocate.bio,
+            advocate.education,
+        ))
+    if rows:
+        with schema_editor.connection.cursor() as cursor:
+            cursor.executemany(
+                f"INSERT INTO {SEARCH_TABLE} "
+                "(rowid, name, specializations, languages, bio, education) "
+                "VALUES (%s, %s, %s, %s, %s, %s)",
+                rows,
+            )
+
+
+def drop_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {SEARCH_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advocates', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 6.0 on 2026-10-18 20:32
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def backfill_spoken_languages(apps, schema_editor):
+    Advocate = apps.get_model('advocates', 'Advocate')
+    Language = apps.get_model('advocates', 'Language')
+    Through = Advocate.spoken_languages.through
+
+    languages = {}
+    links = []
+    for advocate_id, csv in Advocate.objects.values_list('id', 'languages').iterator(chunk_size=1000):
+        slugs = set()
+        for name in (csv or '').split(','):
+            name = name.strip()
+            slug = slugify(name, allow_unicode=True)
+            if not slug or slug in slugs:
+                continue
+            slugs.add(slug)
+            if slug not in languages:
+                languages[slug] = Language.objects.create(slug=slug, name=name.title())
+            links.append(Through(advocate_id=advocate_id, language_id=languages[slug].id))
+    Through.objects.bulk_create(links, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advocates', '0002_advocate_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Language',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50)),
+                ('slug', models.SlugField(unique=True)),
+            ],
+            options={
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddField(
+            model_name='advocate',
+            name='spoken_languages',
+            field=models.ManyToManyField(blank=True, editable=False, related_name='advocates', to='advocates.language'),
+        ),
+        migrations.RunPython(backfill_spoken_languages, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,66 @@
+# Generated by Django 6.0 on 2026-10-18 20:37
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_review_sums(apps, schema_editor):
+    Advocate = apps.get_model('advocates', 'Advocate')
+    Review = apps.get_model('bookings', 'Review')
+    # The running rating is rating_sum / total_reviews, so the count and the
+    # rating are reset from the reviews too, including advocates without any
+    Advocate.objects.exclude(pk__in=Review.objects.values('advocate_id')).update(
+        total_reviews=0, rating=Decimal('0.00'),
+    )
+    rows = Review.objects.values('advocate_id').annotate(
+        total_reviews=Count('id'),
+        rating_sum=Sum('rating'),
+        professionalism_sum=Sum('professionalism'),
+        communication_sum=Sum('communication'),
+        expertise_sum=Sum('expertise'),
+        verified_reviews=Count('id', filter=Q(is_verified=True)),
+    )
+    for row in rows.iterator(chunk_size=1000):
+        row['rating'] = (Decimal(row['rating_sum']) / row['total_reviews']).quantize(
+            Decimal('0.01'), ROUND_HALF_UP,
+        )
+        Advocate.objects.filter(pk=row.pop('advocate_id')).update(**row)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advocates', '0003_language'),
+        ('bookings', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='advocate',
+            name='communication_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='advocate',
+            name='expertise_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='advocate',
+            name='professionalism_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='advocate',
+            name='rating_sum',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='advocate',
+            name='verified_reviews',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(backfill_review_sums, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 6.0 on 2026-10-18 21:58
+
+from django.db import migrations, models
+from django.utils.text import slugify
+
+
+def link_native_script_languages(apps, schema_editor):
+    # 0003 used ASCII-only slugs and dropped names such as हिन्दी
+    Advocate = apps.get_model('advocates', 'Advocate')
+    Language = apps.get_model('advocates', 'Language')
+    Through = Advocate.spoken_languages.through
+
+    languages = {}
+    links = []
+    for advocate_id, csv in Advocate.objects.values_list('id', 'languages').iterator(chunk_size=1000):
+        slugs = set()
+        for name in (csv or '').split(','):
+            name = name.strip()
+            slug = slugify(name, allow_unicode=True)
+            if not slug or slugify(name) or slug in slugs:
+                continue
+            slugs.add(slug)
+            if slug not in languages:
+                languages[slug], _ = Language.objects.get_or_create(slug=slug, defaults={'name': name.title()})
+            links.append(Through(advocate_id=advocate_id, language_id=languages[slug].id))
+    Through.objects.bulk_create(links, batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advocates', '0004_review_running_sums'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='language',
+            name='slug',
+            field=models.SlugField(allow_unicode=True, unique=True),
+        ),
+        migrations.RunPython(link_native_script_languages, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.utils.text import slugify
 from accounts.models import User
 
 class Specialization(models.Model):
@@ -14,6 +15,17 @@ class Specialization(models.Model):
         ordering = ['name']
 
 
+class Language(models.Model):
+    name = models.CharField(max_length=50)
+    slug = models.SlugField(max_length=50, unique=True, allow_unicode=True)
+    
+    def __str__(self):
+        return self.name
+    
+    class Meta:
+        ordering = ['name']
+
+
 class Advocate(models.Model):
     EXPERIENCE_CHOICES = (
         ('0-2', '0-2 years'),
@@ -30,6 +42,7 @@ class Advocate(models.Model):
     court_appearance_fee = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     bio = models.TextField()
     languages = models.CharField(max_length=200, help_text="Comma separated languages")
+    spoken_languages = models.ManyToManyField(Language, related_name='advocates', blank=True, editable=False)
     education = models.TextField()
     certifications = models.TextField(blank=True)
     success_rate = models.DecimalField(
@@ -46,6 +59,12 @@ class Advocate(models.Model):
         validators=[MinValueValidator(0), MaxValueValidator(5)]
     )
     total_reviews = models.IntegerField(default=0)
+    # Running totals over all reviews, maintained by bookings.ratings
+    rating_sum = models.IntegerField(default=0, editable=False)
+    professionalism_sum = models.IntegerField(default=0, editable=False)
+    communication_sum = models.IntegerField(default=0, editable=False)
+    expertise_sum = models.IntegerField(default=0, editable=False)
+    verified_reviews = models.IntegerField(default=0, editable=False)
     is_available = models.BooleanField(default=True)
     verified = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -59,6 +78,21 @@ class Advocate(models.Model):
     
     def get_languages_list(self):
         return [lang.strip() for lang in self.languages.split(',')]
+    
+    def sync_spoken_languages(self):
+        """Point spoken_languages at the Language rows named in ``languages``."""
+        names = {}
+        for name in self.get_languages_list():
+            # Keep names in native script, e.g. हिन्दी
+            slug = slugify(name, allow_unicode=True)
+            if slug:
+                names.setdefault(slug, name.title())
+        existing = {lang.slug: lang for lang in Language.objects.filter(slug__in=names)}
+        missing = [Language(slug=slug, name=name) for slug, name in names.items() if slug not in existing]
+        if missing:
+            Language.objects.bulk_create(missing, ignore_conflicts=True)
+            existing = {lang.slug: lang for lang in Language.objects.filter(slug__in=names)}
+        self.spoken_languages.set(existing.values())
 
 
 class AdvocateAvailability(models.Model):
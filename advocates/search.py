@@ -0,0 +1,153 @@
+"""
+Full-text search index for advocate discovery.
+
+On SQLite the index is an FTS5 virtual table keyed by advocate id, kept in
+sync by the signal handlers in ``advocates.signals``. Other databases (or a
+SQLite build without FTS5) fall back to the plain ``icontains`` search.
+"""
+
+import re
+
+from django.db import connection
+from django.db.models import Q
+
+SEARCH_TABLE = 'advocates_advocate_search'
+
+# Upper bound on the number of ranked ids returned for one query
+SEARCH_RESULT_LIMIT = 500
+
+# bm25() column weights: name, specializations, languages, bio, education
+COLUMN_WEIGHTS = (10.0, 5.0, 3.0, 1.0, 1.0)
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Table existence per database name, so lookups don't introspect every time
+_enabled = {}
+
+
+def is_enabled():
+    """True when the search table exists on the default connection."""
+    if connection.vendor != 'sqlite':
+        return False
+    name = str(connection.settings_dict['NAME'])
+    if name not in _enabled:
+        _enabled[name] = SEARCH_TABLE in connection.introspection.table_names()
+    return _enabled[name]
+
+
+def _document(advocate, specialization_names):
+    return (
+        advocate.user.get_full_name(),
+        ' '.join(specialization_names),
+        advocate.languages or '',
+        advocate.bio or '',
+        advocate.education or '',
+    )
+
+
+def index_advocates(advocates):
+    """Insert or replace the index rows for the given advocates."""
+    if not is_enabled():
+        return
+    advocates = list(advocates)
+    if not advocates:
+        return
+
+    from .models import Advocate
+    through = Advocate.specializations.through
+    names = {}
+    for advocate_id, name in through.objects.filter(
+        advocate_id__in=[a.pk for a in advocates]
+    ).values_list('advocate_id', 'specialization__name'):
+        names.setdefault(advocate_id, []).append(name)
+
+    rows = [(a.pk,) + _document(a, names.get(a.pk, [])) for a in advocates]
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s",
+            [(row[0],) for row in rows],
+        )
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} "
+            "(rowid, name, specializations, languages, bio, education) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            rows,
+        )
+
+
+def index_advocate_ids(advocate_ids):
+    from .models import Advocate
+    index_advocates(Advocate.objects.filter(pk__in=list(advocate_ids)).select_related('user'))
+
+
+def remove_advocate(advocate_id):
+    if not is_enabled():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [advocate_id])
+
+
+def rebuild_index(batch_size=1000):
+    """Rebuild the whole index in batches. Returns the number of rows indexed."""
+    if not is_enabled():
+        return 0
+
+    from .models import Advocate
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+
+    count = 0
+    last_id = 0
+    while True:
+        batch = list(
+            Advocate.objects.filter(pk__gt=last_id)
+            .select_related('user')
+            .order_by('pk')[:batch_size]
+        )
+        if not batch:
+            break
+        index_advocates(batch)
+        count += len(batch)
+        last_id = batch[-1].pk
+    return count
+
+
+def build_match_query(text):
+    """Turn free text into an FTS5 query: every token must prefix-match."""
+    tokens = _TOKEN_RE.findall(text.lower())
+    return ' AND '.join(f'"{token}"*' for token in tokens)
+
+
+def search_advocate_ids(text, limit=SEARCH_RESULT_LIMIT):
+    """
+    Return the ids of listed (verified and available) advocates matching
+    ``text``, best match first, or None when the index is unavailable and
+    the caller should fall back to ``fallback_filter``. Hidden advocates
+    are filtered in the same query, so they never take up the ``limit``.
+    """
+    if not is_enabled():
+        return None
+    match = build_match_query(text)
+    if not match:
+        return []
+
+    from .models import Advocate
+    weights = ', '.join(str(w) for w in COLUMN_WEIGHTS)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"SELECT {SEARCH_TABLE}.rowid FROM {SEARCH_TABLE} "
+            f"JOIN {Advocate._meta.db_table} advocate ON advocate.id = {SEARCH_TABLE}.rowid "
+            f"WHERE {SEARCH_TABLE} MATCH %s AND advocate.verified AND advocate.is_available "
+            f"ORDER BY bm25({SEARCH_TABLE}, {weights}) LIMIT %s",
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def fallback_filter(text):
+    return (
+        Q(user__first_name__icontains=text) |
+        Q(user__last_name__icontains=text) |
+        Q(specializations__name__icontains=text) |
+        Q(bio__icontains=text)
+    )
@@ -0,0 +1,99 @@
+from django.db.models.signals import post_init, post_save, pre_delete, post_delete, m2m_changed
+from django.dispatch import Signal, receiver
+from accounts.models import User
+from .models import Advocate, Specialization
+from . import facets, search
+
+# Sent when advocates are changed through update() or bulk_update(), which
+# skip post_save, with the ids of the advocates changed (``advocate_ids``)
+advocates_changed = Signal()
+
+# Advocate fields whose changes move advocates between facet buckets
+# (languages is filterable, so it invalidates cached counts too)
+FACET_FIELDS = ('verified', 'is_available', 'rating', 'experience', 'languages')
+
+
+def _facet_state(advocate):
+    # Read __dict__ directly so deferred fields are not fetched
+    return tuple(advocate.__dict__.get(field) for field in FACET_FIELDS)
+
+
+@receiver(post_init, sender=Advocate)
+def remember_facet_state(sender, instance, **kwargs):
+    instance._facet_state = _facet_state(instance)
+    instance._loaded_languages = instance.__dict__.get('languages')
+
+
+@receiver(post_save, sender=Advocate)
+def index_saved_advocate(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    search.index_advocates([instance])
+
+
+@receiver(post_save, sender=Advocate)
+def invalidate_facets_for_advocate(sender, instance, created, **kwargs):
+    state = _facet_state(instance)
+    if created or state != instance._facet_state:
+        facets.invalidate()
+    instance._facet_state = state
+
+
+@receiver(post_save, sender=Advocate)
+def sync_advocate_languages(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created or instance.languages != instance._loaded_languages:
+        instance.sync_spoken_languages()
+    instance._loaded_languages = instance.languages
+
+
+@receiver(post_delete, sender=Advocate)
+def unindex_deleted_advocate(sender, instance, **kwargs):
+    search.remove_advocate(instance.pk)
+    facets.invalidate()
+
+
+@receiver(m2m_changed, sender=Advocate.specializations.through)
+def index_advocate_specializations(sender, instance, action, reverse, pk_set, **kwargs):
+    if reverse and action == 'pre_clear':
+        # The through rows are gone by post_clear, so remember who had them
+        instance._search_advocate_ids = list(instance.advocates.values_list('pk', flat=True))
+        return
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    facets.invalidate()
+    if not reverse:
+        search.index_advocates([instance])
+    elif action == 'post_clear':
+        search.index_advocate_ids(getattr(instance, '_search_advocate_ids', []))
+    else:
+        search.index_advocate_ids(pk_set)
+
+
+@receiver(post_save, sender=Specialization)
+def index_renamed_specialization(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        facets.invalidate()
+        return
+    search.index_advocate_ids(instance.advocates.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=Specialization)
+def remember_specialization_advocates(sender, instance, **kwargs):
+    instance._search_advocate_ids = list(instance.advocates.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Specialization)
+def index_deleted_specialization(sender, instance, **kwargs):
+    facets.invalidate()
+    search.index_advocate_ids(getattr(instance, '_search_advocate_ids', []))
+
+
+@receiver(post_save, sender=User)
+def index_advocate_user(sender, instance, raw=False, **kwargs):
+    if raw or instance.user_type != 'advocate':
+        return
+    search.index_advocate_ids(Advocate.objects.filter(user=instance).values_list('pk', flat=True))
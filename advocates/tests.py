@@ -1,3 +1,386 @@
+import asyncio
+import time as time_module
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import urlsplit
+from wsgiref.util import setup_testing_defaults
+from django.core.asgi import get_asgi_application
+from django.core.cache import cache
+from django.core.wsgi import get_wsgi_application
 from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from accounts.models import User
+from book_my_advocate.pagination import encode_cursor
+from testutils.cases import Benchmark
+from testutils.factories import create_advocate
+from . import search
+from .models import Advocate, Specialization
 
-# Create your tests here.
+
+class AdvocateListPaginationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        specs = [
+            Specialization.objects.create(name=name, description=name)
+            for name in ['Criminal Law', 'Family Law', 'Tax Law', 'Civil Law']
+        ]
+        for i in range(60):
+            advocate = create_advocate(f'advocate{i}', rating=Decimal(i % 5))
+            advocate.specializations.set(specs)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_query_budget_for_fifty_card_page(self):
+        # sidebar specializations + facets + page rows + specialization prefetch + count
+        with self.assertNumQueries(5):
+            self.client.get(reverse('advocate_list'), {'page_size': 50})
+        # Facet counts are served from the cache on the next request
+        with self.assertNumQueries(4):
+            response = self.client.get(reverse('advocate_list'), {'page_size': 50})
+        self.assertEqual(len(response.context['advocates']), 50)
+        self.assertEqual(response.context['total_count'], 60)
+
+    def test_cursor_walks_every_advocate_once(self):
+        seen = []
+        params = {'page_size': 25}
+        while True:
+            response = self.client.get(reverse('advocate_list'), params)
+            page = response.context['page']
+            seen.extend(advocate.pk for advocate in page)
+            if not page.has_next:
+                break
+            params['cursor'] = page.next_cursor
+        self.assertEqual(len(seen), 60)
+        self.assertEqual(len(set(seen)), 60)
+        ratings = [Advocate.objects.get(pk=pk).rating for pk in seen]
+        self.assertEqual(ratings, sorted(ratings, reverse=True))
+
+    def test_cursor_keeps_microseconds(self):
+        # Two newest advocates in the same millisecond, one on each page
+        moment = timezone.now().replace(microsecond=123400) + timedelta(days=1)
+        newest, second = Advocate.objects.order_by('pk')[:2]
+        Advocate.objects.filter(pk=newest.pk).update(created_at=moment)
+        Advocate.objects.filter(pk=second.pk).update(created_at=moment - timedelta(microseconds=300))
+        params = {'sort_by': '-created_at', 'page_size': 1}
+        first = self.client.get(reverse('advocate_list'), params).context['page']
+        params['cursor'] = first.next_cursor
+        following = self.client.get(reverse('advocate_list'), params).context['page']
+        self.assertEqual([a.pk for a in first], [newest.pk])
+        self.assertEqual([a.pk for a in following], [second.pk])
+
+    def test_malformed_cursor_gives_the_first_page(self):
+        first = [a.pk for a in self.client.get(reverse('advocate_list')).context['page']]
+        cursors = [
+            (None, encode_cursor(['abc', 1, 2])),
+            (None, encode_cursor([None, None, None])),
+            (None, encode_cursor([{'rating': 4}, 1, 2])),
+            ('-created_at', encode_cursor(['not a date', 1])),
+            ('-created_at', encode_cursor(['2024-01-01T00:00:00+00:00', 'x'])),
+            (None, 'not-base64!'),
+        ]
+        for sort_by, cursor in cursors:
+            params = {'cursor': cursor, **({'sort_by': sort_by} if sort_by else {})}
+            with self.subTest(params=params):
+                response = self.client.get(reverse('advocate_list'), params)
+                self.assertEqual(response.status_code, 200)
+                if not sort_by:
+                    self.assertEqual([a.pk for a in response.context['page']], first)
+
+
+class AdvocateFacetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.criminal = Specialization.objects.create(name='Criminal Law', description='Criminal')
+        cls.family = Specialization.objects.create(name='Family Law', description='Family')
+        cls.senior = create_advocate('senior', rating=Decimal('4.50'), experience='10+')
+        cls.senior.specializations.set([cls.criminal, cls.family])
+        cls.junior = create_advocate('junior', rating=Decimal('3.20'), experience='0-2')
+        cls.junior.specializations.set([cls.criminal])
+        create_advocate('hidden', rating=Decimal('5.00'), verified=False)
+
+    def setUp(self):
+        cache.clear()
+
+    def facets(self, **params):
+        response = self.client.get(reverse('advocate_list'), params)
+        specs = {spec.name: spec.facet_count for spec in response.context['specializations']}
+        experience = {band: count for band, _, count in response.context['experience_facets']}
+        rating = dict(response.context['rating_facets'])
+        return specs, experience, rating
+
+    def test_counts_drop_only_their_own_dimension(self):
+        specs, experience, rating = self.facets(experience='10+')
+        self.assertEqual(specs, {'Criminal Law': 1, 'Family Law': 1})
+        self.assertEqual(experience, {'0-2': 1, '3-5': 0, '6-10': 0, '10+': 1})
+        self.assertEqual(rating, {'4': 1, '3': 1})
+
+    def test_cached_counts_are_invalidated_by_rating_change(self):
+        self.assertEqual(self.facets()[2], {'4': 1, '3': 2})
+        self.junior.rating = Decimal('4.10')
+        self.junior.save()
+        self.assertEqual(self.facets()[2], {'4': 2, '3': 2})
+
+    def test_cached_counts_are_invalidated_by_specialization_change(self):
+        self.assertEqual(self.facets()[0]['Family Law'], 1)
+        self.junior.specializations.add(self.family)
+        self.assertEqual(self.facets()[0]['Family Law'], 2)
+
+
+    def test_search_counts_follow_bio_edits(self):
+        self.assertEqual(self.facets(search='extradition')[1]['10+'], 0)
+        self.senior.bio = 'Extradition and white-collar defence'
+        self.senior.save()
+        self.assertEqual(self.facets(search='extradition')[1]['10+'], 1)
+
+class AdvocateLanguageTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.bilingual = create_advocate('bilingual', languages='English, hindi')
+        self.tamil = create_advocate('tamil', languages='Tamil, Hindustani')
+
+    def test_languages_are_normalised_on_save(self):
+        self.assertEqual(
+            sorted(self.bilingual.spoken_languages.values_list('name', flat=True)), ['English', 'Hindi']
+        )
+        self.tamil.languages = 'Tamil, Telugu'
+        self.tamil.save()
+        self.assertEqual(
+            sorted(self.tamil.spoken_languages.values_list('slug', flat=True)), ['tamil', 'telugu']
+        )
+
+    def test_language_filter_matches_whole_languages_only(self):
+        response = self.client.get(reverse('advocate_list'), {'language': 'Hindi'})
+        self.assertEqual([a.pk for a in response.context['advocates']], [self.bilingual.pk])
+
+        response = self.client.get('/api/advocates/', {'language': 'hindi'})
+        self.assertEqual([a['id'] for a in response.json()['results']], [self.bilingual.pk])
+
+    def test_native_script_languages_are_kept(self):
+        native = create_advocate('native', languages='English, हिन्दी')
+        self.assertEqual(
+            sorted(native.spoken_languages.values_list('name', flat=True)), ['English', 'हिन्दी']
+        )
+        response = self.client.get(reverse('advocate_list'), {'language': 'हिन्दी'})
+        self.assertEqual([a.pk for a in response.context['advocates']], [native.pk])
+        response = self.client.get('/api/advocates/', {'language': 'हिन्दी'})
+        self.assertEqual([a['id'] for a in response.json()['results']], [native.pk])
+
+
+class AdvocateSearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.criminal = Specialization.objects.create(name='Criminal Law', description='Criminal')
+        cls.family = Specialization.objects.create(name='Family Law', description='Family')
+        cls.named = create_advocate('meera', bio='Handles property disputes')
+        cls.named.specializations.set([cls.family])
+        cls.bio = create_advocate('ravi', bio='Often assists Meera with criminal appeals')
+        cls.bio.specializations.set([cls.criminal])
+
+    def setUp(self):
+        cache.clear()
+        if not search.is_enabled():
+            self.skipTest('SQLite without FTS5')
+
+    def ids(self, text, **kwargs):
+        return search.search_advocate_ids(text, **kwargs)
+
+    def test_name_matches_rank_above_bio_matches(self):
+        self.assertEqual(self.ids('meera'), [self.named.pk, self.bio.pk])
+        # Every token must prefix-match
+        self.assertEqual(self.ids('crim appe'), [self.bio.pk])
+        self.assertEqual(self.ids('  '), [])
+
+    def test_index_follows_saves_and_specialization_changes(self):
+        self.named.bio = 'Now argues tax matters'
+        self.named.save()
+        self.assertEqual(self.ids('tax'), [self.named.pk])
+
+        self.named.user.first_name = 'Lakshmi'
+        self.named.user.save()
+        self.assertEqual(self.ids('lakshmi'), [self.named.pk])
+
+        self.named.specializations.add(self.criminal)
+        self.assertEqual(set(self.ids('criminal')), {self.named.pk, self.bio.pk})
+        self.criminal.name = 'Penal Law'
+        self.criminal.save()
+        self.assertEqual(set(self.ids('penal')), {self.named.pk, self.bio.pk})
+        self.criminal.advocates.clear()
+        self.assertEqual(self.ids('penal'), [])
+
+        self.family.delete()
+        self.assertEqual(self.ids('family'), [])
+        self.bio.delete()
+        self.assertEqual(self.ids('ravi'), [])
+
+    def test_hidden_advocates_do_not_take_up_the_limit(self):
+        hidden = create_advocate('meera2', verified=False)
+        unavailable = create_advocate('meera3', is_available=False)
+        hidden.user.first_name = unavailable.user.first_name = 'Meera'
+        hidden.user.save()
+        unavailable.user.save()
+        self.assertEqual(self.ids('meera', limit=1), [self.named.pk])
+
+        response = self.client.get(reverse('advocate_list'), {'search': 'meera'})
+        self.assertEqual([a.pk for a in response.context['advocates']], [self.named.pk, self.bio.pk])
+        self.assertEqual(response.context['total_count'], 2)
+
+    def test_falls_back_to_icontains_without_the_index(self):
+        with mock.patch.object(search, 'is_enabled', return_value=False):
+            self.assertIsNone(self.ids('meera'))
+            response = self.client.get(reverse('advocate_list'), {'search': 'Meera'})
+        self.assertEqual({a.pk for a in response.context['advocates']}, {self.named.pk, self.bio.pk})
+
+
+class AdvocateDetailTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.advocate = create_advocate('detail')
+        cls.advocate.specializations.set([
+            Specialization.objects.create(name='Criminal Law', description='Criminal')
+        ])
+        cls.client_user = User.objects.create_user(username='client', password='pass', user_type='client')
+
+    def test_signed_in_client_is_offered_booking(self):
+        self.client.login(username='client', password='pass')
+        response = self.client.get(reverse('advocate_detail', args=[self.advocate.id]))
+        self.assertContains(response, reverse('create_booking', args=[self.advocate.id]))
+        self.assertContains(response, 'Criminal Law')
+
+    def test_missing_advocate_is_404(self):
+        response = self.client.get(reverse('advocate_detail', args=[self.advocate.id + 1]))
+        self.assertEqual(response.status_code, 404)
+
+    async def test_served_under_asgi(self):
+        response = await self.async_client.get(reverse('advocate_list'), {'search': 'detail'})
+        self.assertEqual([a.pk for a in response.context['advocates']], [self.advocate.pk])
+        response = await self.async_client.get(reverse('advocate_detail', args=[self.advocate.id]))
+        self.assertContains(response, 'Adv. Detail Advocate')
+
+
+class AdvocateBrowsingBenchmark(Benchmark):
+    """
+    Serves the advocate list and detail pages to many concurrent slow
+    clients, through the WSGI handler on a pool of sync workers (as
+    gunicorn's sync workers would) and through the ASGI handler on one
+    event loop (as ``gunicorn -k uvicorn.workers.UvicornWorker
+    book_my_advocate.asgi:application`` would), and reports requests per
+    second and the Python heap (traced with tracemalloc) per connection in
+    flight. Rendering costs the same
+    either way; the difference is that a sync worker is held while its
+    client reads, whereas an ASGI connection only costs a task.
+    """
+    CONNECTIONS = 200
+    SYNC_WORKERS = 8
+    # Time the simulated client takes to read each response
+    SLOW_CLIENT_SECONDS = 0.25
+
+    def setUp(self):
+        cache.clear()
+        spec = Specialization.objects.create(name='Criminal Law', description='Criminal')
+        self.advocates = [create_advocate(f'advocate{i}', rating=Decimal(i % 5)) for i in range(60)]
+        for advocate in self.advocates:
+            advocate.specializations.add(spec)
+
+    def urls(self):
+        detail = [reverse('advocate_detail', args=[advocate.id]) for advocate in self.advocates]
+        return [
+            reverse('advocate_list') + '?page_size=24' if i % 2 else detail[i % len(detail)]
+            for i in range(self.CONNECTIONS)
+        ]
+
+    def serve_wsgi(self, urls):
+        application = get_wsgi_application()
+
+        def request(url):
+            path = urlsplit(url)
+            environ = {'PATH_INFO': path.path, 'QUERY_STRING': path.query}
+            setup_testing_defaults(environ)
+            status = []
+            body = application(environ, lambda s, headers, exc_info=None: status.append(s))
+            try:
+                for _ in body:
+                    time_module.sleep(self.SLOW_CLIENT_SECONDS)
+            finally:
+                body.close()
+            return status[0]
+
+        started = time_module.perf_counter()
+        with ThreadPoolExecutor(self.SYNC_WORKERS) as workers:
+            statuses = list(workers.map(request, urls))
+        return statuses, time_module.perf_counter() - started
+
+    def serve_asgi(self, urls):
+        application = get_asgi_application()
+
+        async def request(url):
+            path = urlsplit(url)
+            scope = {
+                'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1',
+                'method': 'GET', 'scheme': 'http', 'path': path.path, 'raw_path': path.path.encode(),
+                'query_string': path.query.encode(), 'root_path': '', 'headers': [(b'host', b'testserver')],
+                'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+            }
+            received = False
+            status = []
+
+            async def receive():
+                nonlocal received
+                if not received:
+                    received = True
+                    return {'type': 'http.request', 'body': b'', 'more_body': False}
+                # The client stays connected until the handler is done with it
+                await asyncio.Event().wait()
+
+            async def send(message):
+                if message['type'] == 'http.response.start':
+                    status.append(message['status'])
+                elif message['type'] == 'http.response.body':
+                    await asyncio.sleep(self.SLOW_CLIENT_SECONDS)
+
+            await application(scope, receive, send)
+            return status[0]
+
+        async def serve():
+            return await asyncio.gather(*(request(url) for url in urls))
+
+        started = time_module.perf_counter()
+        statuses = asyncio.run(serve())
+        return statuses, time_module.perf_counter() - started
+
+    def peak_kib(self, serve, urls):
+        """Peak Python heap, in KiB, while ``serve`` handles ``urls``."""
+        tracemalloc.start()
+        try:
+            statuses, _ = serve(urls)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        self.assertEqual(len(statuses), len(urls))
+        return peak / 1024
+
+    def test_async_views_hold_more_slow_connections_per_process(self):
+        urls = self.urls()
+        # Warm the facet cache, templates and URL resolver for both runs
+        self.serve_wsgi(urls[:2])
+
+        statuses, sync_seconds = self.serve_wsgi(urls)
+        self.assertEqual(set(statuses), {'200 OK'})
+        statuses, async_seconds = self.serve_asgi(urls)
+        self.assertEqual(set(statuses), {200})
+
+        # The sync workers have SYNC_WORKERS connections in flight at a
+        # time, the event loop all of them
+        sync_kib = self.peak_kib(self.serve_wsgi, urls[:self.SYNC_WORKERS]) / self.SYNC_WORKERS
+        async_kib = self.peak_kib(self.serve_asgi, urls) / len(urls)
+
+        self.report(
+            f"advocate browsing, {len(urls)} concurrent slow clients",
+            f"sync {self.SYNC_WORKERS} workers {len(urls) / sync_seconds:.0f} req/s, "
+            f"{sync_kib:.0f} KiB per connection in flight; "
+            f"asgi {len(urls) / async_seconds:.0f} req/s, {async_kib:.0f} KiB per connection in flight",
+        )
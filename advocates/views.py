@@ -1,68 +1,128 @@
-from django.shortcuts import render, get_object_or_404, redirect
+from asgiref.sync import sync_to_async
+from django.shortcuts import render, aget_object_or_404, redirect
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q, Avg
+from django.db.models import Q, Prefetch
+from book_my_advocate.pagination import apaginate_keyset, apaginate_ranked
 from .models import Advocate, Specialization, AdvocateAvailability
-from bookings.models import Review
+from datetime import timedelta
+from django.utils import timezone
+from bookings.models import Review, RatingSummary
+from bookings.slots import free_slots
 from .forms import AdvocateProfileForm, AdvocateAvailabilityForm
+from . import search as search_index
+from . import facets as facet_engine
 
-def advocate_list(request):
+CALENDAR_DAYS = 30
+ADVOCATE_PAGE_SIZE = 12
+MAX_ADVOCATE_PAGE_SIZE = 50
+
+# Allowed ?sort_by= values and the keyset ordering each maps to; every
+# ordering ends in 'id' so the cursor is unambiguous.
+ADVOCATE_SORTS = {
+    '-rating': ['-rating', '-total_cases', '-id'],
+    '-total_cases': ['-total_cases', '-rating', '-id'],
+    'consultation_fee': ['consultation_fee', 'id'],
+    '-consultation_fee': ['-consultation_fee', '-id'],
+    '-created_at': ['-created_at', '-id'],
+}
+
+
+def _page_size(request):
+    try:
+        size = int(request.GET.get('page_size', ADVOCATE_PAGE_SIZE))
+    except ValueError:
+        return ADVOCATE_PAGE_SIZE
+    return max(1, min(size, MAX_ADVOCATE_PAGE_SIZE))
+
+
+async def advocate_list(request):
+    # Templates read request.user synchronously; resolve it (and the session) up front
+    request.user = await request.auser()
     advocates = Advocate.objects.filter(verified=True, is_available=True).select_related('user')
+    filters = facet_engine.normalise_filters(request.GET)
     
     # Search
     search = request.GET.get('search')
+    ranked_ids = None
     if search:
-        advocates = advocates.filter(
-            Q(user__first_name__icontains=search) |
-            Q(user__last_name__icontains=search) |
-            Q(specializations__name__icontains=search) |
-            Q(bio__icontains=search)
-        ).distinct()
+        ranked_ids = await sync_to_async(search_index.search_advocate_ids)(search)
+        if ranked_ids is None:
+            advocates = advocates.filter(search_index.fallback_filter(search)).distinct()
+        else:
+            advocates = advocates.filter(id__in=ranked_ids)
     
-    # Filter by specialization
-    specialization_id = request.GET.get('specialization')
-    if specialization_id:
-        advocates = advocates.filter(specializations__id=specialization_id)
+    specializations = [spec async for spec in Specialization.objects.all()]
+    facets = await facet_engine.aget_facets(advocates, filters, [spec.id for spec in specializations])
     
-    # Filter by experience
-    experience = request.GET.get('experience')
-    if experience:
-        advocates = advocates.filter(experience=experience)
+    # Filter by specialization, experience, rating and language
+    for condition in facet_engine.filter_conditions(filters).values():
+        advocates = advocates.filter(condition)
     
-    # Filter by rating
-    min_rating = request.GET.get('min_rating')
-    if min_rating:
-        advocates = advocates.filter(rating__gte=min_rating)
+    advocates = advocates.prefetch_related(
+        Prefetch('specializations', queryset=Specialization.objects.only('id', 'name'))
+    )
     
-    # Sort
-    sort_by = request.GET.get('sort_by', '-rating')
-    advocates = advocates.order_by(sort_by)
+    # Sort and paginate (search results default to relevance order)
+    sort_by = request.GET.get('sort_by')
+    cursor = request.GET.get('cursor')
+    page_size = _page_size(request)
+    if ranked_ids is not None and sort_by not in ADVOCATE_SORTS:
+        page = await apaginate_ranked(advocates, ranked_ids, cursor, page_size)
+    else:
+        ordering = ADVOCATE_SORTS.get(sort_by, ADVOCATE_SORTS['-rating'])
+        page = await apaginate_keyset(advocates, ordering, cursor, page_size)
+        page.total_count = await advocates.acount()
     
-    specializations = Specialization.objects.all()
+    for spec in specializations:
+        spec.facet_count = facets['specializations'].get(spec.id, 0)
     
     context = {
-        'advocates': advocates,
+        'advocates': page,
+        'page': page,
+        'total_count': page.total_count,
         'specializations': specializations,
+        'experience_facets': [
+            (band, label, facets['experience'][band])
+            for band, label in Advocate.EXPERIENCE_CHOICES
+        ],
+        'rating_facets': [
+            (str(bucket), facets['rating'][bucket])
+            for bucket in facet_engine.RATING_BUCKETS
+        ],
     }
     return render(request, 'advocates/advocate_list.html', context)
 
-def advocate_detail(request, advocate_id):
-    advocate = get_object_or_404(Advocate.objects.select_related('user'), id=advocate_id)
-    reviews = Review.objects.filter(advocate=advocate, is_verified=True).select_related('client')[:10]
-    availability = AdvocateAvailability.objects.filter(advocate=advocate, is_available=True)
-    
-    # Calculate average ratings
-    avg_ratings = reviews.aggregate(
-        avg_professionalism=Avg('professionalism'),
-        avg_communication=Avg('communication'),
-        avg_expertise=Avg('expertise')
+async def advocate_detail(request, advocate_id):
+    request.user = await request.auser()
+    advocate = await aget_object_or_404(
+        Advocate.objects.select_related('user', 'rating_summary').prefetch_related('specializations'),
+        id=advocate_id,
     )
+    # Loaded here: the template must not query from the event loop
+    reviews = [
+        review async for review in
+        Review.objects.filter(advocate=advocate, is_verified=True).select_related('client')[:10]
+    ]
+    availability = [
+        slot async for slot in AdvocateAvailability.objects.filter(advocate=advocate, is_available=True)
+    ]
+    
+    # Bookable slots for the next month
+    today = timezone.localdate()
+    calendar = (await sync_to_async(free_slots)(
+        [advocate.id], today, today + timedelta(days=CALENDAR_DAYS - 1)
+    ))[advocate.id]
+    
+    # Precomputed breakdown of verified reviews (see bookings.ratings)
+    rating_summary = getattr(advocate, 'rating_summary', None) or RatingSummary(advocate=advocate)
     
     context = {
         'advocate': advocate,
         'reviews': reviews,
         'availability': availability,
-        'avg_ratings': avg_ratings,
+        'free_slots': sorted(calendar.items()),
+        'rating_summary': rating_summary,
     }
     return render(request, 'advocates/advocate_detail.html', context)
 
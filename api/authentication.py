@@ -0,0 +1,164 @@
+"""
+Token authentication with the token lookups cached.
+
+``CachedTokenAuthentication`` keeps each resolved token in a bounded LRU
+shared by the threads of a process, so a request with a recently seen
+token skips the Token + User query. Entries expire after ``TIMEOUT``
+seconds.
+
+When a token is deleted or its user saved (deactivated, say),
+``api.signals`` calls ``revoke_user_tokens``; code that deactivates users
+or changes passwords with a bulk ``update()`` must call it itself. That
+drops the entries of this process and stamps the time in the shared
+cache (``CACHES``); every hit reads the stamp and refuses an entry looked
+up before it, so other workers stop accepting the token on their next
+request too. A missing stamp (never set, or
+evicted) refuses every entry of the user and is set again by the next
+lookup.
+
+Configured with the ``API_TOKEN_CACHE`` setting::
+
+    API_TOKEN_CACHE = {'MAX_SIZE': 10000, 'TIMEOUT': 60}
+"""
+
+import copy
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from rest_framework.authentication import TokenAuthentication
+
+DEFAULT_TOKEN_CACHE = {'MAX_SIZE': 10000, 'TIMEOUT': 60}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def _detached(instance):
+    # Each request gets its own copy; related objects cached on one must not leak to others
+    clone = copy.copy(instance)
+    clone._state = copy.copy(instance._state)
+    clone._state.fields_cache = {}
+    return clone
+
+
+def _revoked_key(user_id):
+    return f'api:tokens:revoked:{user_id}'
+
+
+def revoke_user_tokens(user_id):
+    """Stop every worker accepting cached tokens of ``user_id``; call once the change has committed."""
+    cache.set(_revoked_key(user_id), time.time_ns(), None)
+    get_token_cache().forget_user(user_id)
+
+
+class TokenCache:
+    """
+    Token key -> (user, token, time of the lookup), least recently used
+    first out once ``max_size`` is reached.
+    """
+
+    def __init__(self, max_size, timeout):
+        self.max_size = max_size
+        self.timeout = timeout
+        self._entries = OrderedDict()
+        self._keys_by_user = {}
+        self._lock = threading.Lock()
+        # Moves on every invalidation, so a lookup that raced one is not cached
+        self.generation = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, user, token, looked_up = entry
+            if expires <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+        user, token = _detached(user), _detached(token)
+        token.user = user
+        return user, token, looked_up
+
+    def set(self, key, user, token, generation, looked_up=0):
+        """
+        Cache a lookup made at ``generation`` (and at ``looked_up``
+        nanoseconds), unless something was invalidated since.
+        """
+        with self._lock:
+            if generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (
+                time.monotonic() + self.timeout, _detached(user), _detached(token), looked_up,
+            )
+            self._keys_by_user.setdefault(user.pk, set()).add(key)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def forget_user(self, user_id):
+        with self._lock:
+            self.generation += 1
+            for key in list(self._keys_by_user.get(user_id, ())):
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._keys_by_user.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        _, user, _, _ = self._entries.pop(key)
+        keys = self._keys_by_user.get(user.pk)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_user[user.pk]
+
+
+def get_token_cache():
+    """The process-wide token cache."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            config = {**DEFAULT_TOKEN_CACHE, **getattr(settings, 'API_TOKEN_CACHE', {})}
+            _cache = TokenCache(config['MAX_SIZE'], config['TIMEOUT'])
+        return _cache
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """``TokenAuthentication`` answered from the process's token cache when it can."""
+
+    def authenticate_credentials(self, key):
+        tokens = get_token_cache()
+        cached = tokens.get(key)
+        if cached is not None:
+            user, token, looked_up = cached
+            revoked = cache.get(_revoked_key(user.pk))
+            if revoked is not None and revoked < looked_up:
+                return user, token
+        generation = tokens.generation
+        looked_up = time.time_ns()
+        # Rejects unknown tokens and inactive users; only valid ones are cached
+        user, token = super().authenticate_credentials(key)
+        # Nothing revoked yet (or the stamp was evicted): start the stamp before this lookup
+        cache.add(_revoked_key(user.pk), looked_up - 1, None)
+        tokens.set(key, user, token, generation, looked_up)
+        return user, token
+
+
+@receiver(setting_changed)
+def reset_token_cache(setting, **kwargs):
+    global _cache
+    if setting == 'API_TOKEN_CACHE':
+        _cache = None
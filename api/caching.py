@@ -0,0 +1,87 @@
+"""
+Response caching and conditional GETs for the public read endpoints.
+
+Advocate and specialization reads are cached whole, keyed by the
+normalised request URL and the versions of the data they show. The
+versions live in the shared cache (``CACHES``), and ``api.signals``
+replaces one once a change to that data commits, so every worker stops
+using the responses built from the old data at once. Each cached
+response carries an ETag over its content (and the views may add a
+Last-Modified date); a matching ``If-None-Match`` or
+``If-Modified-Since`` is answered with ``304 Not Modified``. Hits and
+304s cost no queries.
+"""
+
+import hashlib
+import json
+from calendar import timegm
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from book_my_advocate.versions import new_version
+
+RESPONSE_CACHE_TIMEOUT = 300
+
+
+def _version_key(scope):
+    return f'api:{scope}:version'
+
+
+def _versions(scopes):
+    return [cache.get_or_set(_version_key(scope), new_version, None) for scope in scopes]
+
+
+def bump(*scopes):
+    cache.set_many({_version_key(scope): new_version() for scope in scopes}, None)
+
+
+def invalidate(*scopes):
+    """
+    Drop the cached responses built on ``scopes`` once the current
+    transaction commits; bumping earlier would let a concurrent read cache
+    the old rows under the new version.
+    """
+    transaction.on_commit(lambda: bump(*scopes))
+
+
+def response_key(request, scopes):
+    """The cache key of a read: its URL with the query parameters sorted, under the scopes' versions."""
+    params = sorted((name, request.query_params.getlist(name)) for name in request.query_params)
+    url = json.dumps([request.build_absolute_uri(request.path), params])
+    version = '.'.join(str(version) for version in _versions(scopes))
+    return f'api:response:{version}:{hashlib.md5(url.encode()).hexdigest()}'
+
+
+def _entry(data, last_modified):
+    content = json.dumps(data, cls=JSONEncoder, sort_keys=True).encode()
+    return {
+        'data': data,
+        'etag': f'"{hashlib.md5(content).hexdigest()}"',
+        'last_modified': timegm(last_modified.utctimetuple()) if last_modified else None,
+    }
+
+
+def cached_response(request, scopes, build):
+    """
+    Serve a read from the cache, calling ``build()`` on a miss for the
+    serialized data and its Last-Modified datetime (or None). Answers
+    304 when the client's copy is current.
+    """
+    key = response_key(request, scopes)
+    entry = cache.get(key)
+    if entry is None:
+        entry = _entry(*build())
+        cache.set(key, entry, RESPONSE_CACHE_TIMEOUT)
+    response = Response(entry['data'], headers={'ETag': entry['etag']})
+    if entry['last_modified'] is not None:
+        response.headers['Last-Modified'] = http_date(entry['last_modified'])
+    # Clients may keep a copy, but must revalidate it before each use
+    patch_cache_control(response, no_cache=True)
+    return get_conditional_response(
+        request._request, etag=entry['etag'], last_modified=entry['last_modified'], response=response,
+    )
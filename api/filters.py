@@ -0,0 +1,14 @@
+import django_filters
+from django.utils.text import slugify
+from advocates.models import Advocate
+
+
+class AdvocateFilter(django_filters.FilterSet):
+    language = django_filters.CharFilter(method='filter_language')
+
+    class Meta:
+        model = Advocate
+        fields = ['experience', 'is_available', 'verified', 'language']
+
+    def filter_language(self, queryset, name, value):
+        return queryset.filter(spoken_languages__slug=slugify(value, allow_unicode=True))
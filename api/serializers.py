@@ -1,39 +1,276 @@
-from rest_framework import serializers
+from datetime import timedelta
+from django.utils import timezone
+from rest_framework import permissions, serializers
 from accounts.models import User
 from advocates.models import Advocate, Specialization
-from bookings.models import Booking, Review
+from bookings.models import Booking, RatingSummary, Review
+from bookings.slots import DEFAULT_DURATION, MAX_RANGE_DAYS
+from notifications.models import Notification
 
-class UserSerializer(serializers.ModelSerializer):
+MAX_BATCH_SIZE = 100
+
+
+def _lookup(prefix, source):
+    return prefix + source.replace('.', '__')
+
+
+def related_lookups(serializer, prefix=''):
+    """
+    The (select_related, prefetch_related) lookups that let ``serializer``
+    render an instance without further queries, derived from the fields
+    it will output: nested serializers, related fields, dotted sources,
+    plus any ``Meta.select_related`` / ``Meta.prefetch_related`` it
+    declares for fields (method fields, say) the walk cannot see into.
+    """
+    meta = getattr(serializer, 'Meta', None)
+    select = [prefix + lookup for lookup in getattr(meta, 'select_related', ())]
+    prefetch = [prefix + lookup for lookup in getattr(meta, 'prefetch_related', ())]
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        path = _lookup(prefix, field.source)
+        if isinstance(field, serializers.ListSerializer):
+            nested_select, nested_prefetch = related_lookups(field.child, path + '__')
+            prefetch += [path] + nested_select + nested_prefetch
+        elif isinstance(field, serializers.BaseSerializer):
+            nested_select, nested_prefetch = related_lookups(field, path + '__')
+            select += [path] + nested_select
+            prefetch += nested_prefetch
+        elif isinstance(field, serializers.ManyRelatedField):
+            prefetch.append(path)
+        elif isinstance(field, serializers.RelatedField) and not field.use_pk_only_optimization():
+            select.append(path)
+        elif '.' in field.source:
+            select.append(_lookup(prefix, field.source.rsplit('.', 1)[0]))
+    return list(dict.fromkeys(select)), list(dict.fromkeys(prefetch))
+
+
+def optimize_queryset(queryset, serializer):
+    """Apply the lookups ``serializer`` needs to ``queryset``."""
+    select, prefetch = related_lookups(serializer)
+    if select:
+        queryset = queryset.select_related(*select)
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
+
+
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    """
+    On reads, ``?fields=a,b`` keeps only those fields and ``?expand=`` lists
+    the nested relations to keep nested; with ``expand`` present, every
+    other nested relation is rendered as its primary key(s). ``?expand=``
+    alone gives a flat, ID-only representation. Applies to the serializer
+    a view is given the request for, not to the ones nested inside it.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method not in permissions.SAFE_METHODS:
+            return
+        params = request.query_params
+        if 'fields' in params:
+            wanted = set(params['fields'].split(','))
+            for name in list(self.fields):
+                if name not in wanted:
+                    self.fields.pop(name)
+        if 'expand' in params:
+            expand = set(params['expand'].split(','))
+            for name, field in list(self.fields.items()):
+                if isinstance(field, serializers.BaseSerializer) and name not in expand:
+                    self.fields[name] = self._flat_field(name, field)
+
+    @staticmethod
+    def _flat_field(name, field):
+        options = {'read_only': True}
+        if field.source != name:
+            options['source'] = field.source
+        if isinstance(field, serializers.ListSerializer):
+            return serializers.PrimaryKeyRelatedField(many=True, **options)
+        return serializers.PrimaryKeyRelatedField(**options)
+
+
+class BatchPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    A PrimaryKeyRelatedField that, when a batch view has loaded the
+    instances its items refer to (``load_batch_related``), resolves from
+    those instead of querying once per item.
+    """
+
+    def to_internal_value(self, data):
+        loaded = self.context.get('batch_related', {}).get(self.field_name)
+        if loaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return loaded[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+def load_batch_related(serializer, items):
+    """
+    The instances ``items`` (dicts of input data) refer to through the
+    BatchPrimaryKeyRelatedFields of ``serializer``, one query per field,
+    for the ``batch_related`` serializer context.
+    """
+    loaded = {}
+    for name, field in serializer.fields.items():
+        if not isinstance(field, BatchPrimaryKeyRelatedField):
+            continue
+        pks = set()
+        for item in items:
+            try:
+                pks.add(int(item[name]))
+            except (KeyError, TypeError, ValueError):
+                pass
+        loaded[name] = field.get_queryset().in_bulk(pks)
+    return loaded
+
+
+class UserSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'first_name', 'last_name', 'user_type', 'phone']
         read_only_fields = ['id']
 
-class SpecializationSerializer(serializers.ModelSerializer):
+class SpecializationSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Specialization
         fields = '__all__'
 
-class AdvocateSerializer(serializers.ModelSerializer):
+class AdvocateSerializer(DynamicFieldsModelSerializer):
     user = UserSerializer(read_only=True)
     specializations = SpecializationSerializer(many=True, read_only=True)
     
     class Meta:
         model = Advocate
-        fields = '__all__'
+        # Bookkeeping: the review running totals kept by bookings.ratings and
+        # the language index behind ``languages``
+        exclude = [
+            'rating_sum', 'professionalism_sum', 'communication_sum', 'expertise_sum', 'verified_reviews',
+            'spoken_languages',
+        ]
 
-class BookingSerializer(serializers.ModelSerializer):
+class BookingSerializer(DynamicFieldsModelSerializer):
     client = UserSerializer(read_only=True)
     advocate = AdvocateSerializer(read_only=True)
+    advocate_id = BatchPrimaryKeyRelatedField(
+        source='advocate', queryset=Advocate.objects.filter(verified=True), write_only=True
+    )
     
     class Meta:
         model = Booking
         fields = '__all__'
+    
+    def get_validators(self):
+        # A batch checks all its intervals, identical starts included, with one query
+        if 'batch_related' in self.context:
+            return []
+        return super().get_validators()
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(DynamicFieldsModelSerializer):
     client = UserSerializer(read_only=True)
     
     class Meta:
         model = Review
         fields = '__all__'
 
+class RatingSummarySerializer(serializers.ModelSerializer):
+    verified_count = serializers.IntegerField(read_only=True)
+    avg_professionalism = serializers.FloatField(read_only=True)
+    avg_communication = serializers.FloatField(read_only=True)
+    avg_expertise = serializers.FloatField(read_only=True)
+    histogram = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = RatingSummary
+        fields = ['verified_count', 'avg_professionalism', 'avg_communication', 'avg_expertise', 'histogram']
+    
+    def get_histogram(self, summary):
+        return [
+            {'stars': stars, 'count': count, 'percent': percent}
+            for stars, count, percent in summary.histogram()
+        ]
+
+
+class SlotQuerySerializer(serializers.Serializer):
+    """Validates the query string of the free-slot endpoints."""
+    start = serializers.DateField(required=False)
+    days = serializers.IntegerField(required=False, default=30, min_value=1, max_value=MAX_RANGE_DAYS)
+    duration = serializers.IntegerField(required=False, default=DEFAULT_DURATION, min_value=15, max_value=8 * 60)
+    
+    def validate(self, attrs):
+        attrs['start'] = attrs.get('start') or timezone.localdate()
+        attrs['end'] = attrs['start'] + timedelta(days=attrs['days'] - 1)
+        return attrs
+
+
+class FreeAdvocateQuerySerializer(serializers.Serializer):
+    """Validates ?date=&start=&duration=&specialization= for the free-advocate search."""
+    date = serializers.DateField()
+    start = serializers.TimeField()
+    duration = serializers.IntegerField(required=False, default=DEFAULT_DURATION, min_value=15, max_value=8 * 60)
+    specialization = serializers.IntegerField(required=False)
+    
+    def validate(self, attrs):
+        now = timezone.localtime()
+        if (attrs['date'], attrs['start']) < (now.date(), now.time()):
+            raise serializers.ValidationError('The requested time is in the past.')
+        return attrs
+
+
+class EarningsQuerySerializer(serializers.Serializer):
+    """Validates ?period=day|month&start=&end= for the earnings endpoint."""
+    MAX_DAYS = {'day': 366, 'month': 5 * 366}
+    
+    period = serializers.ChoiceField(choices=['day', 'month'], required=False, default='day')
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    
+    def validate(self, attrs):
+        attrs['end'] = attrs.get('end') or timezone.localdate()
+        attrs['start'] = attrs.get('start') or attrs['end'] - timedelta(days=29 if attrs['period'] == 'day' else 364)
+        if attrs['start'] > attrs['end']:
+            raise serializers.ValidationError('start must not be after end.')
+        if (attrs['end'] - attrs['start']).days >= self.MAX_DAYS[attrs['period']]:
+            raise serializers.ValidationError(f"Ask for at most {self.MAX_DAYS[attrs['period']]} days at a time.")
+        return attrs
+
+
+class EarningsSerializer(serializers.Serializer):
+    period = serializers.DateField()
+    payments = serializers.IntegerField()
+    earned = serializers.DecimalField(max_digits=12, decimal_places=2)
+    refunds = serializers.IntegerField()
+    refunded = serializers.DecimalField(max_digits=12, decimal_places=2)
+
+
+
+class NotificationSerializer(DynamicFieldsModelSerializer):
+    class Meta:
+        model = Notification
+        fields = ['id', 'notification_type', 'title', 'message', 'link', 'is_read', 'created_at']
+        read_only_fields = fields
+
+
+class NotificationReadSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=500)
+
+
+class BookingBatchSerializer(serializers.Serializer):
+    """Bookings to write in one transaction: items with an ``id`` update that booking, the rest create one."""
+    bookings = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=MAX_BATCH_SIZE)
+
+def serialize_slots(advocate_id, by_date):
+    return {
+        'advocate': advocate_id,
+        'slots': {
+            day.isoformat(): [slot.strftime('%H:%M') for slot in times]
+            for day, times in by_date.items()
+        },
+    }
@@ -0,0 +1,89 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+from accounts.models import User
+from advocates.models import Advocate, Specialization
+from advocates.signals import advocates_changed
+from . import caching
+from .authentication import revoke_user_tokens
+from .serializers import UserSerializer
+
+
+def touch_advocates(advocates):
+    """Move updated_at, the Last-Modified of the advocate API, when data shown with it changes."""
+    advocates.update(updated_at=timezone.now())
+    caching.invalidate('advocates')
+
+
+@receiver(post_save, sender=Advocate)
+@receiver(post_delete, sender=Advocate)
+def invalidate_advocates(sender, **kwargs):
+    caching.invalidate('advocates')
+
+
+@receiver(advocates_changed)
+def invalidate_changed_advocates(sender, **kwargs):
+    caching.invalidate('advocates')
+
+
+@receiver(m2m_changed, sender=Advocate.specializations.through)
+def touch_advocate_specializations(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        touch_advocates(Advocate.objects.filter(pk=instance.pk))
+    elif pk_set:
+        touch_advocates(Advocate.objects.filter(pk__in=pk_set))
+    else:
+        # A cleared specialization: its former advocates are unknown by now
+        caching.invalidate('advocates')
+
+
+@receiver(m2m_changed, sender=Advocate.spoken_languages.through)
+def invalidate_advocate_languages(sender, action, **kwargs):
+    # Languages are only synced right after the advocate's own save
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        caching.invalidate('advocates')
+
+
+def revoke_tokens(user_ids):
+    # At commit, so a lookup racing the change cannot cache what it read before
+    transaction.on_commit(lambda: [revoke_user_tokens(user_id) for user_id in user_ids])
+
+
+@receiver(post_delete, sender=Token)
+def revoke_deleted_token(sender, instance, **kwargs):
+    revoke_tokens([instance.user_id])
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def revoke_user_tokens_on_change(sender, instance, update_fields=None, **kwargs):
+    # A login only moves last_login; anything else may deactivate the user
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    revoke_tokens([instance.pk])
+
+
+@receiver(post_save, sender=User)
+def touch_advocate_user(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if raw or created or instance.user_type != 'advocate':
+        return
+    # Logins only save last_login, which the API does not show
+    if update_fields is not None and not set(update_fields) & set(UserSerializer.Meta.fields):
+        return
+    touch_advocates(Advocate.objects.filter(user=instance))
+
+
+@receiver(post_save, sender=Specialization)
+def touch_specialization_advocates(sender, instance, created, raw=False, **kwargs):
+    caching.invalidate('specializations')
+    if not raw and not created:
+        touch_advocates(instance.advocates.all())
+
+
+@receiver(post_delete, sender=Specialization)
+def invalidate_specializations(sender, **kwargs):
+    caching.invalidate('specializations')
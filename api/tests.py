@@ -1,3 +1,509 @@
+from datetime import date, time, timedelta
+from unittest import mock
+from django.core.cache import cache
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework.authtoken.models import Token
+from accounts.models import User
+from advocates.models import Advocate, AdvocateAvailability, Specialization
+from bookings.bitmaps import free_advocate_ids
+from bookings.models import Booking, Review
+from bookings.scheduling import save_bookings
+from testutils.factories import create_advocate, create_booking
+from notifications.fanout import write_notifications
+from notifications.models import Notification
+from .authentication import TokenCache, get_token_cache
 
-# Create your tests here.
+
+class AdvocateReviewsApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.advocate = create_advocate('reviewed')
+        cls.url = f'/api/advocates/{cls.advocate.id}/reviews/'
+        for i in range(25):
+            client = User.objects.create_user(username=f'client{i}', user_type='client')
+            booking = create_booking(
+                cls.advocate, client, date.today() - timedelta(days=1 + i), time(10, 0), status='completed'
+            )
+            Review.objects.create(
+                booking=booking, advocate=cls.advocate, client=client, rating=5 - i % 2, comment='Review',
+                professionalism=5, communication=4, expertise=3, is_verified=i != 24,
+            )
+
+    def test_pages_cost_a_fixed_number_of_queries(self):
+        seen = []
+        url = self.url + '?page_size=10'
+        while url:
+            # Advocate lookup plus one page of reviews joined with their clients
+            with self.assertNumQueries(2):
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            seen.extend(review['id'] for review in body['results'])
+            url = body['next']
+        expected = Review.objects.filter(advocate=self.advocate, is_verified=True).order_by('-created_at', '-id')
+        self.assertEqual(seen, list(expected.values_list('id', flat=True)))
+        self.assertIn('username', response.json()['results'][0]['client'])
+
+    def test_summary_only(self):
+        response = self.client.get(self.url, {'summary': 'true'})
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertNotIn('results', body)
+        self.assertEqual(body['verified_count'], 24)
+        self.assertEqual(body['avg_communication'], 4.0)
+        self.assertEqual(body['histogram'][:2], [
+            {'stars': 5, 'count': 12, 'percent': 50},
+            {'stars': 4, 'count': 12, 'percent': 50},
+        ])
+
+
+class NotificationApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.advocate = create_advocate('inbox')
+        cls.user = cls.advocate.user
+        cls.other = User.objects.create_user(username='bystander', user_type='client')
+        Notification.objects.bulk_create(
+            [
+                Notification(user=cls.user, notification_type='system', title=f'Note {i}', message='Hi', is_read=i < 5)
+                for i in range(25)
+            ]
+            + [Notification(user=cls.other, notification_type='system', title='Other', message='Hi')]
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def unread(self):
+        return self.client.get('/api/notifications/unread-count/').json()['unread']
+
+    def test_list_is_cursor_paginated_and_filterable(self):
+        seen = []
+        url = '/api/notifications/?page_size=10'
+        while url:
+            body = self.client.get(url).json()
+            seen.extend(notification['id'] for notification in body['results'])
+            url = body['next']
+        expected = Notification.objects.filter(user=self.user).order_by('-created_at', '-id')
+        self.assertEqual(seen, list(expected.values_list('id', flat=True)))
+
+        body = self.client.get('/api/notifications/', {'unread': 'true', 'page_size': 100}).json()
+        self.assertEqual(len(body['results']), 20)
+        self.assertFalse(any(notification['is_read'] for notification in body['results']))
+
+    # The tests' local-memory cache stands in for a shared one
+    @mock.patch('notifications.inbox._counters_shared', lambda: True)
+    def test_unread_count_comes_from_the_cached_counter(self):
+        self.assertEqual(self.unread(), 20)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.unread(), 20)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+        # New notifications drop the counter; it is recounted once
+        booking = create_booking(self.advocate, self.other, date.today() + timedelta(days=1), time(10, 0))
+        write_notifications([('booking_created', booking.id)])
+        self.assertEqual(self.unread(), 21)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.unread(), 21)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries))
+
+    def test_unread_count_is_counted_without_a_shared_cache(self):
+        self.assertEqual(self.unread(), 20)
+        # As another worker would, out of reach of this process's cache
+        read = Notification.objects.filter(user=self.user, is_read=False).values_list('pk', flat=True)[:2]
+        Notification.objects.filter(pk__in=list(read)).update(is_read=True)
+        self.assertEqual(self.unread(), 18)
+
+    @mock.patch('notifications.inbox._counters_shared', lambda: True)
+    def test_mark_read_and_mark_all_read_are_single_updates(self):
+        self.assertEqual(self.unread(), 20)
+        unread_ids = list(Notification.objects.filter(user=self.user, is_read=False).values_list('id', flat=True))
+        other_id = Notification.objects.get(user=self.other).id
+
+        # Session, user, one UPDATE, then the recount of the dropped counter
+        with self.assertNumQueries(4):
+            response = self.client.post(
+                '/api/notifications/read/', {'ids': unread_ids[:3] + [other_id]}, content_type='application/json',
+            )
+        self.assertEqual(response.json(), {'updated': 3, 'unread': 17})
+
+        with self.assertNumQueries(3):
+            response = self.client.post('/api/notifications/read-all/')
+        self.assertEqual(response.json(), {'updated': 17, 'unread': 0})
+        self.assertEqual(self.unread(), 0)
+        self.assertFalse(Notification.objects.get(pk=other_id).is_read)
+
+        response = self.client.post('/api/notifications/read/', {'ids': []}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+
+class ApiQueryCountTests(TestCase):
+    """Every list page costs the same number of queries, however many rows it shows."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='counted', user_type='client')
+        specializations = [
+            Specialization.objects.create(name=f'Law {i}', description='Law') for i in range(3)
+        ]
+        for i in range(12):
+            advocate = create_advocate(f'counted{i}')
+            advocate.specializations.set(specializations[:1 + i % 3])
+            create_booking(advocate, cls.client_user, date.today() + timedelta(days=1 + i), time(10, 0))
+
+    def setUp(self):
+        # Start from an empty response cache
+        cache.clear()
+
+    def get(self, url, queries, **params):
+        with self.assertNumQueries(queries):
+            response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_advocates(self):
+        # Count, page (joined with users), specializations
+        body = self.get('/api/advocates/', 3)
+        self.assertEqual(len(body['results']), 10)
+        self.assertEqual(body['results'][0]['user']['username'][:7], 'counted')
+        self.get(f"/api/advocates/{body['results'][0]['id']}/", 2)
+
+    def test_advocates_hide_the_review_running_totals(self):
+        advocate = self.get('/api/advocates/', 3)['results'][0]
+        self.assertIn('rating', advocate)
+        self.assertIn('languages', advocate)
+        for field in [
+            'rating_sum', 'professionalism_sum', 'communication_sum', 'expertise_sum', 'verified_reviews',
+            'spoken_languages',
+        ]:
+            self.assertNotIn(field, advocate)
+
+    def test_specializations(self):
+        self.assertEqual(len(self.get('/api/specializations/', 2)['results']), 3)
+
+    def test_bookings(self):
+        self.client.force_login(self.client_user)
+        # Session and user, then count, page (joined with client, advocate and its
+        # user) and the advocates' specializations
+        body = self.get('/api/bookings/', 5)
+        self.assertEqual(len(body['results']), 10)
+        self.assertIn('specializations', body['results'][0]['advocate'])
+        self.get(f"/api/bookings/{body['results'][0]['id']}/", 4)
+
+    def test_bookings_flat_and_field_selected(self):
+        self.client.force_login(self.client_user)
+        booking = self.get('/api/bookings/', 4, expand='')['results'][0]
+        self.assertIsInstance(booking['advocate'], int)
+        self.assertIsInstance(booking['client'], int)
+        self.assertIn('case_description', booking)
+
+        booking = self.get('/api/bookings/', 4, fields='id,status,advocate', expand='')['results'][0]
+        self.assertEqual(set(booking), {'id', 'status', 'advocate'})
+
+        booking = self.get('/api/bookings/', 5, fields='id,advocate', expand='advocate')['results'][0]
+        self.assertEqual(booking['advocate']['user']['username'][:7], 'counted')
+
+    def test_notifications(self):
+        user = User.objects.get(username='counted0')
+        Notification.objects.bulk_create(
+            [Notification(user=user, notification_type='system', title='Hi', message='Hi') for _ in range(15)]
+        )
+        self.client.force_login(user)
+        self.assertEqual(len(self.get('/api/notifications/', 3)['results']), 15)
+
+
+class ApiResponseCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.family = Specialization.objects.create(name='Family Law', description='Family')
+        cls.advocate = create_advocate('cached')
+        cls.advocate.specializations.set([cls.family])
+        cls.url = f'/api/advocates/{cls.advocate.id}/'
+
+    def setUp(self):
+        cache.clear()
+
+    def get(self, url, queries, **headers):
+        with self.assertNumQueries(queries):
+            return self.client.get(url, headers=headers)
+
+    def test_repeat_reads_are_served_from_the_cache(self):
+        first = self.get('/api/specializations/?page=1&ordering=name', 2)
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(first['Cache-Control'], 'no-cache')
+        # The same parameters in another order hit the same entry
+        second = self.get('/api/specializations/?ordering=name&page=1', 0)
+        self.assertEqual(second.json(), first.json())
+        self.assertEqual(second['ETag'], first['ETag'])
+
+        not_modified = self.get('/api/specializations/?page=1&ordering=name', 0, if_none_match=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], first['ETag'])
+        self.assertEqual(self.get('/api/specializations/?page=2', 1).status_code, 404)
+
+    def test_saving_a_specialization_invalidates_both_endpoints(self):
+        specializations = self.get('/api/specializations/', 2)
+        advocate = self.get(self.url, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.family.name = 'Family and Divorce Law'
+            self.family.save()
+
+        response = self.get('/api/specializations/', 2, if_none_match=specializations['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['name'], 'Family and Divorce Law')
+        response = self.get(self.url, 2, if_none_match=advocate['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['specializations'][0]['name'], 'Family and Divorce Law')
+
+    def test_advocate_last_modified(self):
+        # Back far enough that a later change shows in the one-second resolution
+        Advocate.objects.filter(pk=self.advocate.pk).update(updated_at=timezone.now() - timedelta(seconds=5))
+        self.advocate.refresh_from_db()
+        response = self.get(self.url, 2)
+        self.assertEqual(response['Last-Modified'], http_date(self.advocate.updated_at.timestamp()))
+        self.assertEqual(self.get(self.url, 0, if_modified_since=response['Last-Modified']).status_code, 304)
+
+        # Renaming the advocate's user moves updated_at on
+        with self.captureOnCommitCallbacks(execute=True):
+            self.advocate.user.first_name = 'Renamed'
+            self.advocate.user.save()
+        response = self.get(self.url, 2, if_modified_since=response['Last-Modified'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['user']['first_name'], 'Renamed')
+
+    def test_logins_and_rating_updates(self):
+        listed = self.get('/api/advocates/', 3)
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            self.advocate.user.last_login = timezone.now()
+            self.advocate.user.save(update_fields=['last_login'])
+        self.assertEqual(callbacks, [])
+        self.assertEqual(self.get('/api/advocates/', 0, if_none_match=listed['ETag']).status_code, 304)
+
+        # A review adjusts the rating with a bulk UPDATE, bypassing the Advocate signals
+        client = User.objects.create_user(username='reviewer', user_type='client')
+        booking = create_booking(self.advocate, client, date.today() - timedelta(days=1), time(10, 0), status='completed')
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(
+                booking=booking, advocate=self.advocate, client=client, rating=4, comment='Good',
+                professionalism=4, communication=4, expertise=4,
+            )
+        response = self.get('/api/advocates/', 3, if_none_match=listed['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0]['rating'], '4.00')
+
+
+# The unread count in the budgets below is the cached counter
+@mock.patch('notifications.inbox._counters_shared', lambda: True)
+class CachedTokenAuthenticationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(username='tokened', user_type='client')
+        cls.token = Token.objects.create(user=cls.user)
+
+    def setUp(self):
+        get_token_cache().clear()
+        cache.clear()
+
+    def get(self, queries, key=None):
+        with self.assertNumQueries(queries):
+            return self.client.get('/api/notifications/unread-count/', headers={
+                'Authorization': f'Token {key or self.token.key}',
+            })
+
+    def test_hits_skip_the_token_query(self):
+        # Token joined with its user, then the unread count
+        self.assertEqual(self.get(2).json(), {'unread': 0})
+        response = self.get(0)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.wsgi_request.user, self.user)
+        self.assertEqual(self.get(1, key='0' * 40).status_code, 401)
+
+    def test_deleted_tokens_and_deactivated_users_are_dropped(self):
+        self.get(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.get(1).status_code, 401)
+
+        self.user.is_active = True
+        self.user.save()
+        self.get(1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.token.delete()
+        self.assertEqual(self.get(1).status_code, 401)
+
+    def test_revocations_reach_other_workers(self):
+        self.get(2)
+        # Another worker deactivates the user: only the shared stamp moves here
+        with mock.patch.object(get_token_cache(), 'forget_user'), self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(len(get_token_cache()), 1)
+        self.assertEqual(self.get(1).status_code, 401)
+
+    def test_missing_stamp_refuses_the_entry(self):
+        self.get(2)
+        cache.clear()
+        self.get(2)
+        self.get(0)
+
+    def test_logins_keep_the_entry(self):
+        self.get(2)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.last_login = timezone.now()
+            self.user.save(update_fields=['last_login'])
+        self.get(0)
+
+    def test_lru_and_timeout(self):
+        tokens = TokenCache(max_size=2, timeout=60)
+        users = [User(pk=i, username=f'lru{i}') for i in range(3)]
+        for user in users[:2]:
+            tokens.set(f'key{user.pk}', user, Token(key=f'key{user.pk}', user=user), tokens.generation)
+        tokens.get('key0')
+        tokens.set('key2', users[2], Token(key='key2', user=users[2]), tokens.generation)
+        # key1 was the least recently used
+        self.assertIsNone(tokens.get('key1'))
+        self.assertEqual(tokens.get('key0')[0].username, 'lru0')
+        self.assertEqual(len(tokens), 2)
+
+        # A lookup that raced an invalidation is not cached
+        generation = tokens.generation
+        tokens.forget_user(2)
+        tokens.set('key2', users[2], Token(key='key2', user=users[2]), generation)
+        self.assertIsNone(tokens.get('key2'))
+
+        expired = TokenCache(max_size=2, timeout=0)
+        expired.set('key0', users[0], Token(key='key0', user=users[0]), expired.generation)
+        self.assertIsNone(expired.get('key0'))
+
+
+class BookingBatchApiTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='partner', user_type='client')
+        cls.other_client = User.objects.create_user(username='other', user_type='client')
+        cls.day = date.today() + timedelta(days=2)
+        cls.advocates = [create_advocate(f'batched{i}') for i in range(3)]
+        for advocate in cls.advocates:
+            AdvocateAvailability.objects.create(
+                advocate=advocate, day_of_week=cls.day.weekday(), start_time=time(9, 0), end_time=time(17, 0),
+            )
+        cls.existing = create_booking(cls.advocates[0], cls.client_user, cls.day, time(10, 0))
+        cls.others = create_booking(cls.advocates[1], cls.other_client, cls.day, time(10, 0))
+
+    def setUp(self):
+        self.client.force_login(self.client_user)
+
+    def item(self, advocate, hour, minute=0, **extra):
+        return {
+            'advocate_id': advocate.id, 'service_type': 'consultation', 'booking_date': self.day.isoformat(),
+            'booking_time': f'{hour:02}:{minute:02}', 'case_description': 'Case', 'case_type': 'Civil',
+            'total_fee': '500.00', **extra,
+        }
+
+    def post(self, items):
+        return self.client.post('/api/bookings/batch/', {'bookings': items}, content_type='application/json')
+
+    def test_batch_reads(self):
+        ids = [self.advocates[2].id, 0, self.advocates[0].id]
+        # Session and user, the advocates, then their specializations
+        with self.assertNumQueries(4):
+            body = self.client.get('/api/advocates/batch/', {'ids': ','.join(map(str, ids))}).json()
+        self.assertEqual([advocate['id'] for advocate in body['results']], [ids[0], ids[2]])
+        self.assertEqual(body['missing'], [0])
+
+        # Other clients' bookings are missing too
+        body = self.client.get('/api/bookings/batch/', {'ids': f'{self.others.id},{self.existing.id}'}).json()
+        self.assertEqual([booking['id'] for booking in body['results']], [self.existing.id])
+        self.assertEqual(body['missing'], [self.others.id])
+        self.assertEqual(self.client.get('/api/bookings/batch/', {'ids': 'x'}).status_code, 400)
+
+    def test_creates_and_updates_in_one_call(self):
+        # Build the day's bitmaps, which bulk writes must keep in step
+        self.assertEqual(free_advocate_ids([self.advocates[1].id], self.day, time(14, 0), 60), [self.advocates[1].id])
+        items = [
+            self.item(self.advocates[0], 11),
+            self.item(self.advocates[0], 12),
+            self.item(self.advocates[1], 14),
+            {'id': self.existing.id, 'booking_time': '16:00', 'notes': 'Moved'},
+        ]
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.post(items)
+        self.assertEqual(response.status_code, 201, response.json())
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['created', 'created', 'created', 'updated'])
+        self.assertEqual(results[3]['booking']['booking_time'], '16:00:00')
+        self.assertEqual(results[0]['booking']['client']['username'], 'partner')
+        self.assertEqual(Booking.objects.filter(client=self.client_user).count(), 4)
+        self.assertEqual(Booking.objects.get(pk=self.existing.pk).notes, 'Moved')
+        self.assertEqual(free_advocate_ids([self.advocates[1].id], self.day, time(14, 0), 60), [])
+        # The three new bookings notify in one go
+        self.assertEqual(len(callbacks), 1)
+
+    def test_updates_write_only_each_items_fields(self):
+        moved = create_booking(self.advocates[0], self.client_user, self.day, time(14, 0))
+        items = [
+            {'id': self.existing.id, 'status': 'confirmed'},
+            {'id': moved.id, 'booking_time': '15:00'},
+        ]
+        # Paid by a webhook between the batch reading the bookings and writing them
+        original = save_bookings
+
+        def pay_first(bookings, fields, **kwargs):
+            Booking.objects.filter(pk=moved.pk).update(status='confirmed', payment_status='paid')
+            return original(bookings, fields, **kwargs)
+
+        with mock.patch('api.views.save_bookings', pay_first):
+            self.assertEqual(self.post(items).status_code, 200)
+        self.assertEqual(
+            list(Booking.objects.filter(pk__in=[self.existing.pk, moved.pk]).order_by('pk').values_list(
+                'status', 'booking_time', 'payment_status',
+            )),
+            [('confirmed', time(10, 0), 'pending'), ('confirmed', time(15, 0), 'paid')],
+        )
+
+    def test_queries_do_not_grow_with_the_batch(self):
+        def count(items):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.post(items).status_code, 201)
+            return len(queries)
+
+        # The first write of an advocate-day creates its lock row
+        count([self.item(self.advocates[2], 9)])
+        # Session and user, the advocates referred to, then in a savepoint the
+        # day lock, the day's bookings, the insert and the bitmap refresh,
+        # and last the written bookings with specializations
+        self.assertEqual(count([self.item(self.advocates[2], 10)]), 11)
+        self.assertEqual(count([self.item(self.advocates[2], hour) for hour in range(11, 17)]), 11)
+
+    def test_conflicts_write_nothing(self):
+        response = self.post([
+            self.item(self.advocates[2], 11),
+            self.item(self.advocates[0], 10, 30),
+            self.item(self.advocates[2], 11, 30),
+        ])
+        self.assertEqual(response.status_code, 409)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['skipped', 'conflict', 'conflict'])
+        self.assertEqual(results[1]['conflict']['conflicts'], [{'start': '10:00', 'end': '11:00'}])
+        self.assertEqual(results[2]['conflict']['conflicts'], [{'start': '11:00', 'end': '12:00'}])
+        self.assertEqual(Booking.objects.count(), 2)
+
+    def test_invalid_items_write_nothing(self):
+        response = self.post([
+            self.item(self.advocates[2], 11),
+            self.item(self.advocates[2], 13, advocate_id=0),
+            {'id': self.others.id, 'notes': 'Not mine'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        results = response.json()['results']
+        self.assertEqual([result['status'] for result in results], ['skipped', 'invalid', 'invalid'])
+        self.assertIn('advocate_id', results[1]['errors'])
+        self.assertEqual(results[2]['errors'], {'id': ['Not found.']})
+        self.assertEqual(Booking.objects.count(), 2)
+        self.assertEqual(self.post([]).status_code, 400)
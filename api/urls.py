@@ -1,12 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from rest_framework.authtoken.views import obtain_auth_token
-from .views import AdvocateViewSet, SpecializationViewSet, BookingViewSet
+from .views import AdvocateViewSet, SpecializationViewSet, BookingViewSet, EarningsViewSet, NotificationViewSet
 
 router = DefaultRouter()
 router.register(r'advocates', AdvocateViewSet)
 router.register(r'specializations', SpecializationViewSet)
 router.register(r'bookings', BookingViewSet, basename='booking')
+router.register(r'earnings', EarningsViewSet, basename='earnings')
+router.register(r'notifications', NotificationViewSet, basename='notification')
 
 urlpatterns = [
     path('', include(router.urls)),
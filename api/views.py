@@ -1,34 +1,193 @@
-from rest_framework import viewsets, permissions, filters
+from rest_framework import viewsets, permissions, filters, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.pagination import CursorPagination
 from rest_framework.response import Response
+from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from advocates.models import Advocate, Specialization
-from bookings.models import Booking, Review
+from bookings.models import Booking, RatingSummary, Review
+from bookings.bitmaps import free_advocate_ids
+from bookings.scheduling import BookingConflict, BookingConflicts, book_slot, save_bookings
+from bookings.slots import free_slots
+from notifications import inbox
+from notifications.fanout import notify
+from notifications.signals import STATUS_EVENTS
+from notifications.models import Notification
+from payments.earnings import earnings_by_period
+from . import caching
+from .filters import AdvocateFilter
 from .serializers import (
     AdvocateSerializer, SpecializationSerializer,
-    BookingSerializer, ReviewSerializer
+    BookingSerializer, ReviewSerializer, RatingSummarySerializer,
+    SlotQuerySerializer, FreeAdvocateQuerySerializer, serialize_slots,
+    EarningsQuerySerializer, EarningsSerializer,
+    NotificationSerializer, NotificationReadSerializer, optimize_queryset,
+    BookingBatchSerializer, MAX_BATCH_SIZE, load_batch_related,
 )
 
-class AdvocateViewSet(viewsets.ModelViewSet):
+MAX_SLOT_ADVOCATES = 50
+
+
+class BookingConflictError(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_code = 'booking_conflict'
+    
+    def __init__(self, conflict):
+        super().__init__(conflict.message, self.default_code)
+        # Keep the structured payload as-is instead of coercing it to strings
+        self.detail = conflict.as_dict()
+
+def parse_ids(request, limit, noun):
+    """The ids in ?ids=1,2,3; 400 unless there are between 1 and ``limit``."""
+    try:
+        ids = [int(pk) for pk in request.query_params.get('ids', '').split(',') if pk]
+    except ValueError:
+        raise ValidationError({'ids': ['Expected a comma separated list of ids.']})
+    if not ids or len(ids) > limit:
+        raise ValidationError({'ids': [f'Pass between 1 and {limit} {noun} ids.']})
+    return list(dict.fromkeys(ids))
+
+def retrieve_batch(view, request, noun):
+    """Many instances by id in one request, in the order asked; ids not found or not visible are listed as missing."""
+    ids = parse_ids(request, MAX_BATCH_SIZE, noun)
+    serializer = view.get_serializer()
+    found = optimize_queryset(view.get_queryset().filter(id__in=ids), serializer).in_bulk()
+    return Response({
+        'results': view.get_serializer([found[pk] for pk in ids if pk in found], many=True).data,
+        'missing': [pk for pk in ids if pk not in found],
+    })
+
+class OptimizedQuerysetMixin:
+    """
+    Adds the select_related/prefetch_related the serializer needs for the
+    fields this request renders, so a page costs a fixed number of queries.
+    Custom actions that serialize something else optimize for themselves.
+    """
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action in ('list', 'retrieve'):
+            queryset = optimize_queryset(queryset, self.get_serializer())
+        return queryset
+
+class CachedReadMixin:
+    """
+    Serves list and retrieve through the response cache with an ETag, and
+    304 for clients whose copy is current (see ``api.caching``).
+    ``cache_scopes`` names the version counters the responses depend on.
+    """
+    cache_scopes = ()
+    
+    def list(self, request, *args, **kwargs):
+        parent = super().list
+        return caching.cached_response(
+            request, self.cache_scopes, lambda: (parent(request, *args, **kwargs).data, None)
+        )
+    
+    def retrieve(self, request, *args, **kwargs):
+        def build():
+            instance = self.get_object()
+            return self.get_serializer(instance).data, self.get_last_modified(instance)
+        return caching.cached_response(request, self.cache_scopes, build)
+    
+    def get_last_modified(self, instance):
+        """The Last-Modified date of a retrieved instance, if it has one."""
+        return None
+
+class ReviewCursorPagination(CursorPagination):
+    """Newest first; the cursor stays stable while new reviews arrive."""
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+class AdvocateViewSet(CachedReadMixin, OptimizedQuerysetMixin, viewsets.ModelViewSet):
     queryset = Advocate.objects.filter(verified=True)
     serializer_class = AdvocateSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
-    filterset_fields = ['experience', 'is_available', 'verified']
+    filterset_class = AdvocateFilter
     search_fields = ['user__first_name', 'user__last_name', 'bio']
     ordering_fields = ['rating', 'total_cases', 'consultation_fee']
+    # Advocates are shown with their specializations
+    cache_scopes = ('advocates', 'specializations')
     
-    @action(detail=True, methods=['get'])
+    def get_last_modified(self, advocate):
+        # api.signals touches updated_at when the user or specializations shown with it change
+        return advocate.updated_at
+    
+    @action(detail=True, methods=['get'], pagination_class=ReviewCursorPagination)
     def reviews(self, request, pk=None):
+        """Verified reviews, newest first and cursor paginated; ?summary=true for the breakdown only"""
         advocate = self.get_object()
-        reviews = Review.objects.filter(advocate=advocate, is_verified=True)
-        serializer = ReviewSerializer(reviews, many=True)
-        return Response(serializer.data)
+        if request.query_params.get('summary') in ('1', 'true'):
+            summary = RatingSummary.objects.filter(advocate=advocate).first() or RatingSummary(advocate=advocate)
+            return Response(RatingSummarySerializer(summary).data)
+        context = self.get_serializer_context()
+        reviews = optimize_queryset(
+            Review.objects.filter(advocate=advocate, is_verified=True), ReviewSerializer(context=context)
+        )
+        page = self.paginate_queryset(reviews)
+        serializer = ReviewSerializer(page, many=True, context=context)
+        return self.get_paginated_response(serializer.data)
+    
+    @action(detail=True, methods=['get'])
+    def slots(self, request, pk=None):
+        """Free slots for one advocate: ?start=YYYY-MM-DD&days=30&duration=60"""
+        advocate = self.get_object()
+        query = SlotQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        slots = free_slots([advocate.id], params['start'], params['end'], params['duration'])
+        data = serialize_slots(advocate.id, slots[advocate.id])
+        data.update(start=params['start'], end=params['end'], duration=params['duration'])
+        return Response(data)
+    
+    @action(detail=False, methods=['get'], url_path='slots')
+    def bulk_slots(self, request):
+        """Free slots for many advocates: ?ids=1,2,3 plus the slots parameters"""
+        ids = parse_ids(request, MAX_SLOT_ADVOCATES, 'advocate')
+        query = SlotQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        ids = list(self.get_queryset().filter(id__in=ids).values_list('id', flat=True))
+        slots = free_slots(ids, params['start'], params['end'], params['duration'])
+        return Response({
+            'start': params['start'],
+            'end': params['end'],
+            'duration': params['duration'],
+            'results': [serialize_slots(advocate_id, slots[advocate_id]) for advocate_id in ids],
+        })
 
-class SpecializationViewSet(viewsets.ReadOnlyModelViewSet):
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """Many advocates by id: ?ids=1,2,3"""
+        return retrieve_batch(self, request, 'advocate')
+
+    @action(detail=False, methods=['get'])
+    def free(self, request):
+        """Advocates free for a whole window: ?date=&start=HH:MM&duration=60&specialization="""
+        query = FreeAdvocateQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        candidates = self.get_queryset().filter(is_available=True)
+        if params.get('specialization'):
+            candidates = candidates.filter(specializations__id=params['specialization'])
+        ids = free_advocate_ids(
+            candidates.values_list('id', flat=True), params['date'], params['start'], params['duration']
+        )
+        advocates = optimize_queryset(
+            self.get_queryset().filter(id__in=ids).order_by('-rating', '-total_cases'), self.get_serializer()
+        )
+        page = self.paginate_queryset(advocates)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+class SpecializationViewSet(CachedReadMixin, OptimizedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
     queryset = Specialization.objects.all()
     serializer_class = SpecializationSerializer
+    cache_scopes = ('specializations',)
 
-class BookingViewSet(viewsets.ModelViewSet):
+class BookingViewSet(OptimizedQuerysetMixin, viewsets.ModelViewSet):
     serializer_class = BookingSerializer
     permission_classes = [permissions.IsAuthenticated]
     
@@ -41,5 +200,167 @@ class BookingViewSet(viewsets.ModelViewSet):
         return Booking.objects.all()
     
     def perform_create(self, serializer):
-        serializer.save(client=self.request.user)
+        self._save_in_slot(serializer, client=self.request.user)
+    
+    def perform_update(self, serializer):
+        self._save_in_slot(serializer)
+    
+    def _save_in_slot(self, serializer, **extra):
+        """Save under the advocate-day lock, rejecting overlapping bookings with 409."""
+        data = serializer.validated_data
+        instance = serializer.instance
+        if data.get('status', getattr(instance, 'status', None)) == 'cancelled':
+            serializer.save(**extra)
+            return
+        advocate = data.get('advocate') or instance.advocate
+        booking_date = data.get('booking_date') or instance.booking_date
+        booking_time = data.get('booking_time') or instance.booking_time
+        duration = data.get('duration') or (instance.duration if instance else Booking._meta.get_field('duration').default)
+        try:
+            book_slot(
+                lambda: serializer.save(**extra), advocate.id, booking_date, booking_time, duration,
+                exclude_id=instance.pk if instance else None,
+            )
+        except BookingConflict as conflict:
+            raise BookingConflictError(conflict)
+    
+    @action(detail=False, methods=['get'])
+    def batch(self, request):
+        """Many bookings by id: ?ids=1,2,3"""
+        return retrieve_batch(self, request, 'booking')
+    
+    @batch.mapping.post
+    def write_batch(self, request):
+        """
+        Create and update bookings in one transaction: {"bookings": [...]},
+        where items with an "id" update that booking. All or nothing; the
+        results report on each item in order.
+        """
+        batch = BookingBatchSerializer(data=request.data)
+        batch.is_valid(raise_exception=True)
+        items = batch.validated_data['bookings']
+        context = self.get_serializer_context()
+        context['batch_related'] = load_batch_related(self.get_serializer(), items)
+        existing = self.get_queryset().in_bulk(
+            {pk for pk in (item.get('id') for item in items) if isinstance(pk, int)}
+        )
+        
+        bookings, errors, fields, previous_status = [], {}, {}, {}
+        for position, item in enumerate(items):
+            if 'id' in item:
+                instance = existing.get(item['id'])
+                if instance is None:
+                    errors[position] = {'id': ['Not found.']}
+                    continue
+                if instance.pk in previous_status:
+                    errors[position] = {'id': ['Listed more than once.']}
+                    continue
+                previous_status[instance.pk] = instance.status
+                serializer = self.get_serializer(instance, data=item, partial=True, context=context)
+            else:
+                serializer = self.get_serializer(data=item, context=context)
+            if not serializer.is_valid():
+                errors[position] = serializer.errors
+                continue
+            if serializer.instance is None:
+                booking = Booking(client=request.user, **serializer.validated_data)
+            else:
+                booking = serializer.instance
+                for name, value in serializer.validated_data.items():
+                    setattr(booking, name, value)
+                # Only the item's own fields: the others may have moved since they were read
+                fields[booking.pk] = list(serializer.validated_data)
+            bookings.append((position, booking))
+        if errors:
+            return self._batch_failed(items, errors, 'invalid', status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            save_bookings([booking for _, booking in bookings], fields)
+        except BookingConflicts as exc:
+            conflicts = {bookings[index][0]: conflict.as_dict() for index, conflict in exc.conflicts.items()}
+            return self._batch_failed(items, conflicts, 'conflict', status.HTTP_409_CONFLICT)
+        
+        # bulk writes skip the signals that notify
+        notify('booking_created', [booking.pk for _, booking in bookings if booking.pk not in previous_status])
+        for booking_status, event in STATUS_EVENTS.items():
+            notify(event, [
+                booking.pk for _, booking in bookings
+                if booking.status == booking_status and previous_status.get(booking.pk) not in (None, booking_status)
+            ])
+        saved = optimize_queryset(
+            Booking.objects.filter(id__in=[booking.pk for _, booking in bookings]), self.get_serializer()
+        ).in_bulk()
+        results = [
+            {
+                'status': 'updated' if booking.pk in previous_status else 'created',
+                'booking': self.get_serializer(saved[booking.pk]).data,
+            }
+            for _, booking in bookings
+        ]
+        created = len(results) > len(previous_status)
+        return Response({'results': results}, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+    
+    @staticmethod
+    def _batch_failed(items, failures, kind, status_code):
+        """Nothing was written: report the failed items, and the rest as skipped."""
+        key = 'errors' if kind == 'invalid' else 'conflict'
+        return Response({
+            'results': [
+                {'status': kind, key: failures[position]} if position in failures else {'status': 'skipped'}
+                for position in range(len(items))
+            ],
+        }, status=status_code)
 
+class EarningsViewSet(viewsets.ViewSet):
+    """Earnings of the requesting advocate from the daily rollups: ?period=day|month&start=&end="""
+    permission_classes = [permissions.IsAuthenticated]
+    
+    def list(self, request):
+        advocate = get_object_or_404(Advocate, user=request.user)
+        query = EarningsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params = query.validated_data
+        rows = earnings_by_period(advocate.id, params['start'], params['end'], params['period'])
+        return Response({
+            'period': params['period'],
+            'start': params['start'],
+            'end': params['end'],
+            'results': EarningsSerializer(rows, many=True).data,
+        })
+
+class NotificationCursorPagination(CursorPagination):
+    ordering = ('-created_at', '-id')
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+class NotificationViewSet(OptimizedQuerysetMixin, viewsets.ReadOnlyModelViewSet):
+    """The requesting user's notifications, newest first; ?unread=true for unread ones only"""
+    serializer_class = NotificationSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = NotificationCursorPagination
+    filter_backends = []
+    
+    def get_queryset(self):
+        notifications = Notification.objects.filter(user=self.request.user)
+        if self.request.query_params.get('unread') in ('1', 'true'):
+            notifications = notifications.filter(is_read=False)
+        return notifications
+    
+    @action(detail=False, methods=['get'], url_path='unread-count')
+    def unread_count(self, request):
+        """Served from the cached per-user counter, for the navbar to poll"""
+        return Response({'unread': inbox.unread_count(request.user.id)})
+    
+    @action(detail=False, methods=['post'])
+    def read(self, request):
+        """Mark the notifications in {"ids": [...]} read"""
+        serializer = NotificationReadSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        updated = inbox.mark_read(request.user.id, serializer.validated_data['ids'])
+        return Response({'updated': updated, 'unread': inbox.unread_count(request.user.id)})
+    
+    @action(detail=False, methods=['post'], url_path='read-all')
+    def read_all(self, request):
+        updated = inbox.mark_all_read(request.user.id)
+        return Response({'updated': updated, 'unread': 0})
@@ -0,0 +1,25 @@
+"""
+Race-safe running totals.
+
+Counter rows (earnings rollups, rating summaries) are only ever changed
+with ``UPDATE ... SET x = x + n``. The first write for a key has no row
+to update yet, so it inserts one; when two writers both find no row, the
+loser's insert hits the unique constraint and it falls back to the UPDATE.
+"""
+
+from django.db import IntegrityError, transaction
+
+
+def increment_or_create(rows, updates, **values):
+    """
+    Apply the F() ``updates`` to ``rows`` (a queryset matching at most one
+    row), or create that row from ``values`` if it does not exist yet.
+    """
+    if rows.update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            rows.model.objects.create(**values)
+    except IntegrityError:
+        # Created concurrently; apply the increment to that row instead
+        rows.update(**updates)
@@ -0,0 +1,179 @@
+"""
+Keyset (cursor) pagination for the HTML views.
+
+Unlike OFFSET paging, each page is fetched with a ``WHERE (sort key) <
+(last row's sort key)`` filter, so page N costs the same as page 1 however
+deep the listing goes. Cursors are opaque url-safe strings.
+"""
+
+import base64
+import datetime
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+
+
+class CursorEncoder(DjangoJSONEncoder):
+    """Keeps microseconds, which DjangoJSONEncoder drops: a cursor cut to
+    the millisecond would skip rows between the cut and the real value."""
+
+    def default(self, o):
+        if isinstance(o, (datetime.datetime, datetime.time)):
+            return o.isoformat()
+        return super().default(o)
+
+
+def encode_cursor(values):
+    raw = json.dumps(values, cls=CursorEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Return the list of values in ``cursor``, or None if it is missing or invalid."""
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (ValueError, TypeError):
+        return None
+    return values if isinstance(values, list) else None
+
+
+def _model_field(model, name):
+    *relations, last = name.split('__')
+    for relation in relations:
+        model = model._meta.get_field(relation).related_model
+    return model._meta.get_field(last)
+
+
+def cursor_values(model, ordering, cursor):
+    """
+    Return the values in ``cursor`` converted by ``ordering``'s model
+    fields, or None if the cursor is missing, does not match ``ordering``
+    or holds a value a field rejects (a stale or tampered cursor).
+    """
+    values = decode_cursor(cursor)
+    if values is None or len(values) != len(ordering):
+        return None
+    try:
+        values = [
+            _model_field(model, field.lstrip('-')).to_python(value)
+            for field, value in zip(ordering, values)
+        ]
+    except (ValidationError, TypeError, ValueError):
+        return None
+    return None if any(value is None for value in values) else values
+
+
+def _resolve(obj, field):
+    for part in field.split('__'):
+        obj = getattr(obj, part)
+    return obj
+
+
+def keyset_filter(ordering, values):
+    """
+    Build the filter selecting rows strictly after ``values`` in ``ordering``.
+
+    For ordering (a, -b, c) this is ``a > va OR (a = va AND b < vb) OR
+    (a = va AND b = vb AND c > vc)``. Ordering fields must be non-null.
+    """
+    condition = Q()
+    equal = Q()
+    for field, value in zip(ordering, values):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        condition |= equal & Q(**{f'{name}__{lookup}': value})
+        equal &= Q(**{name: value})
+    return condition
+
+
+class KeysetPage:
+    def __init__(self, object_list, next_cursor=None, total_count=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.total_count = total_count
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+def _keyset_queryset(queryset, ordering, cursor):
+    queryset = queryset.order_by(*ordering)
+    values = cursor_values(queryset.model, ordering, cursor)
+    if values is not None:
+        queryset = queryset.filter(keyset_filter(ordering, values))
+    return queryset
+
+
+def _keyset_page(items, ordering, page_size):
+    next_cursor = None
+    if len(items) > page_size:
+        items = items[:page_size]
+        last = items[-1]
+        next_cursor = encode_cursor([_resolve(last, f.lstrip('-')) for f in ordering])
+    return KeysetPage(items, next_cursor)
+
+
+def paginate_keyset(queryset, ordering, cursor=None, page_size=20):
+    """
+    Return one KeysetPage of ``queryset`` ordered by ``ordering``.
+
+    ``ordering`` must end with a unique field (usually ``id``) so that the
+    sort key is total. An invalid ``cursor`` gives the first page. Costs
+    exactly one query, plus any prefetches.
+    """
+    queryset = _keyset_queryset(queryset, ordering, cursor)
+    return _keyset_page(list(queryset[:page_size + 1]), ordering, page_size)
+
+
+async def apaginate_keyset(queryset, ordering, cursor=None, page_size=20):
+    """``paginate_keyset`` for async views."""
+    queryset = _keyset_queryset(queryset, ordering, cursor)
+    return _keyset_page([obj async for obj in queryset[:page_size + 1]], ordering, page_size)
+
+
+def _ranked_offset(cursor):
+    values = decode_cursor(cursor)
+    return values[0] if values and isinstance(values[0], int) and values[0] > 0 else 0
+
+
+def _ranked_page(rows, ordered, offset, page_size):
+    page_ids = ordered[offset:offset + page_size]
+    items = [rows[pk] for pk in page_ids if pk in rows]
+    next_cursor = None
+    if offset + page_size < len(ordered):
+        next_cursor = encode_cursor([offset + page_size])
+    return KeysetPage(items, next_cursor, total_count=len(ordered))
+
+
+def paginate_ranked(queryset, ranked_ids, cursor=None, page_size=20):
+    """
+    Page through ``queryset`` in the order given by ``ranked_ids`` (e.g.
+    search relevance). Costs two queries: one for the matching ids and one
+    for the page rows. The page's ``total_count`` is filled in for free.
+    """
+    matching = set(queryset.filter(pk__in=ranked_ids).values_list('pk', flat=True))
+    ordered = [pk for pk in ranked_ids if pk in matching]
+    offset = _ranked_offset(cursor)
+    rows = {obj.pk: obj for obj in queryset.filter(pk__in=ordered[offset:offset + page_size])}
+    return _ranked_page(rows, ordered, offset, page_size)
+
+
+async def apaginate_ranked(queryset, ranked_ids, cursor=None, page_size=20):
+    """``paginate_ranked`` for async views."""
+    matching = {pk async for pk in queryset.filter(pk__in=ranked_ids).values_list('pk', flat=True)}
+    ordered = [pk for pk in ranked_ids if pk in matching]
+    offset = _ranked_offset(cursor)
+    rows = {obj.pk: obj async for obj in queryset.filter(pk__in=ordered[offset:offset + page_size])}
+    return _ranked_page(rows, ordered, offset, page_size)
@@ -46,6 +46,7 @@ INSTALLED_APPS = [
     'bookings',
     'payments',
     'notifications',
+    'api',
 ]
 
 # --------------------------------------------------
@@ -85,6 +86,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'notifications.context_processors.notification_stream',
             ],
         },
     },
@@ -101,6 +103,24 @@ DATABASES = {
     }
 }
 
+# --------------------------------------------------
+# CACHE
+# --------------------------------------------------
+
+# Shared by every worker process: the version keys that invalidate cached
+# API responses, facet counts, unread counts and API tokens must move for
+# all workers at once. In production point it at Redis or Memcached, e.g.
+#   CACHE_BACKEND=django.core.cache.backends.redis.RedisCache
+#   CACHE_LOCATION=redis://127.0.0.1:6379/1
+# The default, a file cache in the project directory, is for development
+# on one host only. The tests use a local-memory cache (testutils.runner).
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', str(BASE_DIR / 'cache')),
+    }
+}
+
 # --------------------------------------------------
 # PASSWORD VALIDATION
 # --------------------------------------------------
@@ -142,6 +162,9 @@ MEDIA_ROOT = BASE_DIR / 'media'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'accounts.User'
 
+# Skips the benchmarks unless run with: python manage.py test --tag benchmark
+TEST_RUNNER = 'testutils.runner.TestRunner'
+
 # --------------------------------------------------
 # CRISPY FORMS
 # --------------------------------------------------
@@ -155,7 +178,7 @@ CRISPY_TEMPLATE_PACK = "bootstrap5"
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'api.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -170,6 +193,50 @@ REST_FRAMEWORK = {
     'PAGE_SIZE': 10,
 }
 
+# See api/authentication.py; resolved API tokens are cached per process
+# and checked against a revocation stamp in the shared cache on every hit
+API_TOKEN_CACHE = {
+    'MAX_SIZE': 10000,
+    'TIMEOUT': 60,
+}
+
+# --------------------------------------------------
+# PAYMENTS
+# --------------------------------------------------
+
+# See payments/gateways.py; the stub settles locally without a network call
+PAYMENT_GATEWAY = {
+    'BACKEND': 'payments.gateways.StubGateway',
+    'OPTIONS': {
+        'latency': float(os.environ.get('PAYMENT_STUB_LATENCY', '0.5')),
+        'failure_rate': float(os.environ.get('PAYMENT_STUB_FAILURE_RATE', '0')),
+        'webhook_secret': os.environ.get('PAYMENT_WEBHOOK_SECRET', ''),
+    },
+}
+
+# Background threads per process settling submitted payments; with 0,
+# run ``manage.py settle_payments`` as the worker instead
+PAYMENT_WORKERS = int(os.environ.get('PAYMENT_WORKERS', '2'))
+
+# --------------------------------------------------
+# NOTIFICATIONS
+# --------------------------------------------------
+
+# See notifications/fanout.py; queued notifications are written in batches
+# by a background thread, or inline at commit with ENABLED False
+NOTIFICATION_QUEUE = {
+    'ENABLED': os.environ.get('NOTIFICATION_QUEUE_ENABLED', '1') == '1',
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 0.2,
+}
+
+# See notifications/broker.py; pushes new notifications to open streams.
+# The in-memory broker only reaches streams served by the same process
+NOTIFICATION_BROKER = {
+    'BACKEND': 'notifications.broker.InMemoryBroker',
+    'OPTIONS': {'max_queue': 100},
+}
+
 # --------------------------------------------------
 # AUTH REDIRECTS
 # --------------------------------------------------
@@ -183,3 +250,15 @@ LOGOUT_REDIRECT_URL = 'home'
 # --------------------------------------------------
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
+
+# Base of the links in notification emails
+SITE_URL = os.environ.get('SITE_URL', 'http://localhost:8000')
+
+# See notifications/mail.py; instant notification emails are sent in
+# batches over one connection by a background thread, or inline by the
+# fan-out with QUEUED False. Digests: manage.py send_notification_digests
+NOTIFICATION_EMAIL = {
+    'QUEUED': True,
+    'BATCH_SIZE': 50,
+    'FLUSH_INTERVAL': 1.0,
+}
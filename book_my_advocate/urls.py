@@ -12,6 +12,7 @@ urlpatterns = [
     path('advocates/', include('advocates.urls')),
     path('bookings/', include('bookings.urls')),
     path('payments/', include('payments.urls')),
+    path('notifications/', include('notifications.urls')),
     path('api/', include('api.urls')),
 ]
 urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,18 @@
+"""
+Version stamps for namespaced cache keys.
+
+Cached entries embed their namespace's current version in their key;
+bumping the version orphans every entry at once, and they age out of the
+cache on their own.
+"""
+
+import time
+
+
+def new_version():
+    """
+    A fresh version stamp. Never reused, so an evicted version cannot come
+    back; callers write it whole rather than ``incr`` it, which is not
+    atomic across processes on every cache backend.
+    """
+    return time.time_ns()
@@ -0,0 +1,145 @@
+"""
+Per-day availability bitmaps for "who is free at this time" queries.
+
+Each AvailabilityBitmap row stores an advocate's free 15-minute slots for
+one day as a 96-bit integer. Answering "which of these advocates is free
+from 11:00 to 12:00" is then one query for the bitmaps and a bitwise AND
+per advocate, instead of expanding windows and bookings for everyone.
+
+Rows are built lazily (and in bulk by ``build_availability_bitmaps``) and
+kept current by the Booking and AdvocateAvailability signal handlers in
+``bookings.signals``: a new booking clears its bits in place; cancellations,
+reschedules and deletions recompute just the affected advocate-days.
+"""
+
+from django.utils import timezone
+
+from .models import AvailabilityBitmap
+from .slots import load_busy, load_windows, subtract_intervals, to_minutes
+
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+BITMAP_BYTES = SLOTS_PER_DAY // 8
+
+
+def to_bytes(bits):
+    return bits.to_bytes(BITMAP_BYTES, 'little')
+
+
+def from_bytes(raw):
+    return int.from_bytes(bytes(raw), 'little')
+
+
+def interval_mask(start, end):
+    """Bits of every slot overlapping the [start, end) minutes interval."""
+    first = start // SLOT_MINUTES
+    last = min(-(-end // SLOT_MINUTES), SLOTS_PER_DAY)
+    if last <= first:
+        return 0
+    return ((1 << (last - first)) - 1) << first
+
+
+def free_bits(free_intervals):
+    """Bits of every slot lying entirely inside one of ``free_intervals``."""
+    bits = 0
+    for start, end in free_intervals:
+        first = -(-start // SLOT_MINUTES)
+        last = end // SLOT_MINUTES
+        if last > first:
+            bits |= ((1 << (last - first)) - 1) << first
+    return bits
+
+
+def compute_bitmaps(advocate_ids, dates):
+    """Return {(advocate_id, date): bits} computed from availability minus bookings."""
+    advocate_ids = list(advocate_ids)
+    dates = sorted(set(dates))
+    if not advocate_ids or not dates:
+        return {}
+    windows = load_windows(advocate_ids)
+    busy = load_busy(advocate_ids, dates[0], dates[-1])
+
+    bitmaps = {}
+    for advocate_id in advocate_ids:
+        for day in dates:
+            free = windows.get(advocate_id, {}).get(day.weekday(), [])
+            free = subtract_intervals(free, busy.get((advocate_id, day), []))
+            bitmaps[(advocate_id, day)] = free_bits(free)
+    return bitmaps
+
+
+def store_bitmaps(bitmaps):
+    """Insert or overwrite bitmap rows in one statement."""
+    AvailabilityBitmap.objects.bulk_create(
+        [
+            AvailabilityBitmap(advocate_id=advocate_id, date=day, bits=to_bytes(bits))
+            for (advocate_id, day), bits in bitmaps.items()
+        ],
+        batch_size=500,
+        update_conflicts=True,
+        unique_fields=['advocate', 'date'],
+        update_fields=['bits'],
+    )
+
+
+def build_bitmaps(advocate_ids, dates):
+    bitmaps = compute_bitmaps(advocate_ids, dates)
+    store_bitmaps(bitmaps)
+    return bitmaps
+
+
+def load_bitmaps(advocate_ids, day):
+    """Return {advocate_id: bits} for ``day``, building any rows that are missing."""
+    advocate_ids = list(advocate_ids)
+    rows = AvailabilityBitmap.objects.filter(advocate_id__in=advocate_ids, date=day)
+    bitmaps = {advocate_id: from_bytes(raw) for advocate_id, raw in rows.values_list('advocate_id', 'bits')}
+    missing = [advocate_id for advocate_id in advocate_ids if advocate_id not in bitmaps]
+    if missing:
+        for (advocate_id, _), bits in build_bitmaps(missing, [day]).items():
+            bitmaps[advocate_id] = bits
+    return bitmaps
+
+
+def free_advocate_ids(advocate_ids, day, start, duration):
+    """
+    Ids from ``advocate_ids`` (kept in order) who are free for ``duration``
+    minutes from ``start`` on ``day``.
+    """
+    begin = to_minutes(start)
+    if begin + duration > 24 * 60:
+        return []
+    mask = interval_mask(begin, begin + duration)
+    advocate_ids = list(advocate_ids)
+    bitmaps = load_bitmaps(advocate_ids, day)
+    return [advocate_id for advocate_id in advocate_ids if bitmaps.get(advocate_id, 0) & mask == mask]
+
+
+def clear_interval(advocate_id, day, start, duration):
+    """Mark a newly booked interval as taken, if the day has a bitmap."""
+    row = AvailabilityBitmap.objects.filter(advocate_id=advocate_id, date=day).first()
+    if row is None:
+        return
+    begin = to_minutes(start)
+    bits = from_bytes(row.bits) & ~interval_mask(begin, begin + duration)
+    AvailabilityBitmap.objects.filter(pk=row.pk).update(bits=to_bytes(bits))
+
+
+def refresh_days(advocate_days):
+    """Recompute the bitmaps of existing (advocate_id, date) rows."""
+    advocate_days = set(advocate_days)
+    existing = set(
+        AvailabilityBitmap.objects.filter(
+            advocate_id__in={advocate_id for advocate_id, _ in advocate_days},
+            date__in={day for _, day in advocate_days},
+        ).values_list('advocate_id', 'date')
+    ) & advocate_days
+    if not existing:
+        return
+    for advocate_id in {advocate_id for advocate_id, _ in existing}:
+        days = [day for other, day in existing if other == advocate_id]
+        store_bitmaps(compute_bitmaps([advocate_id], days))
+
+
+def drop_future_bitmaps(advocate_id):
+    """Forget an advocate's upcoming bitmaps after their weekly windows change."""
+    AvailabilityBitmap.objects.filter(advocate_id=advocate_id, date__gte=timezone.localdate()).delete()
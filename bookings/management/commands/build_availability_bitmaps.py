@@ -0,0 +1,28 @@
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from advocates.models import Advocate
+from bookings import bitmaps
+
+
+class Command(BaseCommand):
+    help = 'Precompute availability bitmaps for the coming days'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30)
+        parser.add_argument('--batch-size', type=int, default=200)
+
+    def handle(self, *args, **options):
+        today = timezone.localdate()
+        dates = [today + timedelta(days=offset) for offset in range(options['days'])]
+        advocate_ids = list(Advocate.objects.filter(verified=True).values_list('id', flat=True))
+
+        batch_size = options['batch_size']
+        for offset in range(0, len(advocate_ids), batch_size):
+            batch = advocate_ids[offset:offset + batch_size]
+            bitmaps.build_bitmaps(batch, dates)
+            self.stdout.write(f'Built bitmaps for {offset + len(batch)}/{len(advocate_ids)} advocates')
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Built {len(advocate_ids) * len(dates)} bitmaps for {len(dates)} days.'
+        ))
@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from advocates.models import Advocate
+from advocates.signals import advocates_changed
+from bookings import ratings
+
+
+class Command(BaseCommand):
+    help = "Recompute advocates' running review totals and rating summaries in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        checked = fixed = 0
+        last_id = 0
+        while True:
+            batch = list(
+                Advocate.objects.filter(pk__gt=last_id).order_by('pk')
+                .only('pk', *ratings.RECONCILED_FIELDS)[:batch_size]
+            )
+            if not batch:
+                break
+            with transaction.atomic():
+                changed = ratings.reconcile(batch)
+                now = timezone.now()
+                for advocate in changed:
+                    advocate.updated_at = now
+                Advocate.objects.bulk_update(changed, (*ratings.RECONCILED_FIELDS, 'updated_at'))
+                ratings.rebuild_summaries([advocate.pk for advocate in batch])
+                if changed:
+                    advocates_changed.send(sender=Advocate, advocate_ids=[advocate.pk for advocate in changed])
+            checked += len(batch)
+            fixed += len(changed)
+            last_id = batch[-1].pk
+
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} advocates, fixed {fixed}.'))
@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-18 20:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advocates', '0003_language'),
+        ('bookings', '0002_booking_day_lock'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AvailabilityBitmap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('bits', models.BinaryField(max_length=12)),
+                ('advocate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='availability_bitmaps', to='advocates.advocate')),
+            ],
+            options={
+                'unique_together': {('advocate', 'date')},
+            },
+        ),
+    ]
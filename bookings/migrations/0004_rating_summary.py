@@ -0,0 +1,46 @@
+# Generated by Django 6.0 on 2026-10-18 20:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Q, Sum
+
+
+def backfill_rating_summaries(apps, schema_editor):
+    Review = apps.get_model('bookings', 'Review')
+    RatingSummary = apps.get_model('bookings', 'RatingSummary')
+    rows = Review.objects.filter(is_verified=True).values('advocate_id').annotate(
+        professionalism_sum=Sum('professionalism'),
+        communication_sum=Sum('communication'),
+        expertise_sum=Sum('expertise'),
+        **{f'stars_{stars}': Count('id', filter=Q(rating=stars)) for stars in range(1, 6)},
+    )
+    RatingSummary.objects.bulk_create([RatingSummary(**row) for row in rows], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advocates', '0004_review_running_sums'),
+        ('bookings', '0003_availability_bitmap'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingSummary',
+            fields=[
+                ('advocate', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='rating_summary', serialize=False, to='advocates.advocate')),
+                ('stars_1', models.IntegerField(default=0)),
+                ('stars_2', models.IntegerField(default=0)),
+                ('stars_3', models.IntegerField(default=0)),
+                ('stars_4', models.IntegerField(default=0)),
+                ('stars_5', models.IntegerField(default=0)),
+                ('professionalism_sum', models.IntegerField(default=0)),
+                ('communication_sum', models.IntegerField(default=0)),
+                ('expertise_sum', models.IntegerField(default=0)),
+            ],
+            options={
+                'verbose_name_plural': 'Rating Summaries',
+            },
+        ),
+        migrations.RunPython(backfill_rating_summaries, migrations.RunPython.noop),
+    ]
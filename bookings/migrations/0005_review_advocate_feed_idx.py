@@ -0,0 +1,20 @@
+# Generated by Django 6.0 on 2026-10-18 20:40
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advocates', '0004_review_running_sums'),
+        ('bookings', '0004_rating_summary'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['advocate', 'is_verified', '-created_at', '-id'], name='review_advocate_feed_idx'),
+        ),
+    ]
@@ -70,6 +70,92 @@ class Review(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Newest verified reviews of one advocate, as paged by the API
+            models.Index(fields=['advocate', 'is_verified', '-created_at', '-id'], name='review_advocate_feed_idx'),
+        ]
     
     def __str__(self):
         return f"Review by {self.client.username} for {self.advocate}"
+
+
+class BookingDayLock(models.Model):
+    """
+    One row per advocate per day, written at the start of every booking
+    transaction so that overlap checks for the same day run one at a time.
+    """
+    advocate = models.ForeignKey(Advocate, on_delete=models.CASCADE, related_name='booking_day_locks')
+    date = models.DateField()
+    version = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        unique_together = ['advocate', 'date']
+    
+    def __str__(self):
+        return f"{self.advocate_id} @ {self.date} (v{self.version})"
+
+
+class AvailabilityBitmap(models.Model):
+    """
+    Free time of one advocate on one day as a 96-bit bitset, one bit per
+    15-minute slot (bit 0 is 00:00-00:15). Maintained by bookings.bitmaps.
+    """
+    advocate = models.ForeignKey(Advocate, on_delete=models.CASCADE, related_name='availability_bitmaps')
+    date = models.DateField()
+    bits = models.BinaryField(max_length=12)
+    
+    class Meta:
+        unique_together = ['advocate', 'date']
+    
+    def __str__(self):
+        return f"{self.advocate_id} @ {self.date}"
+
+
+class RatingSummary(models.Model):
+    """
+    Breakdown of an advocate's verified reviews: a 1-5 star histogram and
+    sub-score totals. Maintained by bookings.ratings as reviews change.
+    """
+    advocate = models.OneToOneField(Advocate, on_delete=models.CASCADE, primary_key=True, related_name='rating_summary')
+    stars_1 = models.IntegerField(default=0)
+    stars_2 = models.IntegerField(default=0)
+    stars_3 = models.IntegerField(default=0)
+    stars_4 = models.IntegerField(default=0)
+    stars_5 = models.IntegerField(default=0)
+    professionalism_sum = models.IntegerField(default=0)
+    communication_sum = models.IntegerField(default=0)
+    expertise_sum = models.IntegerField(default=0)
+    
+    class Meta:
+        verbose_name_plural = 'Rating Summaries'
+    
+    def __str__(self):
+        return f"Ratings for {self.advocate_id}"
+    
+    @property
+    def verified_count(self):
+        return self.stars_1 + self.stars_2 + self.stars_3 + self.stars_4 + self.stars_5
+    
+    def _average(self, total):
+        count = self.verified_count
+        return round(total / count, 2) if count else None
+    
+    @property
+    def avg_professionalism(self):
+        return self._average(self.professionalism_sum)
+    
+    @property
+    def avg_communication(self):
+        return self._average(self.communication_sum)
+    
+    @property
+    def avg_expertise(self):
+        return self._average(self.expertise_sum)
+    
+    def histogram(self):
+        """(stars, count, percent) from 5 stars down to 1."""
+        count = self.verified_count
+        return [
+            (stars, getattr(self, f'stars_{stars}'), round(100 * getattr(self, f'stars_{stars}') / count) if count else 0)
+            for stars in range(5, 0, -1)
+        ]
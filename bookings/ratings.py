@@ -0,0 +1,185 @@
+"""
+Incremental rating aggregation.
+
+Each advocate carries running sums of review scores; inserting, editing,
+verifying or deleting a review adjusts them with a single ``UPDATE ...
+SET x = x + n`` so concurrent reviews never overwrite each other and the
+cost does not grow with an advocate's review history. ``rating`` is
+recomputed from the sums in the same statement.
+
+Verified reviews are additionally tallied in the advocate's RatingSummary
+(star histogram and sub-score sums) for the profile page.
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db.models import Case, Count, DecimalField, F, FloatField, Q, Sum, Value, When
+from django.db.models.functions import Cast, Round
+from django.utils import timezone
+
+from advocates import facets
+from advocates.models import Advocate
+from advocates.signals import advocates_changed
+from book_my_advocate.counters import increment_or_create
+from .models import RatingSummary, Review
+
+SCORE_FIELDS = ('rating', 'professionalism', 'communication', 'expertise')
+
+RECONCILED_FIELDS = (
+    'total_reviews', 'rating_sum', 'professionalism_sum', 'communication_sum',
+    'expertise_sum', 'verified_reviews', 'rating',
+)
+
+SUMMARY_FIELDS = (
+    'stars_1', 'stars_2', 'stars_3', 'stars_4', 'stars_5',
+    'professionalism_sum', 'communication_sum', 'expertise_sum',
+)
+
+_RATING_FIELD = DecimalField(max_digits=3, decimal_places=2)
+
+
+def review_scores(review):
+    return tuple(getattr(review, field) for field in SCORE_FIELDS)
+
+
+def apply_delta(advocate_id, scores, sign, verified=False):
+    """
+    Add (sign=1) or remove (sign=-1) one review with ``scores`` from the
+    advocate's running totals.
+    """
+    rating, professionalism, communication, expertise = scores
+    new_count = F('total_reviews') + sign
+    rating_expr = Case(
+        When(total_reviews__lte=-sign, then=Value(0)),
+        default=Round(Cast(F('rating_sum') + sign * rating, FloatField()) / new_count, 2),
+        output_field=_RATING_FIELD,
+    )
+    updates = {
+        'total_reviews': new_count,
+        'rating_sum': F('rating_sum') + sign * rating,
+        'professionalism_sum': F('professionalism_sum') + sign * professionalism,
+        'communication_sum': F('communication_sum') + sign * communication,
+        'expertise_sum': F('expertise_sum') + sign * expertise,
+        'rating': rating_expr,
+        'updated_at': timezone.now(),
+    }
+    if verified:
+        updates['verified_reviews'] = F('verified_reviews') + sign
+    Advocate.objects.filter(pk=advocate_id).update(**updates)
+    # update() bypasses the Advocate signals, and the rating facet may have moved
+    facets.invalidate()
+    advocates_changed.send(sender=Advocate, advocate_ids=[advocate_id])
+
+
+def apply_verification(advocate_id, sign):
+    Advocate.objects.filter(pk=advocate_id).update(
+        verified_reviews=F('verified_reviews') + sign, updated_at=timezone.now()
+    )
+    advocates_changed.send(sender=Advocate, advocate_ids=[advocate_id])
+
+
+def apply_summary_delta(advocate_id, scores, sign):
+    """Add or remove one verified review in the advocate's RatingSummary."""
+    rating, professionalism, communication, expertise = scores
+    updates = {
+        f'stars_{rating}': F(f'stars_{rating}') + sign,
+        'professionalism_sum': F('professionalism_sum') + sign * professionalism,
+        'communication_sum': F('communication_sum') + sign * communication,
+        'expertise_sum': F('expertise_sum') + sign * expertise,
+    }
+    summary = RatingSummary.objects.filter(advocate_id=advocate_id)
+    if sign < 0:
+        summary.update(**updates)
+        return
+    increment_or_create(
+        summary, updates, advocate_id=advocate_id, **{f'stars_{rating}': 1},
+        professionalism_sum=professionalism, communication_sum=communication,
+        expertise_sum=expertise,
+    )
+
+
+def review_changed(previous, current):
+    """
+    Apply a review change to the running totals. ``previous`` and
+    ``current`` are (advocate_id, scores, is_verified) before and after
+    the change, or None for an insert or delete respectively.
+    """
+    if previous == current:
+        return
+    if previous and current and previous[:2] == current[:2]:
+        apply_verification(current[0], 1 if current[2] else -1)
+    else:
+        if previous:
+            apply_delta(previous[0], previous[1], -1, verified=previous[2])
+        if current:
+            apply_delta(current[0], current[1], 1, verified=current[2])
+
+    previous_verified = previous if previous and previous[2] else None
+    current_verified = current if current and current[2] else None
+    if previous_verified != current_verified:
+        if previous_verified:
+            apply_summary_delta(previous_verified[0], previous_verified[1], -1)
+        if current_verified:
+            apply_summary_delta(current_verified[0], current_verified[1], 1)
+
+
+def review_totals(advocate_ids):
+    """Recompute the running totals from scratch for ``advocate_ids``."""
+    rows = Review.objects.filter(advocate_id__in=advocate_ids).values('advocate_id').annotate(
+        total_reviews=Count('id'),
+        rating_sum=Sum('rating'),
+        professionalism_sum=Sum('professionalism'),
+        communication_sum=Sum('communication'),
+        expertise_sum=Sum('expertise'),
+        verified_reviews=Count('id', filter=Q(is_verified=True)),
+    )
+    return {row.pop('advocate_id'): row for row in rows}
+
+
+def summary_totals(advocate_ids):
+    """Recompute RatingSummary rows from scratch for ``advocate_ids``."""
+    rows = Review.objects.filter(advocate_id__in=advocate_ids, is_verified=True).values('advocate_id').annotate(
+        professionalism_sum=Sum('professionalism'),
+        communication_sum=Sum('communication'),
+        expertise_sum=Sum('expertise'),
+        **{f'stars_{stars}': Count('id', filter=Q(rating=stars)) for stars in range(1, 6)},
+    )
+    summaries = {advocate_id: RatingSummary(advocate_id=advocate_id) for advocate_id in advocate_ids}
+    for row in rows:
+        advocate_id = row.pop('advocate_id')
+        summaries[advocate_id] = RatingSummary(advocate_id=advocate_id, **row)
+    return summaries
+
+
+def rebuild_summaries(advocate_ids):
+    """Overwrite the RatingSummary rows of ``advocate_ids`` with fresh totals."""
+    RatingSummary.objects.bulk_create(
+        summary_totals(advocate_ids).values(),
+        update_conflicts=True,
+        unique_fields=['advocate'],
+        update_fields=SUMMARY_FIELDS,
+    )
+
+
+def reconcile(advocates):
+    """
+    Bring ``advocates`` back in line with their reviews. Returns the
+    advocates whose totals were wrong, already corrected in memory and
+    ready for ``bulk_update``.
+    """
+    advocates = list(advocates)
+    totals = review_totals([advocate.pk for advocate in advocates])
+    empty = {field: 0 for field in RECONCILED_FIELDS}
+    changed = []
+    for advocate in advocates:
+        expected = dict(empty, **totals.get(advocate.pk, {}))
+        count = expected['total_reviews']
+        expected['rating'] = (
+            (Decimal(expected['rating_sum']) / count).quantize(Decimal('0.01'), ROUND_HALF_UP)
+            if count else Decimal('0.00')
+        )
+        if any(getattr(advocate, field) != value for field, value in expected.items()):
+            for field, value in expected.items():
+                setattr(advocate, field, value)
+            changed.append(advocate)
+    return changed
@@ -0,0 +1,288 @@
+"""
+Overlap-aware booking writes.
+
+``unique_together`` on Booking only rejects identical start times, so a
+10:00 booking of 90 minutes and a 10:30 booking would both be accepted.
+Every booking write instead goes through ``reserve_slot``:
+
+1. take the per-advocate-day lock (an UPDATE on its BookingDayLock row,
+   which serialises writers for that day on every backend — a row lock on
+   PostgreSQL, the database write lock on SQLite);
+2. load that day's bookings and check for interval overlap;
+3. save, or raise ``BookingConflict``.
+
+Threads in the same worker also queue on a striped in-process lock first,
+so they wait on a cheap mutex rather than spinning on the database lock.
+
+``save_bookings`` does the same for a batch: it locks every advocate-day
+the batch books (in a fixed order), checks all the intervals with one
+query and writes them with one ``bulk_create`` and a ``bulk_update`` per
+set of changed fields.
+"""
+
+import random
+import threading
+import time as time_module
+from collections import defaultdict
+from contextlib import ExitStack, contextmanager
+
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import bitmaps
+from .models import Booking, BookingDayLock
+from .slots import to_minutes, to_time
+
+LOCK_ATTEMPTS = 5
+LOCK_BACKOFF_SECONDS = 0.05
+
+_LOCK_STRIPES = 64
+_local_locks = [threading.Lock() for _ in range(_LOCK_STRIPES)]
+
+
+class BookingConflict(Exception):
+    """The requested interval overlaps one or more existing bookings."""
+
+    def __init__(self, booking_date, start, duration, conflicts):
+        self.booking_date = booking_date
+        self.start = start
+        self.duration = duration
+        self.conflicts = conflicts
+        super().__init__(self.message)
+
+    @property
+    def message(self):
+        return (
+            f"The advocate is already booked at {self.start.strftime('%H:%M')} "
+            f"on {self.booking_date.isoformat()}."
+        )
+
+    def as_dict(self):
+        """Structured description that does not reveal other clients' bookings."""
+        return {
+            'detail': self.message,
+            'code': 'booking_conflict',
+            'booking_date': self.booking_date.isoformat(),
+            'requested': {
+                'start': self.start.strftime('%H:%M'),
+                'duration': self.duration,
+            },
+            'conflicts': [
+                {'start': start.strftime('%H:%M'), 'end': end.strftime('%H:%M')}
+                for start, end in self.conflicts
+            ],
+        }
+
+
+class BookingConflicts(Exception):
+    """Bookings of a batch overlap existing bookings or each other."""
+
+    def __init__(self, conflicts):
+        # Position in the batch -> BookingConflict
+        self.conflicts = conflicts
+        super().__init__(f"{len(conflicts)} bookings of the batch conflict.")
+
+
+def find_conflicts(advocate_id, booking_date, start, duration, exclude_id=None):
+    """Return (start, end) times of non-cancelled bookings overlapping the interval."""
+    begin = to_minutes(start)
+    end = begin + duration
+    bookings = Booking.objects.filter(
+        advocate_id=advocate_id, booking_date=booking_date
+    ).exclude(status='cancelled')
+    if exclude_id:
+        bookings = bookings.exclude(id=exclude_id)
+
+    conflicts = []
+    for other_start, other_duration in bookings.values_list('booking_time', 'duration'):
+        other_begin = to_minutes(other_start)
+        other_end = other_begin + other_duration
+        if other_begin < end and begin < other_end:
+            conflicts.append((other_start, to_time(min(other_end, 24 * 60 - 1))))
+    return sorted(conflicts)
+
+
+def lock_advocate_day(advocate_id, booking_date):
+    """Take the row lock for (advocate, day); must run inside a transaction."""
+    lock = BookingDayLock.objects.filter(advocate_id=advocate_id, date=booking_date)
+    if lock.update(version=F('version') + 1):
+        return
+    try:
+        with transaction.atomic():
+            BookingDayLock.objects.create(advocate_id=advocate_id, date=booking_date, version=1)
+    except IntegrityError:
+        # Another request created the row first; lock it now that it exists
+        lock.update(version=F('version') + 1)
+
+
+@contextmanager
+def reserve_slot(advocate_id, booking_date, start, duration, exclude_id=None):
+    """
+    Run the body in a transaction holding the advocate-day lock, after
+    checking that [start, start + duration) is free.
+    """
+    with _local_locks[hash((advocate_id, booking_date)) % _LOCK_STRIPES]:
+        with transaction.atomic():
+            lock_advocate_day(advocate_id, booking_date)
+            conflicts = find_conflicts(advocate_id, booking_date, start, duration, exclude_id)
+            if conflicts:
+                raise BookingConflict(booking_date, start, duration, conflicts)
+            yield
+
+
+def find_batch_conflicts(bookings):
+    """
+    Check the interval of every booking in ``bookings`` that is not
+    cancelled against the other bookings of its advocate-day, loaded with
+    one query for all the days, and against the bookings before it in the
+    batch. Returns {position: BookingConflict}.
+    """
+    wanted = [(position, booking) for position, booking in enumerate(bookings) if booking.status != 'cancelled']
+    days = {(booking.advocate_id, booking.booking_date) for _, booking in wanted}
+    if not days:
+        return {}
+    taken = defaultdict(list)
+    others = Booking.objects.filter(
+        advocate_id__in={advocate_id for advocate_id, _ in days},
+        booking_date__in={day for _, day in days},
+    ).exclude(status='cancelled').exclude(id__in=[booking.pk for booking in bookings if booking.pk])
+    for advocate_id, booking_date, start, duration in others.values_list(
+        'advocate_id', 'booking_date', 'booking_time', 'duration'
+    ):
+        if (advocate_id, booking_date) in days:
+            taken[advocate_id, booking_date].append((start, to_minutes(start), to_minutes(start) + duration))
+
+    conflicts = {}
+    for position, booking in wanted:
+        begin = to_minutes(booking.booking_time)
+        end = begin + booking.duration
+        day = taken[booking.advocate_id, booking.booking_date]
+        overlapping = sorted(
+            (other_start, to_time(min(other_end, 24 * 60 - 1)))
+            for other_start, other_begin, other_end in day
+            if other_begin < end and begin < other_end
+        )
+        if overlapping:
+            conflicts[position] = BookingConflict(
+                booking.booking_date, booking.booking_time, booking.duration, overlapping,
+            )
+        else:
+            day.append((booking.booking_time, begin, end))
+    return conflicts
+
+
+@contextmanager
+def reserve_slots(bookings):
+    """
+    ``reserve_slot`` for a batch: run the body in one transaction holding
+    the lock of every advocate-day the batch books, taken in sorted order
+    so that concurrent batches cannot deadlock, after checking that all
+    the intervals are free.
+    """
+    days = sorted({
+        (booking.advocate_id, booking.booking_date) for booking in bookings if booking.status != 'cancelled'
+    })
+    with ExitStack() as stack:
+        for stripe in sorted({hash(day) % _LOCK_STRIPES for day in days}):
+            stack.enter_context(_local_locks[stripe])
+        with transaction.atomic():
+            for advocate_id, booking_date in days:
+                lock_advocate_day(advocate_id, booking_date)
+            conflicts = find_batch_conflicts(bookings)
+            if conflicts:
+                raise BookingConflicts(conflicts)
+            yield
+
+
+def is_lock_error(exc):
+    return 'locked' in str(exc) or 'deadlock' in str(exc)
+
+
+def retry_on_lock(write, attempts=LOCK_ATTEMPTS, retry_on=()):
+    """
+    Call ``write()`` and return its result, retrying with jittered backoff
+    when the database reports lock contention or ``write`` raises one of
+    the ``retry_on`` exception types.
+    """
+    for attempt in range(attempts):
+        try:
+            return write()
+        except (OperationalError, *retry_on) as exc:
+            retryable = isinstance(exc, retry_on) or is_lock_error(exc)
+            if not retryable or attempt == attempts - 1:
+                raise
+        time_module.sleep(LOCK_BACKOFF_SECONDS * (attempt + 1) * random.uniform(0.5, 1.5))
+
+
+def book_slot(save, advocate_id, booking_date, start, duration, exclude_id=None, attempts=LOCK_ATTEMPTS):
+    """
+    Call ``save()`` under ``reserve_slot``, retrying on lock contention.
+    Returns whatever ``save`` returns; raises BookingConflict if the
+    interval is taken.
+    """
+    def write():
+        try:
+            with reserve_slot(advocate_id, booking_date, start, duration, exclude_id):
+                return save()
+        except IntegrityError:
+            # unique_together still guards identical start times
+            conflicts = find_conflicts(advocate_id, booking_date, start, duration, exclude_id)
+            if not conflicts:
+                raise
+            raise BookingConflict(booking_date, start, duration, conflicts)
+
+    return retry_on_lock(write, attempts)
+
+
+def save_booking(booking, attempts=LOCK_ATTEMPTS):
+    """Save ``booking`` if its interval is free, otherwise raise BookingConflict."""
+    book_slot(
+        booking.save, booking.advocate_id, booking.booking_date, booking.booking_time,
+        booking.duration, exclude_id=booking.pk, attempts=attempts,
+    )
+    return booking
+
+
+def save_bookings(bookings, fields, attempts=LOCK_ATTEMPTS):
+    """
+    Write a batch of bookings in one transaction if none of them
+    conflicts, else raise BookingConflicts. New bookings are inserted
+    with one ``bulk_create``; existing ones are updated with one
+    ``bulk_update`` per set of changed fields, ``fields`` mapping each
+    one's pk to the fields it changes, so columns a booking does not
+    change are never written back from a stale copy. Bulk writes skip the
+    Booking signals, so the bitmaps of the days touched are refreshed
+    here; notifying is up to the caller.
+    """
+    new = [booking for booking in bookings if booking.pk is None]
+    changed = [booking for booking in bookings if booking.pk is not None]
+    updates = defaultdict(list)
+    for booking in changed:
+        updates[tuple(sorted(fields[booking.pk]))].append(booking)
+    days = {(booking.advocate_id, booking.booking_date) for booking in bookings}
+    # Rescheduled bookings also free the day they leave (see bookings.signals)
+    days.update(booking._slot_state[:2] for booking in changed)
+    def write():
+        for booking in new:
+            # A rolled-back attempt leaves pks behind: insert them afresh
+            booking.pk = None
+            booking._state.adding = True
+        try:
+            with reserve_slots(bookings):
+                Booking.objects.bulk_create(new)
+                now = timezone.now()
+                for names, group in updates.items():
+                    for booking in group:
+                        booking.updated_at = now
+                    Booking.objects.bulk_update(group, [*names, 'updated_at'])
+                bitmaps.refresh_days(days)
+        except IntegrityError:
+            # unique_together still guards identical start times
+            conflicts = find_batch_conflicts(bookings)
+            if not conflicts:
+                raise
+            raise BookingConflicts(conflicts)
+        return bookings
+
+    return retry_on_lock(write, attempts)
@@ -0,0 +1,73 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from advocates.models import AdvocateAvailability
+from .models import Booking, Review
+from . import bitmaps, ratings
+
+# Booking fields that decide which 15-minute slots a booking occupies
+SLOT_FIELDS = ('advocate_id', 'booking_date', 'booking_time', 'duration', 'status')
+
+
+def _slot_state(booking):
+    return tuple(booking.__dict__.get(field) for field in SLOT_FIELDS)
+
+
+@receiver(post_init, sender=Booking)
+def remember_slot_state(sender, instance, **kwargs):
+    instance._slot_state = _slot_state(instance)
+
+
+@receiver(post_save, sender=Booking)
+def update_bitmaps_for_booking(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    state = _slot_state(instance)
+    previous = instance._slot_state
+    instance._slot_state = state
+    if created:
+        if instance.status != 'cancelled':
+            bitmaps.clear_interval(instance.advocate_id, instance.booking_date, instance.booking_time, instance.duration)
+        return
+    if state == previous:
+        return
+    # Cancelled or rescheduled: recompute the day it left and the day it moved to
+    days = {(instance.advocate_id, instance.booking_date)}
+    if previous[0] is not None and previous[1] is not None:
+        days.add((previous[0], previous[1]))
+    bitmaps.refresh_days(days)
+
+
+@receiver(post_delete, sender=Booking)
+def update_bitmaps_for_deleted_booking(sender, instance, **kwargs):
+    bitmaps.refresh_days([(instance.advocate_id, instance.booking_date)])
+
+
+@receiver(post_save, sender=AdvocateAvailability)
+@receiver(post_delete, sender=AdvocateAvailability)
+def drop_bitmaps_for_availability(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    bitmaps.drop_future_bitmaps(instance.advocate_id)
+
+
+@receiver(post_init, sender=Review)
+def remember_review_scores(sender, instance, **kwargs):
+    instance._rating_state = (
+        instance.__dict__.get('advocate_id'),
+        tuple(instance.__dict__.get(field) for field in ratings.SCORE_FIELDS),
+        instance.__dict__.get('is_verified'),
+    )
+
+
+@receiver(post_save, sender=Review)
+def update_ratings_for_review(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    state = (instance.advocate_id, ratings.review_scores(instance), instance.is_verified)
+    ratings.review_changed(None if created else instance._rating_state, state)
+    instance._rating_state = state
+
+
+@receiver(post_delete, sender=Review)
+def update_ratings_for_deleted_review(sender, instance, **kwargs):
+    ratings.review_changed(instance._rating_state, None)
@@ -0,0 +1,124 @@
+"""
+Free-slot computation from advocates' weekly availability.
+
+Weekly ``AdvocateAvailability`` windows are expanded over a date range and
+the intervals taken by non-cancelled bookings (start time plus duration)
+are subtracted. Everything is done with interval arithmetic in memory: one
+query loads the windows and one loads the bookings, however many
+advocates and days are requested.
+"""
+
+from collections import defaultdict
+from datetime import time, timedelta
+
+from django.utils import timezone
+
+from advocates.models import AdvocateAvailability
+from .models import Booking
+
+SLOT_STEP_MINUTES = 30
+DEFAULT_DURATION = 60
+MAX_RANGE_DAYS = 60
+
+MINUTES_PER_DAY = 24 * 60
+
+
+def to_minutes(value):
+    return value.hour * 60 + value.minute
+
+
+def to_time(minutes):
+    return time(minutes // 60, minutes % 60)
+
+
+def merge_intervals(intervals):
+    """Merge overlapping or touching [start, end) intervals."""
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [tuple(interval) for interval in merged]
+
+
+def subtract_intervals(free, busy):
+    """Remove the (merged, sorted) ``busy`` intervals from ``free``."""
+    result = []
+    for start, end in free:
+        cursor = start
+        for busy_start, busy_end in busy:
+            if busy_end <= cursor or busy_start >= end:
+                continue
+            if busy_start > cursor:
+                result.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+        if cursor < end:
+            result.append((cursor, end))
+    return result
+
+
+def slot_starts(free, duration, step=SLOT_STEP_MINUTES, not_before=0):
+    """Start minutes of every ``duration`` slot aligned to ``step`` inside ``free``."""
+    starts = []
+    for start, end in free:
+        first = max(start, not_before)
+        first += -first % step
+        starts.extend(range(first, end - duration + 1, step))
+    return starts
+
+
+def load_windows(advocate_ids):
+    """Weekly windows as {advocate_id: {weekday: [(start, end), ...]}}."""
+    windows = defaultdict(lambda: defaultdict(list))
+    rows = AdvocateAvailability.objects.filter(
+        advocate_id__in=advocate_ids, is_available=True
+    ).values_list('advocate_id', 'day_of_week', 'start_time', 'end_time')
+    for advocate_id, weekday, start, end in rows:
+        end_minutes = to_minutes(end) or MINUTES_PER_DAY
+        windows[advocate_id][weekday].append((to_minutes(start), end_minutes))
+    for by_day in windows.values():
+        for weekday, intervals in by_day.items():
+            by_day[weekday] = merge_intervals(intervals)
+    return windows
+
+
+def load_busy(advocate_ids, start_date, end_date):
+    """Booked intervals as {(advocate_id, date): [(start, end), ...]}, merged."""
+    busy = defaultdict(list)
+    rows = Booking.objects.filter(
+        advocate_id__in=advocate_ids,
+        booking_date__range=(start_date, end_date),
+    ).exclude(status='cancelled').values_list('advocate_id', 'booking_date', 'booking_time', 'duration')
+    for advocate_id, booking_date, booking_time, duration in rows:
+        start = to_minutes(booking_time)
+        busy[(advocate_id, booking_date)].append((start, min(start + duration, MINUTES_PER_DAY)))
+    return {key: merge_intervals(intervals) for key, intervals in busy.items()}
+
+
+def free_slots(advocate_ids, start_date, end_date, duration=DEFAULT_DURATION, step=SLOT_STEP_MINUTES):
+    """
+    Return ``{advocate_id: {date: [time, ...]}}`` of bookable start times
+    between ``start_date`` and ``end_date`` inclusive. Days without a free
+    slot are left out; slots already in the past are never offered.
+    """
+    advocate_ids = list(advocate_ids)
+    windows = load_windows(advocate_ids)
+    busy = load_busy(advocate_ids, start_date, end_date)
+
+    now = timezone.localtime()
+    result = {}
+    for advocate_id in advocate_ids:
+        by_date = {}
+        day = start_date
+        while day <= end_date:
+            if day >= now.date():
+                free = windows.get(advocate_id, {}).get(day.weekday(), [])
+                free = subtract_intervals(free, busy.get((advocate_id, day), []))
+                not_before = to_minutes(now) + 1 if day == now.date() else 0
+                starts = slot_starts(free, duration, step, not_before)
+                if starts:
+                    by_date[day] = [to_time(minutes) for minutes in starts]
+            day += timedelta(days=1)
+        result[advocate_id] = by_date
+    return result
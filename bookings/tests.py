@@ -1,3 +1,309 @@
+import threading
+from io import StringIO
+from datetime import date, time, timedelta
+from decimal import Decimal
+from django.core.management import call_command
+from unittest import mock
+from django.db import IntegrityError, OperationalError, connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from accounts.models import User
+from testutils.cases import Benchmark
+from testutils.factories import create_advocate, create_booking
+from advocates.models import Advocate, AdvocateAvailability, Specialization
+from .bitmaps import free_advocate_ids
+from .models import AvailabilityBitmap, Booking, RatingSummary, Review
+from .scheduling import BookingConflict, retry_on_lock, save_booking
+from .slots import free_slots, subtract_intervals
 
-# Create your tests here.
+
+class FreeSlotTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='client', user_type='client')
+        cls.advocate = create_advocate('slots')
+        cls.day = date.today() + timedelta(days=7)
+        AdvocateAvailability.objects.create(
+            advocate=cls.advocate, day_of_week=cls.day.weekday(),
+            start_time=time(9, 0), end_time=time(12, 0),
+        )
+
+    def test_subtract_intervals(self):
+        self.assertEqual(subtract_intervals([(540, 720)], [(600, 690)]), [(540, 600), (690, 720)])
+        self.assertEqual(subtract_intervals([(540, 720)], [(500, 800)]), [])
+
+    def test_bookings_block_their_whole_duration(self):
+        create_booking(self.advocate, self.client_user, self.day, time(9, 30), duration=90)
+        create_booking(self.advocate, self.client_user, self.day, time(9, 0), status='cancelled')
+
+        with self.assertNumQueries(2):
+            slots = free_slots([self.advocate.id], self.day, self.day)
+        self.assertEqual(slots[self.advocate.id], {self.day: [time(11, 0)]})
+
+    def test_api_returns_calendar_for_many_advocates(self):
+        other = create_advocate('other')
+        response = self.client.get('/api/advocates/slots/', {
+            'ids': f'{self.advocate.id},{other.id}', 'start': self.day.isoformat(), 'days': 1, 'duration': 60,
+        })
+        self.assertEqual(response.status_code, 200)
+        results = {item['advocate']: item['slots'] for item in response.json()['results']}
+        self.assertEqual(results[self.advocate.id], {self.day.isoformat(): ['09:00', '09:30', '10:00', '10:30', '11:00']})
+        self.assertEqual(results[other.id], {})
+
+
+class BookingConflictTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='client', password='pass', user_type='client')
+        cls.advocate = create_advocate('busy')
+        cls.day = date.today() + timedelta(days=3)
+        create_booking(cls.advocate, cls.client_user, cls.day, time(10, 0), duration=90)
+
+    def test_overlapping_start_is_rejected(self):
+        booking = Booking(
+            advocate=self.advocate, client=self.client_user, service_type='consultation',
+            booking_date=self.day, booking_time=time(10, 30), duration=30,
+            case_description='Case', case_type='Civil', total_fee=Decimal('500.00'),
+        )
+        with self.assertRaises(BookingConflict) as raised:
+            save_booking(booking)
+        self.assertEqual(raised.exception.conflicts, [(time(10, 0), time(11, 30))])
+
+        booking.booking_time = time(11, 30)
+        save_booking(booking)
+        self.assertIsNotNone(booking.pk)
+
+    def test_other_integrity_errors_are_not_conflicts(self):
+        booking = Booking(
+            advocate=self.advocate, client=self.client_user, service_type='consultation',
+            booking_date=self.day, booking_time=time(14, 0), duration=30,
+            case_description='Case', case_type=None, total_fee=Decimal('500.00'),
+        )
+        with self.assertRaises(IntegrityError):
+            save_booking(booking)
+
+    @mock.patch('bookings.scheduling.time_module.sleep')
+    def test_only_lock_errors_are_retried(self, sleep):
+        write = mock.Mock(side_effect=[OperationalError('database table is locked'), 'written'])
+        self.assertEqual(retry_on_lock(write), 'written')
+        self.assertEqual(write.call_count, 2)
+
+        write = mock.Mock(side_effect=OperationalError('no such column'))
+        with self.assertRaises(OperationalError):
+            retry_on_lock(write)
+        self.assertEqual(write.call_count, 1)
+
+        write = mock.Mock(side_effect=[IntegrityError, 'written'])
+        self.assertEqual(retry_on_lock(write, retry_on=(IntegrityError,)), 'written')
+
+    def test_view_returns_conflict_with_alternatives(self):
+        self.client.force_login(self.client_user)
+        response = self.client.post(reverse('create_booking', args=[self.advocate.id]), {
+            'service_type': 'consultation', 'booking_date': self.day.isoformat(),
+            'booking_time': '10:00', 'duration': 60, 'case_description': 'Case',
+            'case_type': 'Civil', 'priority': 'normal',
+        })
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(Booking.objects.count(), 1)
+
+    def test_api_returns_structured_conflict(self):
+        self.client.force_login(self.client_user)
+        response = self.client.post('/api/bookings/', {
+            'advocate_id': self.advocate.id, 'service_type': 'consultation',
+            'booking_date': self.day.isoformat(), 'booking_time': '11:00', 'duration': 60,
+            'case_description': 'Case', 'case_type': 'Civil', 'total_fee': '500.00',
+        }, content_type='application/json')
+        self.assertEqual(response.status_code, 409)
+        body = response.json()
+        self.assertEqual(body['code'], 'booking_conflict')
+        self.assertEqual(body['conflicts'], [{'start': '10:00', 'end': '11:30'}])
+
+
+
+class AvailabilityBitmapTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='urgent', password='pass', user_type='client')
+        cls.criminal = Specialization.objects.create(name='Criminal Law', description='Criminal')
+        cls.day = date.today() + timedelta(days=1)
+        cls.advocates = []
+        for name in ['first', 'second']:
+            advocate = create_advocate(name)
+            advocate.specializations.add(cls.criminal)
+            AdvocateAvailability.objects.create(
+                advocate=advocate, day_of_week=cls.day.weekday(),
+                start_time=time(10, 0), end_time=time(13, 0),
+            )
+            cls.advocates.append(advocate)
+        cls.ids = [advocate.id for advocate in cls.advocates]
+
+    def free_at(self, hour, minute=0, duration=60):
+        return free_advocate_ids(self.ids, self.day, time(hour, minute), duration)
+
+    def test_bitmaps_follow_booking_lifecycle(self):
+        self.assertEqual(self.free_at(11), self.ids)
+        self.assertEqual(AvailabilityBitmap.objects.count(), 2)
+
+        booking = create_booking(self.advocates[0], self.client_user, self.day, time(11, 30), duration=30)
+        self.assertEqual(self.free_at(11), [self.ids[1]])
+        self.assertEqual(self.free_at(10), self.ids)
+
+        booking.booking_time = time(10, 0)
+        booking.save()
+        self.assertEqual(self.free_at(11), self.ids)
+        self.assertEqual(self.free_at(10), [self.ids[1]])
+
+        booking.status = 'cancelled'
+        booking.save()
+        self.assertEqual(self.free_at(10), self.ids)
+        self.assertEqual(self.free_at(12, 30), [])
+
+    def test_api_filters_by_specialization_and_window(self):
+        create_booking(self.advocates[1], self.client_user, self.day, time(11, 0))
+        response = self.client.get('/api/advocates/free/', {
+            'date': self.day.isoformat(), 'start': '11:00', 'duration': 60,
+            'specialization': self.criminal.id,
+        })
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([a['id'] for a in response.json()['results']], [self.ids[0]])
+
+
+
+class ReviewAggregationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='reviewer', user_type='client')
+        cls.advocate = create_advocate('rated')
+
+    def review(self, rating, booking=None, **kwargs):
+        booking = booking or self.completed_booking()
+        return Review.objects.create(
+            booking=booking, advocate=self.advocate, client=self.client_user, rating=rating,
+            comment='Review', professionalism=rating, communication=rating, expertise=rating, **kwargs
+        )
+
+    def completed_booking(self):
+        count = Booking.objects.count()
+        return create_booking(
+            self.advocate, self.client_user, date.today() - timedelta(days=1 + count // 12),
+            time(8 + count % 12, 0), status='completed'
+        )
+
+    def test_running_totals_follow_insert_verify_and_delete(self):
+        first = self.review(5)
+        booking = self.completed_booking()
+        # One INSERT plus one UPDATE, however many reviews already exist
+        with self.assertNumQueries(2):
+            second = self.review(4, booking)
+        self.advocate.refresh_from_db()
+        self.assertEqual((self.advocate.total_reviews, self.advocate.rating_sum), (2, 9))
+        self.assertEqual(self.advocate.rating, Decimal('4.50'))
+
+        second.is_verified = True
+        second.save()
+        first.delete()
+        self.advocate.refresh_from_db()
+        self.assertEqual((self.advocate.total_reviews, self.advocate.verified_reviews), (1, 1))
+        self.assertEqual(self.advocate.rating, Decimal('4.00'))
+
+        second.delete()
+        self.advocate.refresh_from_db()
+        self.assertEqual((self.advocate.total_reviews, self.advocate.rating), (0, Decimal('0.00')))
+
+    def test_summary_counts_only_verified_reviews(self):
+        pending = self.review(2)
+        self.review(5, is_verified=True)
+        summary = RatingSummary.objects.get(advocate=self.advocate)
+        self.assertEqual((summary.verified_count, summary.stars_5, summary.stars_2), (1, 1, 0))
+
+        pending.is_verified = True
+        pending.save()
+        pending.rating = 3
+        pending.save()
+        summary.refresh_from_db()
+        self.assertEqual(summary.histogram(), [(5, 1, 50), (4, 0, 0), (3, 1, 50), (2, 0, 0), (1, 0, 0)])
+        self.assertEqual(summary.avg_expertise, 3.5)
+
+        pending.delete()
+        summary.refresh_from_db()
+        self.assertEqual((summary.verified_count, summary.expertise_sum), (1, 5))
+
+    def test_detail_page_reads_summary_without_aggregating(self):
+        for rating in [5] * 9 + [4] * 3:
+            self.review(rating, is_verified=True)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('advocate_detail', args=[self.advocate.id]))
+        self.assertFalse([q for q in queries if 'AVG(' in q['sql'] or 'COUNT(' in q['sql']])
+        summary = response.context['rating_summary']
+        self.assertEqual(summary.verified_count, 12)
+        self.assertEqual(summary.histogram()[:2], [(5, 9, 75), (4, 3, 25)])
+        self.assertEqual(len(response.context['reviews']), 10)
+        self.assertContains(response, 'Client Reviews (12)')
+
+    def test_reconcile_command_repairs_drift(self):
+        self.review(3)
+        self.review(4, is_verified=True)
+        Advocate.objects.filter(pk=self.advocate.pk).update(rating_sum=0, total_reviews=7, rating=1)
+        RatingSummary.objects.filter(advocate=self.advocate).update(stars_4=0, stars_1=2)
+        call_command('reconcile_ratings', batch_size=1, stdout=StringIO())
+        self.advocate.refresh_from_db()
+        self.assertEqual((self.advocate.total_reviews, self.advocate.rating_sum), (2, 7))
+        self.assertEqual(self.advocate.rating, Decimal('3.50'))
+        summary = RatingSummary.objects.get(advocate=self.advocate)
+        self.assertEqual((summary.stars_4, summary.stars_1), (1, 0))
+
+
+class BookingContentionBenchmark(Benchmark):
+    """
+    Many threads race for overlapping slots on the same advocate-days.
+    Asserts that no two accepted bookings overlap and reports throughput.
+    """
+    THREADS = 8
+    ATTEMPTS_PER_THREAD = 20
+
+    def test_no_double_bookings_under_contention(self):
+        client_user = User.objects.create_user(username='racer', user_type='client')
+        advocates = [create_advocate(f'contended{i}') for i in range(2)]
+        day = date.today() + timedelta(days=5)
+        outcomes = {'booked': 0, 'conflicts': 0, 'errors': 0}
+        outcome_lock = threading.Lock()
+
+        def worker(seed):
+            for attempt in range(self.ATTEMPTS_PER_THREAD):
+                advocate = advocates[(seed + attempt) % len(advocates)]
+                # 15-minute grid with 60-minute bookings: most requests overlap
+                minutes = 9 * 60 + 15 * ((seed * 7 + attempt * 3) % 24)
+                booking = Booking(
+                    advocate=advocate, client=client_user, service_type='consultation',
+                    booking_date=day, booking_time=time(minutes // 60, minutes % 60), duration=60,
+                    case_description='Race', case_type='Civil', total_fee=Decimal('500.00'),
+                )
+                try:
+                    save_booking(booking, attempts=20)
+                    result = 'booked'
+                except BookingConflict:
+                    result = 'conflicts'
+                except Exception:
+                    result = 'errors'
+                with outcome_lock:
+                    outcomes[result] += 1
+
+        elapsed = self.run_threads(worker, self.THREADS)
+
+        for advocate in advocates:
+            intervals = sorted(
+                (b.booking_time.hour * 60 + b.booking_time.minute, b.duration)
+                for b in Booking.objects.filter(advocate=advocate, booking_date=day)
+            )
+            for (start, duration), (next_start, _) in zip(intervals, intervals[1:]):
+                self.assertLessEqual(start + duration, next_start)
+
+        total = self.THREADS * self.ATTEMPTS_PER_THREAD
+        self.assertEqual(outcomes['errors'], 0)
+        self.assertEqual(outcomes['booked'], Booking.objects.count())
+        self.report(
+            'booking contention',
+            f"{self.THREADS} threads, {total} requests in {elapsed:.2f}s ({total / elapsed:.0f} req/s), "
+            f"{outcomes['booked']} booked, {outcomes['conflicts']} conflicts",
+        )
@@ -7,6 +7,8 @@ from datetime import datetime, timedelta
 from .models import Booking, Review
 from advocates.models import Advocate
 from .forms import BookingForm, ReviewForm
+from .scheduling import BookingConflict, save_booking
+from .slots import free_slots
 
 @login_required
 def create_booking(request, advocate_id):
@@ -27,11 +29,28 @@ def create_booking(request, advocate_id):
             else:
                 booking.total_fee = advocate.consultation_fee
             
-            booking.save()
+            try:
+                save_booking(booking)
+            except BookingConflict as conflict:
+                # Offer the advocate's remaining free slots on that day
+                day = conflict.booking_date
+                alternatives = free_slots([advocate.id], day, day, booking.duration)[advocate.id].get(day, [])
+                form.add_error('booking_time', conflict.message)
+                context = {
+                    'form': form,
+                    'advocate': advocate,
+                    'conflict': conflict,
+                    'alternative_slots': alternatives,
+                }
+                return render(request, 'bookings/create_booking.html', context, status=409)
             messages.success(request, 'Booking created successfully! Please proceed to payment.')
             return redirect('booking_detail', booking_id=booking.id)
     else:
-        form = BookingForm()
+        # Slots picked on the advocate's calendar arrive as ?date=&time=
+        form = BookingForm(initial={
+            'booking_date': request.GET.get('date'),
+            'booking_time': request.GET.get('time'),
+        })
     
     context = {
         'form': form,
@@ -112,14 +131,9 @@ def create_review(request, booking_id):
             review.booking = booking
             review.advocate = booking.advocate
             review.client = request.user
+            # The advocate's rating totals are updated by bookings.signals
             review.save()
             
-            # Update advocate rating
-            avg_rating = Review.objects.filter(advocate=booking.advocate).aggregate(Avg('rating'))['rating__avg']
-            booking.advocate.rating = round(avg_rating, 2)
-            booking.advocate.total_reviews = Review.objects.filter(advocate=booking.advocate).count()
-            booking.advocate.save()
-            
             messages.success(request, 'Review submitted successfully!')
             return redirect('booking_detail', booking_id=booking.id)
     else:
@@ -0,0 +1,61 @@
+import logging
+import queue
+import threading
+import time as time_module
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class BatchQueue:
+    """
+    Items waiting for ``handle(batch)``. One daemon thread takes up to
+    ``batch_size`` of them at a time, waiting at most ``flush_interval``
+    seconds after the first for more to arrive. A batch whose handler
+    raises is logged and dropped.
+    """
+
+    def __init__(self, handle, batch_size=200, flush_interval=0.2, name='notifications'):
+        self.handle = handle
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.name = name
+        self._items = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def put(self, items):
+        for item in items:
+            self._items.put(item)
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def join(self):
+        """Block until every queued item has been handled (or dropped)."""
+        self._items.join()
+
+    def _next_batch(self):
+        batch = [self._items.get()]
+        deadline = time_module.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self._items.get(timeout=max(deadline - time_module.monotonic(), 0)))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            close_old_connections()
+            try:
+                self.handle(batch)
+            except Exception:
+                logger.exception('%s: dropped a batch of %d', self.name, len(batch))
+            finally:
+                close_old_connections()
+                for _ in batch:
+                    self._items.task_done()
@@ -0,0 +1,159 @@
+"""
+Notification push brokers.
+
+The fan-out publishes every notification it writes to the configured
+broker; each open stream (``notifications.views.notification_stream``)
+subscribes for its user and forwards what arrives. Chosen with the
+``NOTIFICATION_BROKER`` setting, in the same shape as ``CACHES``::
+
+    NOTIFICATION_BROKER = {
+        'BACKEND': 'notifications.broker.InMemoryBroker',
+        'OPTIONS': {'max_queue': 100},
+    }
+
+``InMemoryBroker`` only reaches streams served by the same process, which
+fits a single ASGI worker; more workers need a backend over a shared
+channel (Redis pub/sub, Postgres LISTEN) implementing the same two
+methods. Streams replay from the database on reconnect, so a missed
+message costs latency, not data.
+"""
+
+import asyncio
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BROKER = {'BACKEND': 'notifications.broker.InMemoryBroker', 'OPTIONS': {}}
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def payload(notification):
+    """The JSON-ready form of a notification pushed to streams."""
+    return {
+        'id': notification.pk,
+        'notification_type': notification.notification_type,
+        'title': notification.title,
+        'message': notification.message,
+        'link': notification.link,
+        'is_read': notification.is_read,
+        'created_at': notification.created_at.isoformat(),
+    }
+
+
+class Subscription:
+    """
+    Messages for one user, bound to the event loop that subscribed. Any
+    thread may deliver; only that loop reads. When the reader falls more
+    than ``maxsize`` messages behind, newer ones are dropped.
+    """
+
+    def __init__(self, broker, user_id, maxsize):
+        self.broker = broker
+        self.user_id = user_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize)
+
+    def deliver(self, message):
+        try:
+            self.loop.call_soon_threadsafe(self._put, message)
+        except RuntimeError:
+            # The loop has closed; the stream is gone
+            self.close()
+
+    def _put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            logger.debug('Dropped a notification for user %s: stream is behind', self.user_id)
+
+    async def get(self, timeout):
+        """The next message; raises TimeoutError after ``timeout`` seconds without one."""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class BaseBroker:
+    def __init__(self, **options):
+        self.options = options
+
+    def publish(self, user_id, message):
+        """Send ``message`` to every stream of ``user_id``; callable from any thread."""
+        raise NotImplementedError
+
+    def subscribe(self, user_id):
+        """Return a Subscription for ``user_id``; called from the stream's event loop."""
+        raise NotImplementedError
+
+    def unsubscribe(self, subscription):
+        raise NotImplementedError
+
+
+class InMemoryBroker(BaseBroker):
+    """Delivers to the streams of this process only."""
+
+    def __init__(self, max_queue=100, **options):
+        super().__init__(**options)
+        self.max_queue = max_queue
+        self._subscriptions = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, user_id, message):
+        with self._lock:
+            subscriptions = list(self._subscriptions.get(user_id, ()))
+        for subscription in subscriptions:
+            subscription.deliver(message)
+
+    def subscribe(self, user_id):
+        subscription = Subscription(self, user_id, self.max_queue)
+        with self._lock:
+            self._subscriptions[user_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = self._subscriptions.get(subscription.user_id)
+            if subscriptions is not None:
+                subscriptions.discard(subscription)
+                if not subscriptions:
+                    del self._subscriptions[subscription.user_id]
+
+    def subscriber_count(self, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                return len(self._subscriptions.get(user_id, ()))
+            return sum(len(subscriptions) for subscriptions in self._subscriptions.values())
+
+
+def get_broker():
+    """The configured broker; one shared instance per process."""
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            config = getattr(settings, 'NOTIFICATION_BROKER', DEFAULT_BROKER)
+            _broker = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        return _broker
+
+
+def publish_notifications(notifications):
+    broker = get_broker()
+    for notification in notifications:
+        if notification.pk is not None:
+            broker.publish(notification.user_id, payload(notification))
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    global _broker
+    if setting == 'NOTIFICATION_BROKER':
+        _broker = None
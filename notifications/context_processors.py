@@ -0,0 +1,10 @@
+from django.core.handlers.asgi import ASGIRequest
+
+
+def notification_stream(request):
+    """
+    Whether pages may hold the notification stream open. Only under ASGI,
+    where a waiting stream costs no worker; under WSGI the bell polls the
+    cached unread count instead.
+    """
+    return {'notification_stream': isinstance(request, ASGIRequest)}
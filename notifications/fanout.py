@@ -0,0 +1,167 @@
+"""
+Notification fan-out.
+
+The booking, payment and review signal handlers in
+``notifications.signals`` call ``notify(event, booking_ids)``. Once the
+surrounding transaction commits, the events are put on an in-process
+queue; a background thread drains it in batches, loads the bookings of a
+batch with one query, renders a Notification per recipient and writes
+them with one ``bulk_create``, then publishes them to open streams
+(``notifications.broker``) and queues their emails
+(``notifications.mail``). Request paths only pay for an ``on_commit``
+hook.
+
+Configured with the ``NOTIFICATION_QUEUE`` setting::
+
+    NOTIFICATION_QUEUE = {'ENABLED': True, 'BATCH_SIZE': 200, 'FLUSH_INTERVAL': 0.2}
+
+With ``ENABLED`` False the notifications are written inline at commit
+instead. Events still queued when a process exits are lost: notifications
+are a convenience, not a record.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import transaction
+from django.dispatch import receiver
+from django.urls import reverse
+
+from bookings.models import Booking
+from bookings.scheduling import LOCK_ATTEMPTS, retry_on_lock
+from . import mail
+from .batching import BatchQueue
+from .broker import publish_notifications
+from .inbox import notifications_added
+from .models import Notification
+
+DEFAULT_QUEUE = {'ENABLED': True, 'BATCH_SIZE': 200, 'FLUSH_INTERVAL': 0.2}
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def _when(booking):
+    return f"{booking.booking_date:%d %b %Y} at {booking.booking_time:%H:%M}"
+
+
+def _booking_created(booking):
+    return [(
+        booking.advocate.user, 'New booking request',
+        f"{booking.client.get_full_name() or booking.client.username} booked a "
+        f"{booking.get_service_type_display().lower()} on {_when(booking)}.",
+    )]
+
+
+def _booking_confirmed(booking):
+    return [(
+        booking.client, 'Booking confirmed',
+        f"{booking.advocate} confirmed your booking on {_when(booking)}.",
+    )]
+
+
+def _booking_cancelled(booking):
+    message = f"The booking on {_when(booking)} was cancelled."
+    if booking.cancellation_reason:
+        message += f" Reason: {booking.cancellation_reason}"
+    return [(booking.client, 'Booking cancelled', message), (booking.advocate.user, 'Booking cancelled', message)]
+
+
+def _payment_received(booking):
+    return [(
+        booking.advocate.user, 'Payment received',
+        f"Payment of ₹{booking.total_fee} received for the booking on {_when(booking)}.",
+    )]
+
+
+def _review_received(booking):
+    return [(
+        booking.advocate.user, 'New review',
+        f"{booking.client.get_full_name() or booking.client.username} reviewed the booking on {_when(booking)}.",
+    )]
+
+
+# Event name (a Notification type) -> recipients and texts for a booking
+EVENTS = {
+    'booking_created': _booking_created,
+    'booking_confirmed': _booking_confirmed,
+    'booking_cancelled': _booking_cancelled,
+    'payment_received': _payment_received,
+    'review_received': _review_received,
+}
+
+
+def build_notifications(events):
+    """Unsaved Notifications for (event, booking_id) pairs; bookings deleted since are skipped."""
+    bookings = Booking.objects.select_related('client', 'advocate__user').in_bulk(
+        {booking_id for _, booking_id in events}
+    )
+    notifications = []
+    for event, booking_id in events:
+        booking = bookings.get(booking_id)
+        if booking is None:
+            continue
+        link = reverse('booking_detail', args=[booking_id])
+        notifications.extend(
+            Notification(user=user, notification_type=event, title=title, message=message, link=link)
+            for user, title, message in EVENTS[event](booking)
+        )
+    return notifications
+
+
+def write_notifications(events, attempts=LOCK_ATTEMPTS):
+    """Render and insert the notifications for ``events``, retrying on lock contention."""
+    notifications = retry_on_lock(
+        lambda: Notification.objects.bulk_create(build_notifications(events)), attempts,
+    )
+    notifications_added(notifications)
+    publish_notifications(notifications)
+    mail.notifications_written(notifications)
+    return notifications
+
+
+def _config():
+    return {**DEFAULT_QUEUE, **getattr(settings, 'NOTIFICATION_QUEUE', {})}
+
+
+def get_queue():
+    """The process-wide notification queue."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            config = _config()
+            _queue = BatchQueue(
+                lambda events: write_notifications(events, attempts=LOCK_ATTEMPTS * 4),
+                config['BATCH_SIZE'], config['FLUSH_INTERVAL'],
+            )
+        return _queue
+
+
+def _deliver(events):
+    if _config()['ENABLED']:
+        get_queue().put(events)
+    else:
+        write_notifications(events)
+
+
+def notify(event, booking_ids):
+    """Notify the people involved in ``booking_ids`` of ``event`` once the current transaction commits."""
+    events = [(event, booking_id) for booking_id in booking_ids]
+    if events:
+        # A failed notification must not fail the request that caused it
+        transaction.on_commit(lambda: _deliver(events), robust=True)
+
+
+def flush():
+    """Wait for the queued notifications to be written."""
+    if _queue is not None:
+        _queue.join()
+
+
+@receiver(setting_changed)
+def reset_queue(setting, **kwargs):
+    global _queue
+    if setting == 'NOTIFICATION_QUEUE':
+        flush()
+        _queue = None
@@ -0,0 +1,74 @@
+"""
+Unread notification counts.
+
+The navbar asks for the unread count on every page, so it is served from
+a per-user counter in the cache instead of a COUNT over Notification. A
+missing counter is computed once (from the inbox index) and cached.
+Whatever changes a user's unread notifications drops the counter, to be
+recounted on the next read: the fan-out writing new ones, ``mark_read``,
+``mark_all_read`` and single saves or deletes (the admin). Counters are
+never incremented in place, since ``incr`` is a non-atomic
+read-modify-write on some backends and lost updates would leave the
+badge drifting; the timeout bounds a recount that races a change.
+
+Counters must live in a cache every worker shares (``CACHES``); with a
+per-process LocMemCache the other workers would never see them move, so
+the count then comes from the indexed COUNT on every read.
+"""
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+
+from .models import Notification
+
+UNREAD_CACHE_TIMEOUT = 60 * 5
+
+
+def _key(user_id):
+    return f'notifications:unread:{user_id}'
+
+
+def _counters_shared():
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def _count(user_id):
+    return Notification.objects.filter(user_id=user_id, is_read=False).count()
+
+
+def unread_count(user_id):
+    if not _counters_shared():
+        return _count(user_id)
+    count = cache.get(_key(user_id))
+    if count is None:
+        count = _count(user_id)
+        cache.set(_key(user_id), count, UNREAD_CACHE_TIMEOUT)
+    return max(count, 0)
+
+
+def forget_unread(user_id):
+    cache.delete(_key(user_id))
+
+
+def notifications_added(notifications):
+    """Drop the counters of the users freshly written notifications went to."""
+    keys = {_key(notification.user_id) for notification in notifications if not notification.is_read}
+    if keys:
+        cache.delete_many(keys)
+
+
+def mark_read(user_id, notification_ids):
+    """Mark some of a user's notifications read with one UPDATE; returns how many changed."""
+    updated = Notification.objects.filter(user_id=user_id, pk__in=notification_ids, is_read=False).update(
+        is_read=True,
+    )
+    if updated:
+        forget_unread(user_id)
+    return updated
+
+
+def mark_all_read(user_id):
+    """Mark every unread notification of a user read with one UPDATE."""
+    updated = Notification.objects.filter(user_id=user_id, is_read=False).update(is_read=True)
+    forget_unread(user_id)
+    return updated
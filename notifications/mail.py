@@ -0,0 +1,163 @@
+"""
+Notification emails.
+
+Each user picks one of ``User.NOTIFICATION_EMAIL_CHOICES``. For
+``instant`` users the fan-out queues an email per notification it
+writes. A background thread sends them in batches, each batch over one
+backend connection (one SMTP session) rather than one per email. For
+``digest`` users the ``send_notification_digests`` command folds every
+notification not yet emailed into one email per user. Either way
+``Notification.emailed_at`` records what went out.
+
+Configured with the ``NOTIFICATION_EMAIL`` setting::
+
+    NOTIFICATION_EMAIL = {'QUEUED': True, 'BATCH_SIZE': 50, 'FLUSH_INTERVAL': 1.0}
+
+With ``QUEUED`` False instant emails are sent inline by the fan-out.
+"""
+
+import threading
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.core.signals import setting_changed
+from django.db.models import Count, F, Max, Window
+from django.db.models.functions import RowNumber
+from django.dispatch import receiver
+from django.utils import timezone
+
+from accounts.models import User
+from .batching import BatchQueue
+from .models import Notification
+
+DEFAULT_EMAIL = {'QUEUED': True, 'BATCH_SIZE': 50, 'FLUSH_INTERVAL': 1.0}
+DIGEST_BATCH_SIZE = 200
+# Notifications listed (and loaded) per digest; older ones are counted and
+# marked emailed all the same
+DIGEST_MAX_ITEMS = 50
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def _config():
+    return {**DEFAULT_EMAIL, **getattr(settings, 'NOTIFICATION_EMAIL', {})}
+
+
+def _url(link):
+    return f"{settings.SITE_URL.rstrip('/')}{link}" if link else settings.SITE_URL
+
+
+def notification_email(notification, email):
+    body = f"{notification.message}\n\n{_url(notification.link)}\n"
+    return EmailMessage(notification.title, body, to=[email])
+
+
+def digest_email(user, notifications, total=None):
+    """One email listing ``notifications``, newest first, out of ``total`` new ones."""
+    total = len(notifications) if total is None else total
+    lines = [f"Hello {user.get_full_name()},", '', f"You have {total} new notifications:", '']
+    for notification in notifications[:DIGEST_MAX_ITEMS]:
+        lines.append(f"- {notification.title}: {notification.message}")
+        lines.append(f"  {_url(notification.link)}")
+    if total > DIGEST_MAX_ITEMS:
+        lines.append(f"...and {total - DIGEST_MAX_ITEMS} more.")
+    subject = f"{total} new notifications" if total > 1 else notifications[0].title
+    return EmailMessage(subject, '\n'.join(lines) + '\n', to=[user.email])
+
+
+def send_batch(messages):
+    """Send ``messages`` over one backend connection; returns how many were sent."""
+    with get_connection() as connection:
+        return connection.send_messages(messages) or 0
+
+
+def send_instant(items):
+    """Send (notification_id, EmailMessage) pairs and mark them emailed."""
+    send_batch([message for _, message in items])
+    Notification.objects.filter(pk__in=[notification_id for notification_id, _ in items]).update(
+        emailed_at=timezone.now(),
+    )
+
+
+def get_queue():
+    """The process-wide outbound mail queue."""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            config = _config()
+            _queue = BatchQueue(send_instant, config['BATCH_SIZE'], config['FLUSH_INTERVAL'], name='notification-mail')
+        return _queue
+
+
+def notifications_written(notifications):
+    """
+    Queue the emails of freshly written notifications whose recipients
+    want one each. Their ``user`` must be loaded, as the fan-out does.
+    """
+    items = [
+        (notification.pk, notification_email(notification, notification.user.email))
+        for notification in notifications
+        if notification.pk is not None
+        and notification.user.notification_emails == 'instant' and notification.user.email
+    ]
+    if not items:
+        return
+    if _config()['QUEUED']:
+        get_queue().put(items)
+    else:
+        send_instant(items)
+
+
+def send_digests(batch_size=DIGEST_BATCH_SIZE, progress=None):
+    """
+    Email every digest user their notifications not emailed yet, one
+    email each. Users are walked in primary-key chunks and each chunk
+    goes out over one connection; only the newest ``DIGEST_MAX_ITEMS`` of
+    each user's notifications are loaded. Returns (emails sent,
+    notifications).
+    """
+    emails = folded = 0
+    last_id = 0
+    while True:
+        users = list(
+            User.objects.filter(pk__gt=last_id, notification_emails='digest').exclude(email='')
+            .order_by('pk')[:batch_size]
+        )
+        if not users:
+            break
+        last_id = users[-1].pk
+        unsent = Notification.objects.filter(user__in=users, emailed_at__isnull=True)
+        counts = list(unsent.values('user_id').annotate(total=Count('id'), newest=Max('id')).order_by())
+        if not counts:
+            continue
+        totals = {row['user_id']: row['total'] for row in counts}
+        newest = max(row['newest'] for row in counts)
+        pending = {}
+        listed = unsent.filter(pk__lte=newest).annotate(
+            position=Window(RowNumber(), partition_by=F('user_id'), order_by=[F('created_at').desc(), F('id').desc()]),
+        ).filter(position__lte=DIGEST_MAX_ITEMS).order_by('user_id', '-created_at', '-id')
+        for notification in listed:
+            pending.setdefault(notification.user_id, []).append(notification)
+        # Mark before sending: a digest is better lost than sent twice
+        folded += unsent.filter(pk__lte=newest).update(emailed_at=timezone.now())
+        emails += send_batch([
+            digest_email(user, pending[user.pk], totals[user.pk]) for user in users if user.pk in pending
+        ])
+        if progress:
+            progress(emails, folded)
+    return emails, folded
+
+
+def flush():
+    """Wait for the queued emails to be sent."""
+    if _queue is not None:
+        _queue.join()
+
+
+@receiver(setting_changed)
+def reset_queue(setting, **kwargs):
+    global _queue
+    if setting == 'NOTIFICATION_EMAIL':
+        flush()
+        _queue = None
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from notifications import mail
+
+
+class Command(BaseCommand):
+    help = 'Email digest users one message folding their notifications not emailed yet (run daily)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=mail.DIGEST_BATCH_SIZE, help='Users per chunk.')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(emails, folded):
+            if verbosity > 1:
+                self.stdout.write(f'Sent {emails} digests covering {folded} notifications')
+
+        emails, folded = mail.send_digests(options['batch_size'], progress)
+        self.stdout.write(self.style.SUCCESS(f'Sent {emails} digests covering {folded} notifications.'))
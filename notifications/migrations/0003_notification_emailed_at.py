@@ -0,0 +1,27 @@
+# Generated by Django 6.0 on 2026-10-18 21:00
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def mark_existing_emailed(apps, schema_editor):
+    # Notifications from before emails were sent are not owed one: without
+    # this the first digest run would mail every user's whole history
+    Notification = apps.get_model('notifications', 'Notification')
+    Notification.objects.filter(emailed_at__isnull=True).update(emailed_at=F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notifications', '0002_notification_inbox_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='emailed_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(mark_existing_emailed, migrations.RunPython.noop),
+    ]
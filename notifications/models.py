@@ -18,9 +18,15 @@ class Notification(models.Model):
     is_read = models.BooleanField(default=False)
     link = models.CharField(max_length=200, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Set once the notification went out by email, alone or in a digest
+    emailed_at = models.DateTimeField(null=True, blank=True, editable=False)
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # The inbox (unread first or all) and the unread count
+            models.Index(fields=['user', 'is_read', '-created_at', '-id'], name='notification_inbox_idx'),
+        ]
     
     def __str__(self):
         return f"{self.title} - {self.user.username}"
@@ -0,0 +1,51 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from bookings.models import Booking, Review
+from payments.models import Payment
+from .fanout import notify
+from .inbox import forget_unread
+from .models import Notification
+
+# Booking statuses that notify when a booking moves into them
+STATUS_EVENTS = {'confirmed': 'booking_confirmed', 'cancelled': 'booking_cancelled'}
+
+
+@receiver(post_init, sender=Booking)
+@receiver(post_init, sender=Payment)
+def remember_status(sender, instance, **kwargs):
+    instance._notified_status = instance.__dict__.get('status')
+
+
+@receiver(post_save, sender=Booking)
+def notify_booking_change(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else instance._notified_status
+    instance._notified_status = instance.status
+    if created:
+        notify('booking_created', [instance.pk])
+    if instance.status != previous and instance.status in STATUS_EVENTS:
+        notify(STATUS_EVENTS[instance.status], [instance.pk])
+
+
+@receiver(post_save, sender=Payment)
+def notify_payment_change(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else instance._notified_status
+    instance._notified_status = instance.status
+    if instance.status == 'completed' and previous != 'completed':
+        notify('payment_received', [instance.booking_id])
+
+
+@receiver(post_save, sender=Review)
+def notify_review(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        notify('review_received', [instance.booking_id])
+
+
+@receiver(post_save, sender=Notification)
+@receiver(post_delete, sender=Notification)
+def forget_unread_count(sender, instance, raw=False, **kwargs):
+    # Single saves come from the admin; the fan-out counts its bulk inserts itself
+    forget_unread(instance.user_id)
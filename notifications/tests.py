@@ -1,3 +1,371 @@
-from django.test import TestCase
+import asyncio
+import threading
+import time as time_module
+from datetime import date, time, timedelta
+from io import StringIO
+from unittest import mock
+from asgiref.sync import sync_to_async
+from django.core import mail as outbox
+from django.core.mail.backends.locmem import EmailBackend
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from accounts.models import User
+from bookings.models import Booking, Review
+from testutils.cases import Benchmark
+from testutils.factories import create_advocate, create_booking
+from payments.models import Payment
+from .broker import InMemoryBroker, get_broker
+from .fanout import build_notifications, flush, write_notifications
+from .mail import notification_email, send_batch
+from .models import Notification
+from . import mail
 
-# Create your tests here.
+INLINE = {'ENABLED': False}
+INLINE_EMAIL = {'QUEUED': False}
+
+
+class HandshakeBackend(EmailBackend):
+    """locmem, plus a pause on open() standing in for an SMTP handshake; counts opens per thread."""
+    HANDSHAKE_SECONDS = 0.005
+    opened = []
+
+    def open(self):
+        HandshakeBackend.opened.append(threading.current_thread().name)
+        time_module.sleep(self.HANDSHAKE_SECONDS)
+        return True
+
+
+@override_settings(NOTIFICATION_QUEUE=INLINE)
+class NotificationFanoutTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='notified', user_type='client', first_name='Asha')
+        cls.advocate = create_advocate('notifying')
+
+    def received(self, user):
+        return list(
+            Notification.objects.filter(user=user).order_by('id').values_list('notification_type', flat=True)
+        )
+
+    def test_booking_lifecycle_notifies_both_sides(self):
+        day = date.today() + timedelta(days=4)
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = create_booking(self.advocate, self.client_user, day, time(10, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.status = 'confirmed'
+            booking.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            # Saving again without a status change notifies nobody
+            booking.save()
+            Payment.objects.create(
+                booking=booking, amount=booking.total_fee, payment_method='card',
+                transaction_id='notify-1', status='completed',
+            )
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.status = 'cancelled'
+            booking.cancellation_reason = 'Travelling'
+            booking.save()
+
+        self.assertEqual(self.received(self.advocate.user), ['booking_created', 'payment_received', 'booking_cancelled'])
+        self.assertEqual(self.received(self.client_user), ['booking_confirmed', 'booking_cancelled'])
+        created = Notification.objects.get(user=self.advocate.user, notification_type='booking_created')
+        self.assertIn('Asha booked a legal consultation', created.message)
+        self.assertEqual(created.link, reverse('booking_detail', args=[booking.id]))
+        self.assertTrue(Notification.objects.filter(message__endswith='Reason: Travelling').exists())
+
+    def test_review_notifies_advocate(self):
+        booking = create_booking(self.advocate, self.client_user, date.today(), time(9, 0), status='completed')
+        with self.captureOnCommitCallbacks(execute=True):
+            Review.objects.create(
+                booking=booking, advocate=self.advocate, client=self.client_user, rating=5,
+                professionalism=5, communication=5, expertise=5, comment='Great',
+            )
+        self.assertEqual(self.received(self.advocate.user), ['review_received'])
+
+    def test_rolled_back_changes_notify_nobody(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                create_booking(self.advocate, self.client_user, date.today() + timedelta(days=1), time(9, 0))
+                raise RuntimeError
+        self.assertEqual(callbacks, [])
+        self.assertFalse(Notification.objects.exists())
+
+    def test_batch_is_rendered_with_one_query(self):
+        bookings = [
+            create_booking(self.advocate, self.client_user, date.today() + timedelta(days=1 + i), time(9, 0))
+            for i in range(10)
+        ]
+        events = [('booking_cancelled', booking.id) for booking in bookings] + [('booking_created', 0)]
+        with self.assertNumQueries(1):
+            notifications = build_notifications(events)
+        self.assertEqual(len(notifications), 20)
+
+
+
+@override_settings(NOTIFICATION_QUEUE=INLINE)
+class NotificationStreamTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='listener-client', user_type='client')
+        cls.advocate = create_advocate('listener')
+        cls.booking = create_booking(cls.advocate, cls.client_user, date.today() + timedelta(days=3), time(10, 0))
+        cls.existing = Notification.objects.create(
+            user=cls.advocate.user, notification_type='system', title='Welcome', message='Hi',
+        )
+
+    async def test_broker_delivers_across_threads(self):
+        broker = InMemoryBroker()
+        subscription = broker.subscribe(7)
+        publisher = threading.Thread(target=broker.publish, args=(7, {'id': 1}))
+        publisher.start()
+        publisher.join()
+        self.assertEqual(await subscription.get(1), {'id': 1})
+        with self.assertRaises(TimeoutError):
+            await subscription.get(0.01)
+        subscription.close()
+        self.assertEqual(broker.subscriber_count(), 0)
+
+    async def test_stream_pushes_new_notifications(self):
+        await self.async_client.aforce_login(self.advocate.user)
+        response = await self.async_client.get(reverse('notifications:stream'))
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), f'retry: 5000\nid: {self.existing.pk}\n\n'.encode())
+
+        # Wait on the broker, then write a notification from another thread
+        pending = asyncio.ensure_future(anext(chunks))
+        await asyncio.sleep(0.05)
+        self.assertFalse(pending.done())
+        self.assertEqual(get_broker().subscriber_count(self.advocate.user.id), 1)
+        await sync_to_async(write_notifications)([('booking_created', self.booking.id)])
+        event = (await asyncio.wait_for(pending, 1)).decode()
+        latest = await Notification.objects.filter(user=self.advocate.user).alatest('pk')
+        self.assertTrue(event.startswith(f'id: {latest.pk}\nevent: notification\ndata: '))
+        self.assertIn('"notification_type": "booking_created"', event)
+
+        # A client going away cancels the stream and drops its subscription
+        pending = asyncio.ensure_future(anext(chunks))
+        await asyncio.sleep(0.01)
+        pending.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await pending
+        self.assertEqual(get_broker().subscriber_count(), 0)
+
+    async def test_stream_replays_missed_notifications(self):
+        await self.async_client.aforce_login(self.advocate.user)
+        await sync_to_async(write_notifications)([('booking_created', self.booking.id)])
+        response = await self.async_client.get(
+            reverse('notifications:stream'), headers={'Last-Event-ID': str(self.existing.pk)}
+        )
+        chunks = aiter(response.streaming_content)
+        self.assertEqual(await anext(chunks), b'retry: 5000\n\n')
+        event = (await anext(chunks)).decode()
+        self.assertTrue(event.startswith('id: ') and '"title": "New booking request"' in event)
+        await response.streaming_content.aclose()
+
+    def test_wsgi_tells_the_browser_not_to_reconnect(self):
+        self.client.force_login(self.advocate.user)
+        response = self.client.get(reverse('notifications:stream'))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(get_broker().subscriber_count(), 0)
+
+    async def test_pages_open_the_stream_only_under_asgi(self):
+        await self.async_client.aforce_login(self.advocate.user)
+        response = await self.async_client.get(reverse('home'))
+        self.assertContains(response, 'data-stream-url=')
+        await sync_to_async(self.client.force_login)(self.advocate.user)
+        response = await sync_to_async(self.client.get)(reverse('home'))
+        self.assertNotContains(response, 'data-stream-url=')
+
+    def test_requires_login(self):
+        self.assertEqual(self.client.get(reverse('notifications:stream')).status_code, 401)
+
+
+@override_settings(
+    NOTIFICATION_QUEUE=INLINE, NOTIFICATION_EMAIL=INLINE_EMAIL,
+    EMAIL_BACKEND='notifications.tests.HandshakeBackend', SITE_URL='https://example.com',
+)
+class NotificationMailTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.advocate = create_advocate('mailed')
+        User.objects.filter(pk=cls.advocate.user_id).update(email='advocate@example.com')
+        cls.client_user = User.objects.create_user(
+            username='digested', email='client@example.com', user_type='client', notification_emails='digest',
+        )
+
+    def setUp(self):
+        HandshakeBackend.opened.clear()
+
+    def test_instant_emails_go_out_as_notifications_are_written(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            booking = create_booking(self.advocate, self.client_user, date.today() + timedelta(days=2), time(10, 0))
+        self.assertEqual(len(outbox.outbox), 1)
+        message = outbox.outbox[0]
+        self.assertEqual((message.to, message.subject), (['advocate@example.com'], 'New booking request'))
+        self.assertIn(f'https://example.com/bookings/{booking.id}/', message.body)
+        self.assertIsNotNone(Notification.objects.get(user=self.advocate.user).emailed_at)
+        # The digest user's notification waits for the digest
+        with self.captureOnCommitCallbacks(execute=True):
+            booking.status = 'confirmed'
+            booking.save()
+        self.assertEqual(len(outbox.outbox), 1)
+        self.assertIsNone(Notification.objects.get(user=self.client_user).emailed_at)
+
+    def test_digest_folds_notifications_into_one_email(self):
+        for i in range(3):
+            with self.captureOnCommitCallbacks(execute=True):
+                booking = create_booking(
+                    self.advocate, self.client_user, date.today() + timedelta(days=2 + i), time(10, 0),
+                )
+                booking.status = 'confirmed'
+                booking.save()
+        outbox.outbox.clear()
+        HandshakeBackend.opened.clear()
+
+        call_command('send_notification_digests', stdout=StringIO())
+        self.assertEqual(len(outbox.outbox), 1)
+        self.assertEqual(len(HandshakeBackend.opened), 1)
+        digest = outbox.outbox[0]
+        self.assertEqual((digest.to, digest.subject), (['client@example.com'], '3 new notifications'))
+        self.assertEqual(digest.body.count('- Booking confirmed:'), 3)
+        self.assertFalse(Notification.objects.filter(user=self.client_user, emailed_at__isnull=True).exists())
+
+        out = StringIO()
+        call_command('send_notification_digests', stdout=out)
+        self.assertIn('Sent 0 digests', out.getvalue())
+
+    def test_digest_loads_only_the_listed_notifications(self):
+        Notification.objects.bulk_create([
+            Notification(user=self.client_user, notification_type='system', title=f'Note {i}', message='Hi')
+            for i in range(5)
+        ])
+        outbox.outbox.clear()
+        with mock.patch.object(mail, 'DIGEST_MAX_ITEMS', 2), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(mail.send_digests(), (1, 5))
+        listed = next(query['sql'] for query in queries if 'ROW_NUMBER' in query['sql'])
+        self.assertIn('<= 2', listed)
+        digest = outbox.outbox[0]
+        self.assertEqual(digest.subject, '5 new notifications')
+        self.assertEqual(digest.body.count('- Note '), 2)
+        self.assertIn('...and 3 more.', digest.body)
+        self.assertFalse(Notification.objects.filter(user=self.client_user, emailed_at__isnull=True).exists())
+
+    def test_batch_reuses_one_connection(self):
+        notification = Notification(title='Hello', message='Hi', link='/x/')
+        self.assertEqual(send_batch([notification_email(notification, f'user{i}@example.com') for i in range(20)]), 20)
+        self.assertEqual(len(HandshakeBackend.opened), 1)
+        self.assertEqual(len(outbox.outbox), 20)
+
+class NotificationLatencyBenchmark(Benchmark):
+    """
+    Creates bookings through the booking view with the notification queue
+    on and off, and reports the request latency of each. With the queue
+    on, the request thread must not write notifications itself.
+    """
+    REQUESTS = 20
+
+    def book(self, advocate, first_day):
+        timings = []
+        inserts = 0
+        for i in range(self.REQUESTS):
+            with CaptureQueriesContext(connection) as queries:
+                started = time_module.perf_counter()
+                response = self.client.post(reverse('create_booking', args=[advocate.id]), {
+                    'service_type': 'consultation', 'booking_date': (first_day + timedelta(days=i)).isoformat(),
+                    'booking_time': '10:00', 'duration': 60, 'case_description': 'Case',
+                    'case_type': 'Civil', 'priority': 'normal',
+                })
+                timings.append(time_module.perf_counter() - started)
+            self.assertEqual(response.status_code, 302)
+            inserts += sum('INSERT INTO "notifications_notification"' in query['sql'] for query in queries)
+        return timings, inserts
+
+    def test_queue_keeps_notification_writes_off_the_request_path(self):
+        client_user = User.objects.create_user(username='latency', user_type='client')
+        advocate = create_advocate('latency-advocate')
+        self.client.force_login(client_user)
+        first_day = date.today() + timedelta(days=1)
+
+        with self.settings(NOTIFICATION_QUEUE=INLINE):
+            inline, inline_inserts = self.book(advocate, first_day)
+        with self.settings(NOTIFICATION_QUEUE={'ENABLED': True, 'FLUSH_INTERVAL': 0.05}):
+            queued, queued_inserts = self.book(advocate, first_day + timedelta(days=self.REQUESTS))
+            flush()
+
+        self.assertEqual(inline_inserts, self.REQUESTS)
+        self.assertEqual(queued_inserts, 0)
+        self.assertEqual(Booking.objects.count(), 2 * self.REQUESTS)
+        self.assertEqual(Notification.objects.filter(notification_type='booking_created').count(), 2 * self.REQUESTS)
+
+        self.report('booking requests', f"notifications inline {self.latency(inline)}; queued {self.latency(queued)}")
+
+
+@override_settings(EMAIL_BACKEND='notifications.tests.HandshakeBackend')
+class NotificationMailBenchmark(Benchmark):
+    """
+    Sends notification emails through the locmem backend with a simulated
+    handshake, one connection per message and then in queue-sized batches,
+    and times the advocate's booking confirmation with the email sent
+    inside the request and through the queues.
+    """
+    MESSAGES = 200
+    REQUESTS = 10
+
+    def setUp(self):
+        HandshakeBackend.opened.clear()
+
+    def tearDown(self):
+        super().tearDown()
+        mail.flush()
+
+    def test_batches_raise_throughput_and_leave_requests_alone(self):
+        notification = Notification(title='Hello', message='Hi', link='/x/')
+        messages = [notification_email(notification, f'user{i}@example.com') for i in range(self.MESSAGES)]
+        started = time_module.perf_counter()
+        for message in messages:
+            send_batch([message])
+        one_by_one = time_module.perf_counter() - started
+        batch_size = mail.DEFAULT_EMAIL['BATCH_SIZE']
+        started = time_module.perf_counter()
+        for i in range(0, self.MESSAGES, batch_size):
+            send_batch(messages[i:i + batch_size])
+        batched = time_module.perf_counter() - started
+        self.assertEqual(len(HandshakeBackend.opened), self.MESSAGES + self.MESSAGES // batch_size)
+
+        client_user = User.objects.create_user(username='mail-client', email='client@example.com', user_type='client')
+        advocate = create_advocate('mail-advocate')
+        self.client.force_login(advocate.user)
+        bookings = [
+            create_booking(advocate, client_user, date.today() + timedelta(days=1 + i), time(10, 0))
+            for i in range(2 * self.REQUESTS)
+        ]
+
+        def confirm(bookings):
+            timings = []
+            HandshakeBackend.opened.clear()
+            for booking in bookings:
+                started = time_module.perf_counter()
+                self.client.post(reverse('update_booking_status', args=[booking.id]), {'status': 'confirmed'})
+                timings.append(time_module.perf_counter() - started)
+            return timings, HandshakeBackend.opened.count(threading.current_thread().name)
+
+        with self.settings(NOTIFICATION_QUEUE=INLINE, NOTIFICATION_EMAIL=INLINE_EMAIL):
+            inline, inline_opens = confirm(bookings[:self.REQUESTS])
+        with self.settings(NOTIFICATION_QUEUE={'ENABLED': True}, NOTIFICATION_EMAIL={'QUEUED': True}):
+            queued, queued_opens = confirm(bookings[self.REQUESTS:])
+            flush()
+            mail.flush()
+
+        self.assertEqual(inline_opens, self.REQUESTS)
+        self.assertEqual(queued_opens, 0)
+        self.assertFalse(Notification.objects.filter(user=client_user, emailed_at__isnull=True).exists())
+        self.report(
+            'notification mail',
+            f"{self.MESSAGES / one_by_one:.0f} msg/s one connection each, "
+            f"{self.MESSAGES / batched:.0f} msg/s in batches of {batch_size}; "
+            f"confirmation request {self.latency(inline)} sending inline, {self.latency(queued)} queued",
+        )
@@ -1,3 +1,75 @@
-from django.shortcuts import render
+import asyncio
+import json
 
-# Create your views here.
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+
+from .broker import get_broker, payload
+from .models import Notification
+
+# Seconds between keep-alive comments, so proxies do not drop idle streams
+STREAM_HEARTBEAT = 15
+# Streams end after this long and the browser reconnects with Last-Event-ID
+STREAM_MAX_AGE = 5 * 60
+# Notifications replayed on reconnect
+STREAM_REPLAY_LIMIT = 50
+
+
+def _event(message):
+    return f"id: {message['id']}\nevent: notification\ndata: {json.dumps(message)}\n\n"
+
+
+async def _stream(user_id, last_id, max_age):
+    first = 'retry: 5000\n\n'
+    if last_id is None:
+        # Give the browser a position to resume from on reconnect
+        last_id = await (
+            Notification.objects.filter(user_id=user_id).order_by('-pk').values_list('pk', flat=True).afirst()
+        ) or 0
+        first = f'retry: 5000\nid: {last_id}\n\n'
+    # Subscribe, then replay from the database, so nothing written in between is missed
+    subscription = get_broker().subscribe(user_id)
+    try:
+        yield first
+        missed = Notification.objects.filter(user_id=user_id, pk__gt=last_id).order_by('pk')
+        async for notification in missed[:STREAM_REPLAY_LIMIT]:
+            last_id = notification.pk
+            yield _event(payload(notification))
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_age
+        while (remaining := deadline - loop.time()) > 0:
+            try:
+                message = await subscription.get(min(STREAM_HEARTBEAT, remaining))
+            except TimeoutError:
+                yield ': keepalive\n\n'
+                continue
+            if message['id'] > last_id:
+                last_id = message['id']
+                yield _event(message)
+    finally:
+        subscription.close()
+
+
+async def notification_stream(request):
+    """
+    Server-Sent Events stream of the user's new notifications. Waiting
+    streams hold no thread or database connection, so one ASGI worker
+    serves thousands. Under WSGI every open stream would hold a worker
+    thread, so it answers 204 No Content, which tells EventSource not to
+    reconnect; pages served under WSGI poll the unread count instead.
+    """
+    user = await request.auser()
+    if not user.is_authenticated:
+        return HttpResponse(status=401)
+    last_id = request.headers.get('Last-Event-ID') or request.GET.get('last_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        last_id = None
+    if not isinstance(request, ASGIRequest):
+        return HttpResponse(status=204)
+    response = StreamingHttpResponse(_stream(user.id, last_id, STREAM_MAX_AGE), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
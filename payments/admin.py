@@ -1,9 +1,32 @@
 from django.contrib import admin
-from .models import Payment
+from .models import Payment, PaymentLedgerEntry
+from .refunds import refund_in_batches
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ['id', 'booking', 'amount', 'payment_method', 'status', 'payment_date']
     list_filter = ['status', 'payment_method', 'payment_date']
-    search_fields = ['booking__id', 'transaction_id']
-    readonly_fields = ['created_at', 'updated_at']
+    search_fields = ['booking__id', 'transaction_id', 'gateway_reference', 'booking__advocate__user__username']
+    readonly_fields = ['idempotency_key', 'gateway_reference', 'created_at', 'updated_at']
+    actions = ['refund_payments']
+    
+    @admin.action(description='Refund selected payments and cancel their bookings')
+    def refund_payments(self, request, queryset):
+        refunded = refund_in_batches(queryset, reason=f'Refunded by {request.user.username}')
+        skipped = queryset.count() - refunded
+        self.message_user(request, f'Refunded {refunded} payments; {skipped} were not eligible.')
+
+@admin.register(PaymentLedgerEntry)
+class PaymentLedgerEntryAdmin(admin.ModelAdmin):
+    list_display = ['id', 'payment', 'event', 'from_status', 'to_status', 'amount', 'created_at']
+    list_filter = ['event', 'created_at']
+    search_fields = ['payment__id', 'idempotency_key']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
@@ -0,0 +1,119 @@
+"""
+Booking/Payment consistency checks.
+
+The Payment row is the source of truth (every change to it is in the
+ledger); a booking's ``payment_status``, and its ``status`` where payment
+decides it, are derived from it:
+
+* completed payment -> ``paid``, and a pending booking becomes confirmed;
+* refunded payment  -> ``refunded``, and the booking is cancelled;
+* anything else, or no payment -> ``pending``.
+
+``reconcile_chunk`` checks one primary-key range of bookings (joined to
+their payments) without locks, then re-reads and fixes only the
+mismatched rows in a short transaction with one bulk UPDATE per kind of
+fix. Memory and lock time are bounded by the chunk size.
+"""
+
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from bookings.bitmaps import refresh_days
+from bookings.models import Booking
+
+DEFAULT_BATCH_SIZE = 1000
+
+PAYMENT_TO_BOOKING = {'completed': 'paid', 'refunded': 'refunded'}
+
+_FIELDS = ('pk', 'payment_status', 'status', 'payment__status', 'advocate_id', 'booking_date')
+
+
+def expected_state(payment_status, booking_status):
+    """The (payment_status, status) a booking should have for its payment's status."""
+    expected = PAYMENT_TO_BOOKING.get(payment_status, 'pending')
+    if payment_status == 'refunded':
+        return expected, 'cancelled'
+    if payment_status == 'completed' and booking_status == 'pending':
+        return expected, 'confirmed'
+    return expected, booking_status
+
+
+def _mismatches(rows):
+    """{(payment_status, status): [row, ...]} of rows whose booking needs fixing."""
+    fixes = defaultdict(list)
+    for row in rows:
+        _, booking_payment_status, booking_status, payment_status, _, _ = row
+        expected = expected_state(payment_status, booking_status)
+        if expected != (booking_payment_status, booking_status):
+            fixes[expected].append(row)
+    return fixes
+
+
+def describe(row, expected):
+    """Short label for a kind of mismatch, e.g. 'paid->pending' or 'status pending->confirmed'."""
+    _, booking_payment_status, booking_status, _, _, _ = row
+    if booking_payment_status != expected[0]:
+        return f'{booking_payment_status}->{expected[0]}'
+    return f'status {booking_status}->{expected[1]}'
+
+
+def reconcile_chunk(after_id, batch_size, dry_run=False):
+    """
+    Check the next ``batch_size`` bookings with pk > ``after_id``. Returns
+    (last pk seen or None when done, rows checked, Counter of fixes).
+    """
+    rows = list(
+        Booking.objects.filter(pk__gt=after_id).order_by('pk').values_list(*_FIELDS)[:batch_size]
+    )
+    if not rows:
+        return None, 0, Counter()
+    last_id = rows[-1][0]
+    fixes = _mismatches(rows)
+    if not fixes or dry_run:
+        return last_id, len(rows), Counter(
+            describe(row, expected) for expected, found in fixes.items() for row in found
+        )
+
+    fixed = Counter()
+    with transaction.atomic():
+        # Re-check the suspects under lock; they may have been fixed meanwhile
+        suspects = [row[0] for found in fixes.values() for row in found]
+        locked = list(
+            Booking.objects.select_for_update(of=('self',)).filter(pk__in=suspects)
+            .order_by('pk').values_list(*_FIELDS)
+        )
+        now = timezone.now()
+        cancelled_days = set()
+        for (payment_status, status), found in _mismatches(locked).items():
+            Booking.objects.filter(pk__in=[row[0] for row in found]).update(
+                payment_status=payment_status, status=status, updated_at=now,
+            )
+            fixed.update(describe(row, (payment_status, status)) for row in found)
+            if status == 'cancelled':
+                cancelled_days.update((row[4], row[5]) for row in found)
+        # Bulk updates skip the Booking signals that keep bitmaps current
+        if cancelled_days:
+            refresh_days(cancelled_days)
+    return last_id, len(rows), fixed
+
+
+def reconcile(batch_size=DEFAULT_BATCH_SIZE, dry_run=False, progress=None):
+    """
+    Check every booking against its payment and fix the ones that drifted
+    (or only count them with ``dry_run``). ``progress(checked, fixes)`` is
+    called after each chunk. Returns (bookings checked, Counter of fixes).
+    """
+    checked = 0
+    fixes = Counter()
+    last_id = 0
+    while True:
+        last_id, count, fixed = reconcile_chunk(last_id, batch_size, dry_run)
+        if last_id is None:
+            break
+        checked += count
+        fixes.update(fixed)
+        if progress:
+            progress(checked, fixes)
+    return checked, fixes
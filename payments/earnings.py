@@ -0,0 +1,143 @@
+"""
+Earnings rollups.
+
+EarningsRollup keeps, per advocate, day and payment status, the number of
+payments and their amount and refund totals. Earnings pages then read one
+row per day and status instead of scanning the payment history. The day
+is the local date of ``payment_date``; only completed and refunded
+payments are rolled up.
+
+Saved payments are applied incrementally by the handlers in
+``payments.signals`` with ``UPDATE ... SET x = x + n``; bulk refunds call
+``apply_bulk_refund`` themselves. ``backfill_earnings`` rebuilds the
+table from history.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, IntegerField, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncDate, TruncMonth
+from django.utils import timezone
+
+from book_my_advocate.counters import increment_or_create
+from .models import EarningsRollup, Payment
+
+ROLLUP_STATUSES = ('completed', 'refunded')
+ZERO = Decimal('0.00')
+
+_MONEY = DecimalField(max_digits=12, decimal_places=2)
+
+
+def rollup_state(payment):
+    """(status, day, amount, refund_amount) as the rollups count a payment, or None."""
+    data = payment.__dict__
+    if data.get('status') not in ROLLUP_STATUSES or data.get('payment_date') is None:
+        return None
+    return (
+        data['status'], timezone.localdate(data['payment_date']),
+        data.get('amount') or ZERO, data.get('refund_amount') or ZERO,
+    )
+
+
+def apply_delta(advocate_id, day, status, sign, amount, refund_amount, count=1):
+    """Add (sign=1) or remove (sign=-1) ``count`` payments from one rollup row."""
+    updates = {
+        'payment_count': F('payment_count') + sign * count,
+        'amount': F('amount') + sign * amount,
+        'refund_amount': F('refund_amount') + sign * refund_amount,
+    }
+    rollup = EarningsRollup.objects.filter(advocate_id=advocate_id, day=day, status=status)
+    if sign < 0:
+        rollup.update(**updates)
+        return
+    increment_or_create(
+        rollup, updates, advocate_id=advocate_id, day=day, status=status, payment_count=count,
+        amount=amount, refund_amount=refund_amount,
+    )
+
+
+def payment_changed(advocate_id, previous, current):
+    """Move a payment between rollup rows; states come from ``rollup_state``."""
+    if previous == current:
+        return
+    if previous:
+        status, day, amount, refund_amount = previous
+        apply_delta(advocate_id, day, status, -1, amount, refund_amount)
+    if current:
+        status, day, amount, refund_amount = current
+        apply_delta(advocate_id, day, status, 1, amount, refund_amount)
+
+
+def apply_bulk_refund(payments):
+    """
+    Move fully refunded payments, given as (advocate_id, payment_date,
+    amount), from the completed to the refunded rows: two UPDATEs per
+    advocate-day rather than per payment.
+    """
+    groups = defaultdict(lambda: [0, ZERO])
+    for advocate_id, payment_date, amount in payments:
+        if payment_date is not None:
+            group = groups[(advocate_id, timezone.localdate(payment_date))]
+            group[0] += 1
+            group[1] += amount
+    for (advocate_id, day), (count, amount) in groups.items():
+        apply_delta(advocate_id, day, 'completed', -1, amount, ZERO, count=count)
+        apply_delta(advocate_id, day, 'refunded', 1, amount, amount, count=count)
+
+
+def earnings_by_period(advocate_id, start, end, period='day'):
+    """
+    Earnings between ``start`` and ``end`` inclusive, one dict per day (or
+    per month with ``period='month'``) that had payments: ``period``,
+    ``payments`` and ``earned`` for completed payments, ``refunds`` and
+    ``refunded`` for refunded ones.
+    """
+    completed = Q(status='completed')
+    refunded = Q(status='refunded')
+    return list(
+        EarningsRollup.objects.filter(advocate_id=advocate_id, day__range=(start, end))
+        .annotate(period=TruncMonth('day') if period == 'month' else F('day'))
+        .values('period')
+        .annotate(
+            payments=Coalesce(Sum('payment_count', filter=completed), Value(0), output_field=IntegerField()),
+            earned=Coalesce(Sum('amount', filter=completed), Value(ZERO), output_field=_MONEY),
+            refunds=Coalesce(Sum('payment_count', filter=refunded), Value(0), output_field=IntegerField()),
+            refunded=Coalesce(Sum('refund_amount', filter=refunded), Value(ZERO), output_field=_MONEY),
+        )
+        .order_by('period')
+    )
+
+
+def rollup_totals(advocate_ids):
+    """Recompute the rollup rows of ``advocate_ids`` from their payments."""
+    rows = (
+        Payment.objects.filter(
+            booking__advocate_id__in=advocate_ids, status__in=ROLLUP_STATUSES, payment_date__isnull=False,
+        )
+        .values(
+            'status', advocate=F('booking__advocate_id'),
+            payment_day=TruncDate('payment_date', tzinfo=timezone.get_current_timezone()),
+        )
+        .annotate(
+            count=Count('id'),
+            total=Sum('amount'),
+            refunded=Coalesce(Sum('refund_amount'), Value(ZERO), output_field=_MONEY),
+        )
+        .order_by()
+    )
+    return [
+        EarningsRollup(
+            advocate_id=row['advocate'], day=row['payment_day'], status=row['status'],
+            payment_count=row['count'], amount=row['total'], refund_amount=row['refunded'],
+        )
+        for row in rows
+    ]
+
+
+def rebuild_rollups(advocate_ids):
+    """Replace the rollup rows of ``advocate_ids`` with fresh totals."""
+    with transaction.atomic():
+        EarningsRollup.objects.filter(advocate_id__in=advocate_ids).delete()
+        EarningsRollup.objects.bulk_create(rollup_totals(advocate_ids), batch_size=500)
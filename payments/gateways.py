@@ -0,0 +1,127 @@
+"""
+Pluggable payment gateways.
+
+The gateway is chosen with the ``PAYMENT_GATEWAY`` setting, in the same
+shape as ``CACHES``::
+
+    PAYMENT_GATEWAY = {
+        'BACKEND': 'payments.gateways.StubGateway',
+        'OPTIONS': {'latency': 0.5, 'failure_rate': 0.1},
+    }
+
+A gateway charges a Payment and, for gateways that report results
+asynchronously, parses their webhook calls. ``charge`` must be idempotent
+on ``payment.idempotency_key`` so a payment settled twice (by a worker
+thread and by ``settle_payments``, say) is only charged once.
+"""
+
+import hashlib
+import hmac
+import json
+import random
+import threading
+import time as time_module
+import uuid
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+DEFAULT_GATEWAY = {'BACKEND': 'payments.gateways.StubGateway', 'OPTIONS': {}}
+
+_gateway = None
+_gateway_lock = threading.Lock()
+
+
+class GatewayError(Exception):
+    """The gateway could not be reached or sent a request we cannot trust."""
+
+
+class GatewayResult:
+    """Outcome of a charge: whether it succeeded and the gateway's reference."""
+
+    def __init__(self, succeeded, reference='', message=''):
+        self.succeeded = succeeded
+        self.reference = reference
+        self.message = message
+
+    def __repr__(self):
+        return f"GatewayResult(succeeded={self.succeeded!r}, reference={self.reference!r})"
+
+
+class BaseGateway:
+    def __init__(self, **options):
+        self.options = options
+
+    def charge(self, payment):
+        """Charge ``payment.amount``; return a GatewayResult or raise GatewayError."""
+        raise NotImplementedError
+
+    def parse_webhook(self, request):
+        """Verify a webhook call; return (transaction_id, GatewayResult) or raise GatewayError."""
+        raise GatewayError('This gateway does not send webhooks.')
+
+
+class StubGateway(BaseGateway):
+    """
+    Local stand-in for a real gateway, for development and offline load
+    tests. Each charge sleeps for ``latency`` seconds (plus up to
+    ``jitter``) and is declined with probability ``failure_rate``.
+    Webhooks are signed with an HMAC-SHA256 of the body under
+    ``webhook_secret`` in the ``X-Stub-Signature`` header.
+    """
+    SIGNATURE_HEADER = 'X-Stub-Signature'
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, webhook_secret='', **options):
+        super().__init__(**options)
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.webhook_secret = webhook_secret or settings.SECRET_KEY
+        self._charges = {}
+        self._lock = threading.Lock()
+
+    def charge(self, payment):
+        with self._lock:
+            if payment.idempotency_key in self._charges:
+                return self._charges[payment.idempotency_key]
+        time_module.sleep(self.latency + random.uniform(0, self.jitter))
+        if random.random() < self.failure_rate:
+            result = GatewayResult(False, message='Declined by the stub gateway.')
+        else:
+            result = GatewayResult(True, reference=f'stub_{uuid.uuid4().hex[:16]}')
+        with self._lock:
+            return self._charges.setdefault(payment.idempotency_key, result)
+
+    def sign(self, body):
+        return hmac.new(self.webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+
+    def parse_webhook(self, request):
+        signature = request.headers.get(self.SIGNATURE_HEADER, '')
+        if not hmac.compare_digest(signature, self.sign(request.body)):
+            raise GatewayError('Invalid webhook signature.')
+        try:
+            data = json.loads(request.body)
+            return data['transaction_id'], GatewayResult(
+                data['status'] == 'succeeded', data.get('reference', ''), data.get('message', '')
+            )
+        except (ValueError, KeyError) as exc:
+            raise GatewayError(f'Malformed webhook: {exc}')
+
+
+def get_gateway():
+    """The configured gateway; one shared instance per process."""
+    global _gateway
+    with _gateway_lock:
+        if _gateway is None:
+            config = getattr(settings, 'PAYMENT_GATEWAY', DEFAULT_GATEWAY)
+            _gateway = import_string(config['BACKEND'])(**config.get('OPTIONS', {}))
+        return _gateway
+
+
+@receiver(setting_changed)
+def reset_gateway(setting, **kwargs):
+    global _gateway
+    if setting == 'PAYMENT_GATEWAY':
+        _gateway = None
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from advocates.models import Advocate
+from payments import earnings
+
+
+class Command(BaseCommand):
+    help = "Rebuild advocates' daily earnings rollups from their payment history in batches"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200, help='Advocates per transaction.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        total = Advocate.objects.count()
+        done = 0
+        last_id = 0
+        while True:
+            batch = list(Advocate.objects.filter(pk__gt=last_id).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            earnings.rebuild_rollups(batch)
+            done += len(batch)
+            last_id = batch[-1]
+            self.stdout.write(f'Rebuilt earnings for {done}/{total} advocates')
+
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt earnings rollups for {done} advocates.'))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from payments import consistency
+
+
+class Command(BaseCommand):
+    help = "Find and fix bookings whose payment status disagrees with their payment"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=consistency.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Only report the mismatches.')
+
+    def handle(self, *args, **options):
+        verbosity = options['verbosity']
+
+        def progress(checked, fixes):
+            if verbosity > 1:
+                self.stdout.write(f'Checked {checked} bookings, {sum(fixes.values())} mismatched')
+
+        checked, fixes = consistency.reconcile(options['batch_size'], options['dry_run'], progress)
+        for kind, count in sorted(fixes.items()):
+            self.stdout.write(f'  {kind}: {count}')
+        verb = 'Found' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} {sum(fixes.values())} mismatched bookings out of {checked} checked.'
+        ))
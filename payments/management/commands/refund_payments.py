@@ -0,0 +1,44 @@
+from datetime import date
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from payments import refunds
+from payments.models import Payment
+
+
+class Command(BaseCommand):
+    help = 'Refund completed payments and cancel their bookings in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--advocate', type=int, help='Refund bookings with this advocate id.')
+        parser.add_argument('--booking', type=int, nargs='+', dest='bookings', help='Refund these booking ids.')
+        parser.add_argument(
+            '--since', type=date.fromisoformat,
+            help='Only bookings on or after this date (YYYY-MM-DD, default today).',
+        )
+        parser.add_argument('--until', type=date.fromisoformat, help='Only bookings on or before this date.')
+        parser.add_argument('--reason', default='Advocate unavailable')
+        parser.add_argument('--batch-size', type=int, default=refunds.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true', help='Only count the eligible payments.')
+
+    def handle(self, *args, **options):
+        if not options['advocate'] and not options['bookings']:
+            raise CommandError('Pass --advocate or --booking to choose what to refund.')
+
+        payments = Payment.objects.filter(booking__booking_date__gte=options['since'] or timezone.localdate())
+        if options['advocate']:
+            payments = payments.filter(booking__advocate_id=options['advocate'])
+        if options['bookings']:
+            payments = payments.filter(booking_id__in=options['bookings'])
+        if options['until']:
+            payments = payments.filter(booking__booking_date__lte=options['until'])
+
+        total = refunds.eligible_payments(payments).count()
+        if options['dry_run'] or not total:
+            self.stdout.write(f'{total} payments eligible for refund.')
+            return
+
+        refunded = refunds.refund_in_batches(
+            payments, options['reason'], options['batch_size'],
+            progress=lambda done: self.stdout.write(f'Refunded {done}/{total} payments'),
+        )
+        self.stdout.write(self.style.SUCCESS(f'Refunded {refunded} payments.'))
@@ -0,0 +1,39 @@
+import time as time_module
+from datetime import timedelta
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from payments.models import Payment
+from payments.processing import settle_payment
+
+
+class Command(BaseCommand):
+    help = "Settle payments left in 'processing' through the payment gateway"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--older-than', type=int, default=60,
+            help='Only settle payments submitted at least this many seconds ago (default 60).',
+        )
+        parser.add_argument(
+            '--interval', type=float, default=0,
+            help='Keep running as a worker, polling every INTERVAL seconds.',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            cutoff = timezone.now() - timedelta(seconds=options['older_than'])
+            ids = list(
+                Payment.objects.filter(status='processing', updated_at__lte=cutoff)
+                .order_by('updated_at').values_list('id', flat=True)
+            )
+            outcomes = {}
+            for payment_id in ids:
+                payment = settle_payment(payment_id)
+                if payment is not None:
+                    outcomes[payment.status] = outcomes.get(payment.status, 0) + 1
+            if ids or not options['interval']:
+                summary = ', '.join(f'{count} {status}' for status, count in sorted(outcomes.items())) or 'nothing to do'
+                self.stdout.write(self.style.SUCCESS(f'Settled {len(ids)} payments: {summary}.'))
+            if not options['interval']:
+                break
+            time_module.sleep(options['interval'])
@@ -0,0 +1,31 @@
+# Generated by Django 6.0 on 2026-10-18 20:48
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('advocates', '0004_review_running_sums'),
+        ('payments', '0003_payment_gateway_reference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EarningsRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('failed', 'Failed'), ('refunded', 'Refunded')], max_length=20)),
+                ('payment_count', models.IntegerField(default=0)),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('refund_amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('advocate', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='earnings_rollups', to='advocates.advocate')),
+            ],
+            options={
+                'ordering': ['-day', 'status'],
+                'unique_together': {('advocate', 'day', 'status')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 20:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bookings', '0005_review_advocate_feed_idx'),
+        ('payments', '0004_earnings_rollup'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['-created_at', '-id'], name='payment_recent_idx'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from advocates.models import Advocate
 from bookings.models import Booking
 
 class Payment(models.Model):
@@ -21,6 +22,8 @@ class Payment(models.Model):
     amount = models.DecimalField(max_digits=10, decimal_places=2)
     payment_method = models.CharField(max_length=20, choices=PAYMENT_METHOD_CHOICES)
     transaction_id = models.CharField(max_length=100, unique=True, blank=True)
+    idempotency_key = models.CharField(max_length=64, unique=True, null=True, blank=True, editable=False)
+    gateway_reference = models.CharField(max_length=100, blank=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     payment_date = models.DateTimeField(null=True, blank=True)
     refund_date = models.DateTimeField(null=True, blank=True)
@@ -31,7 +34,70 @@ class Payment(models.Model):
     
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            # Keyset pages and exports of the payment history
+            models.Index(fields=['-created_at', '-id'], name='payment_recent_idx'),
+        ]
     
     def __str__(self):
         return f"Payment #{self.id} - Booking #{self.booking.id}"
 
+
+
+class PaymentLedgerEntry(models.Model):
+    """
+    Append-only record of every payment state change. Rows are written by
+    payments.processing in the same transaction as the change itself and
+    are never updated or deleted.
+    """
+    EVENT_CHOICES = (
+        ('submitted', 'Submitted'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+        ('refunded', 'Refunded'),
+    )
+    
+    payment = models.ForeignKey(Payment, on_delete=models.PROTECT, related_name='ledger_entries')
+    event = models.CharField(max_length=20, choices=EVENT_CHOICES)
+    from_status = models.CharField(max_length=20, blank=True)
+    to_status = models.CharField(max_length=20)
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    idempotency_key = models.CharField(max_length=64, blank=True)
+    note = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['created_at', 'id']
+        verbose_name_plural = 'Payment Ledger Entries'
+    
+    def __str__(self):
+        return f"{self.event} - Payment #{self.payment_id}"
+    
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError('Ledger entries are append-only.')
+        super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        raise ValueError('Ledger entries are append-only.')
+
+
+class EarningsRollup(models.Model):
+    """
+    Per advocate, day and payment status: how many payments there were and
+    their amount and refund totals. The day is the local date the payment
+    was taken. Maintained by payments.earnings as payments change.
+    """
+    advocate = models.ForeignKey(Advocate, on_delete=models.CASCADE, related_name='earnings_rollups')
+    day = models.DateField()
+    status = models.CharField(max_length=20, choices=Payment.STATUS_CHOICES)
+    payment_count = models.IntegerField(default=0)
+    amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    refund_amount = models.DecimalField(max_digits=12, decimal_places=2, default=0)
+    
+    class Meta:
+        unique_together = ['advocate', 'day', 'status']
+        ordering = ['-day', 'status']
+    
+    def __str__(self):
+        return f"{self.advocate_id} @ {self.day} ({self.status})"
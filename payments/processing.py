@@ -0,0 +1,211 @@
+"""
+Idempotent, asynchronous payment writes.
+
+Every payment submission carries an idempotency key: a hidden field minted
+when the payment page is rendered, or an ``Idempotency-Key`` header from
+API and mobile clients. A retried or double-submitted request with a key
+that already moved a payment gets that payment back instead of a second
+charge.
+
+Submission only records a ``processing`` payment and returns; the gateway
+round trip happens off the request. After the submission commits, one of
+``PAYMENT_WORKERS`` background threads settles it through the configured
+gateway (``payments.gateways``). Payments left in ``processing`` (worker
+threads disabled, or a process restarted mid-charge) are picked up by the
+``settle_payments`` command, and gateways that report asynchronously call
+the webhook view. Every path ends in ``apply_gateway_result``, which only
+moves a payment out of ``processing`` once.
+
+State changes happen in one transaction holding the booking's or the
+payment's row lock (``select_for_update``), so concurrent requests for the
+same booking queue behind each other while different bookings never
+contend. Each state change appends a PaymentLedgerEntry in the same
+transaction.
+"""
+
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from bookings.models import Booking
+from bookings.scheduling import LOCK_ATTEMPTS, retry_on_lock
+from .gateways import GatewayError, get_gateway
+from .models import Payment, PaymentLedgerEntry
+
+IDEMPOTENCY_HEADER = 'Idempotency-Key'
+DEFAULT_WORKERS = 2
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+class PaymentError(Exception):
+    """The payment cannot be taken or refunded in its current state."""
+
+
+def new_idempotency_key():
+    return uuid.uuid4().hex
+
+
+def request_idempotency_key(request):
+    """The client's key from the header or the form, or a fresh one."""
+    key = request.headers.get(IDEMPOTENCY_HEADER) or request.POST.get('idempotency_key') or ''
+    return key.strip()[:64] or new_idempotency_key()
+
+
+def record(payment, event, from_status, idempotency_key='', note=''):
+    return PaymentLedgerEntry.objects.create(
+        payment=payment, event=event, from_status=from_status, to_status=payment.status,
+        amount=payment.refund_amount if event == 'refunded' else payment.amount,
+        idempotency_key=idempotency_key or '', note=note,
+    )
+
+
+def _with_retries(write, attempts):
+    """Run ``write()``, retrying with jittered backoff on lock contention or a lost insert race."""
+    return retry_on_lock(write, attempts, retry_on=(IntegrityError,))
+
+
+def _submit_locked(booking_id, payment_method, idempotency_key):
+    with transaction.atomic():
+        booking = Booking.objects.select_for_update().get(pk=booking_id)
+        payment = Payment.objects.filter(booking=booking).first()
+        if payment and (
+            payment.idempotency_key == idempotency_key
+            or payment.status in ('processing', 'completed', 'refunded')
+        ):
+            # A replay, or already in flight or paid under another key: never charge twice
+            return payment
+        if booking.status == 'cancelled':
+            raise PaymentError('This booking has been cancelled.')
+
+        previous = payment.status if payment else ''
+        if payment is None:
+            payment = Payment(booking=booking, transaction_id=str(uuid.uuid4()))
+        payment.amount = booking.total_fee
+        payment.payment_method = payment_method
+        payment.idempotency_key = idempotency_key
+        payment.status = 'processing'
+        payment.save()
+        record(payment, 'submitted', previous, idempotency_key)
+        transaction.on_commit(lambda: dispatch(payment.pk))
+        return payment
+
+
+def submit_payment(booking_id, payment_method, idempotency_key, attempts=LOCK_ATTEMPTS):
+    """
+    Submit a payment for a booking and return its Payment, normally still
+    ``processing``. Repeating a call with the same ``idempotency_key``
+    returns the same payment without charging again; a key already used
+    for another booking raises PaymentError.
+    """
+    def write():
+        # Replays are answered without touching the booking lock
+        replay = Payment.objects.filter(idempotency_key=idempotency_key).first()
+        if replay is None:
+            return _submit_locked(booking_id, payment_method, idempotency_key)
+        if replay.booking_id != booking_id:
+            raise PaymentError('This payment request was already used for another booking.')
+        return replay
+    return _with_retries(write, attempts)
+
+
+def _apply_result_locked(payment_id, result):
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().select_related('booking').get(pk=payment_id)
+        if payment.status != 'processing':
+            # Already settled by another worker or an earlier webhook delivery
+            return payment
+
+        payment.gateway_reference = result.reference
+        if result.succeeded:
+            payment.status = 'completed'
+            payment.payment_date = timezone.now()
+        else:
+            payment.status = 'failed'
+            payment.notes = result.message
+        payment.save()
+
+        if result.succeeded:
+            booking = payment.booking
+            booking.payment_status = 'paid'
+            booking.status = 'confirmed'
+            booking.save(update_fields=['payment_status', 'status', 'updated_at'])
+        record(payment, payment.status, 'processing', payment.idempotency_key, note=result.message)
+        return payment
+
+
+def apply_gateway_result(payment_id, result, attempts=LOCK_ATTEMPTS):
+    """Complete or fail a ``processing`` payment; later results for it are ignored."""
+    return _with_retries(lambda: _apply_result_locked(payment_id, result), attempts)
+
+
+def settle_payment(payment_id):
+    """Charge a ``processing`` payment through the gateway and record the outcome."""
+    payment = _with_retries(lambda: Payment.objects.filter(pk=payment_id, status='processing').first(), LOCK_ATTEMPTS)
+    if payment is None:
+        return None
+    try:
+        result = get_gateway().charge(payment)
+    except GatewayError as exc:
+        # Leave it processing; settle_payments retries it later
+        logger.warning('Gateway error settling payment %s: %s', payment_id, exc)
+        return payment
+    return apply_gateway_result(payment_id, result)
+
+
+def _settle_in_worker(payment_id):
+    close_old_connections()
+    try:
+        settle_payment(payment_id)
+    except Exception:
+        logger.exception('Settling payment %s failed', payment_id)
+    finally:
+        close_old_connections()
+
+
+def dispatch(payment_id):
+    """Hand a submitted payment to the background workers, if there are any."""
+    global _executor
+    workers = getattr(settings, 'PAYMENT_WORKERS', DEFAULT_WORKERS)
+    if not workers:
+        return
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='payments')
+    _executor.submit(_settle_in_worker, payment_id)
+
+
+def _refund_locked(payment_id, reason, idempotency_key):
+    with transaction.atomic():
+        payment = Payment.objects.select_for_update().select_related('booking').get(pk=payment_id)
+        if payment.status == 'refunded':
+            return payment
+        if payment.status != 'completed':
+            raise PaymentError('This payment is not eligible for refund.')
+
+        payment.status = 'refunded'
+        payment.refund_date = timezone.now()
+        payment.refund_amount = payment.amount
+        payment.notes = f"Refund requested. Reason: {reason}"
+        payment.save()
+
+        booking = payment.booking
+        booking.payment_status = 'refunded'
+        booking.status = 'cancelled'
+        booking.cancellation_reason = f"Refund requested: {reason}"
+        booking.save(update_fields=['payment_status', 'status', 'cancellation_reason', 'updated_at'])
+        record(payment, 'refunded', 'completed', idempotency_key, note=reason)
+        return payment
+
+
+def refund_payment(payment_id, reason='', idempotency_key='', attempts=LOCK_ATTEMPTS):
+    """Refund a completed payment in full; refunding twice is a no-op."""
+    return _with_retries(lambda: _refund_locked(payment_id, reason, idempotency_key), attempts)
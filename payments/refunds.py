@@ -0,0 +1,92 @@
+"""
+Batch refunds.
+
+When an advocate becomes unavailable, every upcoming paid booking of
+theirs has to be refunded and cancelled. ``refund_in_batches`` walks the
+completed payments of a queryset in primary-key chunks. For each chunk it
+locks the payments, flips them and their bookings with two bulk UPDATEs,
+and bulk-inserts one ledger entry per payment, all in one transaction.
+A chunk costs the same handful of queries whatever its size.
+
+Bulk updates bypass the Booking and Payment signal handlers, so the
+availability bitmaps and earnings rollups of the affected advocate-days
+are updated, and the cancellations notified, explicitly.
+"""
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from bookings.bitmaps import refresh_days
+from bookings.models import Booking
+from notifications.fanout import notify
+from .earnings import apply_bulk_refund
+from .models import Payment, PaymentLedgerEntry
+from .processing import new_idempotency_key
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def eligible_payments(payments):
+    return payments.filter(status='completed')
+
+
+def _refund_chunk(payment_ids, reason, batch_key):
+    with transaction.atomic():
+        rows = list(
+            eligible_payments(Payment.objects.select_for_update())
+            .filter(pk__in=payment_ids)
+            # Lock in a fixed order so overlapping batches cannot deadlock
+            .order_by('pk')
+            .values_list(
+                'pk', 'amount', 'booking_id', 'booking__advocate_id', 'booking__booking_date', 'payment_date',
+            )
+        )
+        if not rows:
+            return 0
+        now = timezone.now()
+        refunded_ids = [row[0] for row in rows]
+        Payment.objects.filter(pk__in=refunded_ids).update(
+            status='refunded', refund_date=now, refund_amount=F('amount'),
+            notes=f"Refunded in bulk. Reason: {reason}", updated_at=now,
+        )
+        Booking.objects.filter(pk__in=[row[2] for row in rows]).update(
+            payment_status='refunded', status='cancelled',
+            cancellation_reason=f"Refunded: {reason}", updated_at=now,
+        )
+        PaymentLedgerEntry.objects.bulk_create([
+            PaymentLedgerEntry(
+                payment_id=payment_id, event='refunded', from_status='completed', to_status='refunded',
+                amount=amount, idempotency_key=batch_key, note=reason,
+            )
+            for payment_id, amount, _, _, _, _ in rows
+        ])
+        refresh_days({(advocate_id, booking_date) for _, _, _, advocate_id, booking_date, _ in rows})
+        apply_bulk_refund((advocate_id, paid_at, amount) for _, amount, _, advocate_id, _, paid_at in rows)
+        notify('booking_cancelled', [row[2] for row in rows])
+        return len(rows)
+
+
+def refund_in_batches(payments, reason='', batch_size=DEFAULT_BATCH_SIZE, progress=None):
+    """
+    Refund every completed payment in the ``payments`` queryset and cancel
+    its booking. ``progress(done)`` is called after each committed chunk.
+    Payments refunded concurrently are skipped, so rerunning after an
+    interruption picks up where it stopped. Returns the number refunded.
+    """
+    # One key per run ties the ledger entries of a batch together
+    batch_key = f'batch-{new_idempotency_key()}'
+    refunded = 0
+    last_id = 0
+    while True:
+        ids = list(
+            eligible_payments(payments).filter(pk__gt=last_id)
+            .order_by('pk').values_list('pk', flat=True)[:batch_size]
+        )
+        if not ids:
+            break
+        refunded += _refund_chunk(ids, reason, batch_key)
+        last_id = ids[-1]
+        if progress:
+            progress(refunded)
+    return refunded
@@ -0,0 +1,35 @@
+from django.db.models.signals import post_init, post_save, post_delete
+from django.dispatch import receiver
+from bookings.models import Booking
+from .models import Payment
+from . import earnings
+
+
+def _advocate_id(payment):
+    try:
+        return payment.booking.advocate_id
+    except Booking.DoesNotExist:
+        return None
+
+
+@receiver(post_init, sender=Payment)
+def remember_rollup_state(sender, instance, **kwargs):
+    instance._rollup_state = earnings.rollup_state(instance)
+
+
+@receiver(post_save, sender=Payment)
+def update_earnings_for_payment(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    state = earnings.rollup_state(instance)
+    previous = None if created else instance._rollup_state
+    instance._rollup_state = state
+    if state != previous:
+        earnings.payment_changed(_advocate_id(instance), previous, state)
+
+
+@receiver(post_delete, sender=Payment)
+def update_earnings_for_deleted_payment(sender, instance, **kwargs):
+    advocate_id = _advocate_id(instance)
+    if instance._rollup_state and advocate_id:
+        earnings.payment_changed(advocate_id, instance._rollup_state, None)
@@ -1,3 +1,470 @@
-from django.test import TestCase
+import json
+import threading
+from io import StringIO
+import time as time_module
+from datetime import date, time, timedelta
+from decimal import Decimal
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from accounts.models import User
+from bookings.models import Booking
+from book_my_advocate.pagination import encode_cursor
+from testutils.cases import Benchmark, FlushNotificationsMixin
+from testutils.factories import create_advocate, create_booking
+from .consistency import reconcile_chunk
+from .gateways import get_gateway
+from .earnings import earnings_by_period
+from .models import EarningsRollup, Payment, PaymentLedgerEntry
+from .processing import PaymentError, refund_payment, settle_payment, submit_payment
+from .refunds import refund_in_batches
 
-# Create your tests here.
+INSTANT_GATEWAY = {'BACKEND': 'payments.gateways.StubGateway', 'OPTIONS': {'webhook_secret': 'test'}}
+DECLINING_GATEWAY = {'BACKEND': 'payments.gateways.StubGateway', 'OPTIONS': {'failure_rate': 1}}
+
+
+def ledger(payment=None):
+    entries = payment.ledger_entries.all() if payment else PaymentLedgerEntry.objects.all()
+    return list(entries.values_list('event', 'from_status', 'to_status'))
+
+
+@override_settings(PAYMENT_GATEWAY=INSTANT_GATEWAY, PAYMENT_WORKERS=0)
+class PaymentProcessingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='payer', password='pass', user_type='client')
+        cls.advocate = create_advocate('paid')
+        cls.booking = create_booking(cls.advocate, cls.client_user, date.today() + timedelta(days=2), time(10, 0))
+
+    def test_same_key_is_charged_once(self):
+        first = submit_payment(self.booking.id, 'upi', 'key-1')
+        again = submit_payment(self.booking.id, 'upi', 'key-1')
+        other = submit_payment(self.booking.id, 'card', 'key-2')
+        self.assertEqual({first.pk, again.pk, other.pk}, {first.pk})
+        self.assertEqual((other.status, other.payment_method), ('processing', 'upi'))
+
+        settle_payment(first.pk)
+        settle_payment(first.pk)
+        self.assertEqual(ledger(), [('submitted', '', 'processing'), ('completed', 'processing', 'completed')])
+        self.booking.refresh_from_db()
+        self.assertEqual((self.booking.payment_status, self.booking.status), ('paid', 'confirmed'))
+
+    def test_key_used_for_another_booking_is_rejected(self):
+        first = submit_payment(self.booking.id, 'upi', 'key-1')
+        other = create_booking(self.advocate, self.client_user, date.today() + timedelta(days=3), time(10, 0))
+        with self.assertRaises(PaymentError):
+            submit_payment(other.id, 'upi', 'key-1')
+        self.assertFalse(Payment.objects.filter(booking=other).exists())
+
+        self.client.login(username='payer', password='pass')
+        response = self.client.post(
+            reverse('payments:process_payment', args=[other.id]),
+            {'payment_method': 'upi', 'idempotency_key': 'key-1'},
+        )
+        self.assertRedirects(response, reverse('payments:payment_failure', args=[other.id]), fetch_redirect_response=False)
+        self.assertEqual(list(Payment.objects.values_list('pk', flat=True)), [first.pk])
+
+    @override_settings(PAYMENT_GATEWAY=DECLINING_GATEWAY)
+    def test_declined_payment_can_be_retried_with_a_new_key(self):
+        payment = settle_payment(submit_payment(self.booking.id, 'card', 'key-1').pk)
+        self.assertEqual(payment.status, 'failed')
+        self.booking.refresh_from_db()
+        self.assertEqual(self.booking.payment_status, 'pending')
+
+        self.assertEqual(submit_payment(self.booking.id, 'card', 'key-1').status, 'failed')
+        retried = submit_payment(self.booking.id, 'upi', 'key-2')
+        self.assertEqual((retried.pk, retried.status), (payment.pk, 'processing'))
+        self.assertEqual(ledger()[-1], ('submitted', 'failed', 'processing'))
+
+    def test_refund_is_recorded_once(self):
+        payment = settle_payment(submit_payment(self.booking.id, 'card', 'key-1').pk)
+        refund_payment(payment.id, 'Changed plans')
+        refund_payment(payment.id, 'Changed plans')
+        self.assertEqual([event for event, _, _ in ledger(payment)], ['submitted', 'completed', 'refunded'])
+        self.booking.refresh_from_db()
+        self.assertEqual((self.booking.payment_status, self.booking.status), ('refunded', 'cancelled'))
+
+    def test_ledger_is_append_only(self):
+        submit_payment(self.booking.id, 'card', 'key-1')
+        entry = PaymentLedgerEntry.objects.get()
+        entry.note = 'edited'
+        with self.assertRaises(ValueError):
+            entry.save()
+        with self.assertRaises(ValueError):
+            entry.delete()
+
+    def test_double_submit_then_poll_through_views(self):
+        self.client.force_login(self.client_user)
+        url = reverse('payments:process_payment', args=[self.booking.id])
+        status_url = reverse('payments:payment_status', args=[self.booking.id])
+        for _ in range(2):
+            response = self.client.post(url, {'payment_method': 'card', 'idempotency_key': 'form-key'})
+            self.assertRedirects(response, reverse('payments:payment_processing', args=[self.booking.id]))
+        self.assertEqual(self.client.get(status_url).json(), {'status': 'processing', 'redirect': None})
+
+        settle_payment(Payment.objects.get(idempotency_key='form-key').pk)
+        self.assertEqual(
+            self.client.get(status_url).json()['redirect'],
+            reverse('payments:payment_success', args=[self.booking.id]),
+        )
+        self.assertEqual(PaymentLedgerEntry.objects.count(), 2)
+
+    def test_webhook_settles_once(self):
+        payment = submit_payment(self.booking.id, 'card', 'key-1')
+        body = json.dumps({'transaction_id': payment.transaction_id, 'status': 'succeeded', 'reference': 'ch_1'})
+        url = reverse('payments:payment_webhook')
+        response = self.client.post(url, body, content_type='application/json', HTTP_X_STUB_SIGNATURE='forged')
+        self.assertEqual(response.status_code, 400)
+
+        signature = get_gateway().sign(body.encode())
+        for _ in range(2):
+            response = self.client.post(url, body, content_type='application/json', HTTP_X_STUB_SIGNATURE=signature)
+            self.assertEqual(response.json(), {'status': 'completed'})
+        payment.refresh_from_db()
+        self.assertEqual(payment.gateway_reference, 'ch_1')
+        self.assertEqual(len(ledger(payment)), 2)
+
+    def test_settle_command_picks_up_stranded_payments(self):
+        payment = submit_payment(self.booking.id, 'card', 'key-1')
+        call_command('settle_payments', older_than=0, stdout=StringIO())
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+
+
+class BatchRefundTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='refunded', user_type='client')
+        cls.advocate = create_advocate('unavailable')
+        cls.other = create_advocate('still-here')
+        today = date.today()
+        cls.upcoming = [cls.paid_booking(cls.advocate, today + timedelta(days=1 + i)) for i in range(5)]
+        cls.past = cls.paid_booking(cls.advocate, today - timedelta(days=3))
+        cls.elsewhere = cls.paid_booking(cls.other, today + timedelta(days=1))
+
+    @classmethod
+    def paid_booking(cls, advocate, day):
+        booking = create_booking(advocate, cls.client_user, day, time(10, 0), status='confirmed', payment_status='paid')
+        Payment.objects.create(
+            booking=booking, amount=booking.total_fee, payment_method='card',
+            transaction_id=f'txn-{booking.id}', status='completed', payment_date=timezone.now(),
+        )
+        return booking
+
+    def statuses(self, booking):
+        booking.refresh_from_db()
+        return booking.status, booking.payment_status, booking.payment.status
+
+    def test_command_refunds_upcoming_bookings_in_chunks(self):
+        out = StringIO()
+        call_command('refund_payments', advocate=self.advocate.id, batch_size=2, stdout=out)
+        self.assertIn('Refunded 4/5 payments', out.getvalue())
+        self.assertIn('Refunded 5 payments.', out.getvalue())
+        for booking in self.upcoming:
+            self.assertEqual(self.statuses(booking), ('cancelled', 'refunded', 'refunded'))
+        self.assertEqual(self.statuses(self.past), ('confirmed', 'paid', 'completed'))
+        self.assertEqual(self.statuses(self.elsewhere), ('confirmed', 'paid', 'completed'))
+
+        entries = PaymentLedgerEntry.objects.filter(event='refunded')
+        self.assertEqual(entries.count(), 5)
+        self.assertEqual(len(set(entries.values_list('idempotency_key', flat=True))), 1)
+
+        call_command('refund_payments', advocate=self.advocate.id, stdout=out)
+        self.assertEqual(entries.count(), 5)
+
+        rollups = dict(
+            EarningsRollup.objects.filter(advocate=self.advocate).values_list('status', 'payment_count')
+        )
+        self.assertEqual(rollups, {'completed': 1, 'refunded': 5})
+
+    def test_chunk_cost_does_not_grow_with_its_size(self):
+        payments = Payment.objects.filter(booking__advocate=self.advocate, booking__booking_date__gt=date.today())
+        # Ids, locked rows, two UPDATEs, one ledger INSERT, a bitmap lookup and
+        # the rollup writes for the one advocate-day, plus savepoints and the
+        # empty next chunk: nothing per payment
+        with self.assertNumQueries(14):
+            self.assertEqual(refund_in_batches(payments, 'Bulk', batch_size=10), 5)
+
+    def test_admin_action(self):
+        admin = User.objects.create_superuser(username='admin', password='pass', email='admin@example.com')
+        self.client.force_login(admin)
+        response = self.client.post(reverse('admin:payments_payment_changelist'), {
+            'action': 'refund_payments',
+            '_selected_action': [self.past.payment.pk, self.elsewhere.payment.pk],
+        }, follow=True)
+        self.assertContains(response, 'Refunded 2 payments; 0 were not eligible.')
+        self.assertEqual(self.statuses(self.elsewhere), ('cancelled', 'refunded', 'refunded'))
+
+
+
+class ReconcileTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='drifted', user_type='client')
+        cls.advocate = create_advocate('reconciled')
+        day = date.today() + timedelta(days=2)
+        cls.bookings = [
+            create_booking(cls.advocate, cls.client_user, day, time(9 + i, 0)) for i in range(5)
+        ]
+        consistent, paid_unpaid, unpaid_paid, refunded, no_payment = cls.bookings
+        statuses = {consistent: 'completed', paid_unpaid: 'completed', unpaid_paid: 'failed', refunded: 'refunded'}
+        for booking, status in statuses.items():
+            Payment.objects.create(
+                booking=booking, amount=booking.total_fee, payment_method='card',
+                transaction_id=f'txn-{booking.id}', status=status, payment_date=timezone.now(),
+            )
+        # Drift as left behind by a request that died between the two saves
+        Booking.objects.filter(pk__in=[consistent.pk, unpaid_paid.pk, refunded.pk, no_payment.pk]).update(
+            status='confirmed', payment_status='paid',
+        )
+
+    def states(self):
+        return list(Booking.objects.order_by('pk').values_list('status', 'payment_status'))
+
+    def test_dry_run_reports_without_fixing(self):
+        before = self.states()
+        out = StringIO()
+        call_command('reconcile_payments', dry_run=True, batch_size=2, stdout=out)
+        self.assertIn('pending->paid: 1', out.getvalue())
+        self.assertIn('paid->pending: 2', out.getvalue())
+        self.assertIn('paid->refunded: 1', out.getvalue())
+        self.assertIn('Found 4 mismatched bookings out of 5 checked.', out.getvalue())
+        self.assertEqual(self.states(), before)
+
+    def test_fixes_bookings_from_their_payments(self):
+        out = StringIO()
+        call_command('reconcile_payments', batch_size=2, stdout=out)
+        self.assertIn('Fixed 4 mismatched bookings out of 5 checked.', out.getvalue())
+        self.assertEqual(self.states(), [
+            ('confirmed', 'paid'),
+            ('confirmed', 'paid'),
+            ('confirmed', 'pending'),
+            ('cancelled', 'refunded'),
+            ('confirmed', 'pending'),
+        ])
+
+        call_command('reconcile_payments', stdout=out)
+        self.assertIn('Fixed 0 mismatched bookings out of 5 checked.', out.getvalue())
+
+    def test_chunk_cost_does_not_grow_with_its_size(self):
+        # The scan, the locked re-read, one UPDATE per kind of fix and the
+        # bitmap refresh for the cancelled day, plus savepoints
+        with self.assertNumQueries(8):
+            last_id, checked, fixed = reconcile_chunk(0, 10)
+        self.assertEqual((last_id, checked, sum(fixed.values())), (self.bookings[-1].pk, 5, 4))
+
+
+@override_settings(PAYMENT_GATEWAY=INSTANT_GATEWAY, PAYMENT_WORKERS=0)
+class EarningsRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='earner-client', user_type='client')
+        cls.advocate = create_advocate('earner')
+        cls.bookings = [
+            create_booking(cls.advocate, cls.client_user, date.today() + timedelta(days=1), time(9 + i, 0))
+            for i in range(3)
+        ]
+
+    def pay(self, booking):
+        return settle_payment(submit_payment(booking.id, 'card', f'key-{booking.id}').pk)
+
+    def rollups(self):
+        return sorted(
+            EarningsRollup.objects.filter(advocate=self.advocate)
+            .values_list('status', 'payment_count', 'amount', 'refund_amount')
+        )
+
+    def test_rollups_follow_payments(self):
+        payments = [self.pay(booking) for booking in self.bookings]
+        refund_payment(payments[0].id, 'Changed plans')
+        self.assertEqual(self.rollups(), [
+            ('completed', 2, Decimal('1000.00'), Decimal('0.00')),
+            ('refunded', 1, Decimal('500.00'), Decimal('500.00')),
+        ])
+        today = timezone.localdate()
+        [day] = earnings_by_period(self.advocate.id, today, today)
+        self.assertEqual(
+            (day['period'], day['payments'], day['earned'], day['refunds'], day['refunded']),
+            (today, 2, Decimal('1000.00'), 1, Decimal('500.00')),
+        )
+
+    def test_backfill_matches_incremental_rollups(self):
+        for booking in self.bookings:
+            self.pay(booking)
+        incremental = self.rollups()
+        EarningsRollup.objects.all().delete()
+        out = StringIO()
+        call_command('backfill_earnings', batch_size=1, stdout=out)
+        self.assertEqual(self.rollups(), incremental)
+        self.assertIn('Rebuilt earnings rollups for 1 advocates.', out.getvalue())
+
+    def test_dashboard_and_api_read_rollups(self):
+        self.pay(self.bookings[0])
+        self.client.force_login(self.advocate.user)
+        response = self.client.get(reverse('payments:earnings'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['total_earned'], Decimal('500.00'))
+
+        # Session, user, advocate, then one rollup query
+        with self.assertNumQueries(4):
+            response = self.client.get('/api/earnings/', {'period': 'month'})
+        body = response.json()
+        self.assertEqual(body['results'], [{
+            'period': timezone.localdate().replace(day=1).isoformat(), 'payments': 1,
+            'earned': '500.00', 'refunds': 0, 'refunded': '0.00',
+        }])
+
+        self.client.force_login(self.client_user)
+        self.assertEqual(self.client.get('/api/earnings/').status_code, 404)
+
+
+class PaymentHistoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.client_user = User.objects.create_user(username='history', user_type='client')
+        cls.staff = User.objects.create_user(username='finance', user_type='admin')
+        advocate = create_advocate('historic')
+        for i in range(30):
+            booking = create_booking(advocate, cls.client_user, date.today() + timedelta(days=1 + i), time(10, 0))
+            Payment.objects.create(
+                booking=booking, amount=booking.total_fee, payment_method='upi', transaction_id=f'hist-{i}',
+                status='refunded' if i % 10 == 0 else 'completed',
+            )
+        cls.newest_first = list(Payment.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+
+    def test_history_pages_with_a_cursor(self):
+        self.client.force_login(self.client_user)
+        seen = []
+        params = {}
+        while True:
+            with self.assertNumQueries(3):
+                response = self.client.get(reverse('payments:payment_history'), params)
+            page = response.context['page']
+            seen.extend(payment.id for payment in page)
+            if not page.has_next:
+                break
+            params = {'cursor': page.next_cursor}
+        self.assertEqual(seen, self.newest_first)
+
+    def test_tampered_cursor_gives_the_first_page(self):
+        self.client.force_login(self.client_user)
+        first = [payment.id for payment in self.client.get(reverse('payments:payment_history')).context['page']]
+        for cursor in [encode_cursor(['zzz', 1]), encode_cursor(['2024-01-01T00:00:00+00:00', 'x']), encode_cursor([1])]:
+            with self.subTest(cursor=cursor):
+                response = self.client.get(reverse('payments:payment_history'), {'cursor': cursor})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual([payment.id for payment in response.context['page']], first)
+
+    def test_csv_export_streams_filtered_rows(self):
+        self.client.force_login(self.staff)
+        response = self.client.get(reverse('payments:payment_export'), {'status': 'completed'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0].split(',')[:3], ['id', 'transaction_id', 'booking_id'])
+        self.assertEqual(len(lines), 1 + 27)
+        self.assertIn(',historic,', lines[1])
+
+    def test_ndjson_export(self):
+        self.client.force_login(self.client_user)
+        response = self.client.get(reverse('payments:payment_export'), {'format': 'ndjson', 'status': 'refunded'})
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row['id'] for row in rows], [pk for pk in self.newest_first if pk in {
+            payment.pk for payment in Payment.objects.filter(status='refunded')
+        }])
+        self.assertEqual((rows[0]['amount'], rows[0]['client']), ('500.00', 'history'))
+
+
+@override_settings(PAYMENT_GATEWAY=INSTANT_GATEWAY, PAYMENT_WORKERS=0)
+class ConcurrentPaymentTests(FlushNotificationsMixin, TransactionTestCase):
+    def test_racing_retries_submit_once(self):
+        client_user = User.objects.create_user(username='racer', user_type='client')
+        booking = create_booking(create_advocate('raced'), client_user, date.today() + timedelta(days=2), time(10, 0))
+        errors = []
+
+        def pay(key):
+            try:
+                submit_payment(booking.id, 'card', key, attempts=50)
+            except Exception as exc:
+                errors.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=pay, args=(f'key-{i % 3}',)) for i in range(9)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(Payment.objects.count(), 1)
+        self.assertEqual(ledger(), [('submitted', '', 'processing')])
+
+
+@override_settings(
+    PAYMENT_WORKERS=4,
+    PAYMENT_GATEWAY={
+        'BACKEND': 'payments.gateways.StubGateway',
+        'OPTIONS': {'latency': 0.02, 'jitter': 0.03, 'failure_rate': 0.2},
+    },
+)
+class PaymentPipelineBenchmark(Benchmark):
+    """
+    Submits payments from many threads against a slow, flaky stub gateway
+    and waits for the background workers to settle them. Reports how fast
+    submissions return and how long settlement takes.
+    """
+    THREADS = 8
+    PAYMENTS_PER_THREAD = 5
+    TIMEOUT_SECONDS = 5
+
+    def test_every_submission_settles_once(self):
+        client_user = User.objects.create_user(username='bulk', user_type='client')
+        advocate = create_advocate('busy-gateway')
+        total = self.THREADS * self.PAYMENTS_PER_THREAD
+        bookings = [
+            create_booking(advocate, client_user, date.today() + timedelta(days=1 + i // 10), time(8 + i % 10, 0))
+            for i in range(total)
+        ]
+        submit_times = []
+        times_lock = threading.Lock()
+
+        def worker(seed):
+            for booking in bookings[seed::self.THREADS]:
+                started = time_module.perf_counter()
+                # Every request is sent twice, as a flaky client would
+                for _ in range(2):
+                    submit_payment(booking.id, 'card', f'bench-{booking.id}', attempts=50)
+                with times_lock:
+                    submit_times.append(time_module.perf_counter() - started)
+
+        submitted = self.run_threads(worker, self.THREADS)
+        started = time_module.perf_counter() - submitted
+
+        deadline = time_module.monotonic() + self.TIMEOUT_SECONDS
+        while time_module.monotonic() < deadline:
+            try:
+                if not Payment.objects.filter(status='processing').exists():
+                    break
+            except OperationalError:
+                # The workers hold the SQLite write lock
+                pass
+            time_module.sleep(0.05)
+        settled = time_module.perf_counter() - started
+        # A worker that ran out of lock attempts leaves its payment to the
+        # settle_payments sweep, as in production
+        swept = Payment.objects.filter(status='processing').count()
+        call_command('settle_payments', older_than=0, stdout=StringIO())
+
+        self.assertEqual(Payment.objects.count(), total)
+        self.assertFalse(Payment.objects.filter(status='processing').exists())
+        completed = Payment.objects.filter(status='completed').count()
+        self.assertEqual(Booking.objects.filter(payment_status='paid').count(), completed)
+        self.assertEqual(PaymentLedgerEntry.objects.count(), 2 * total)
+        self.report(
+            'payment pipeline',
+            f"{total} payments submitted in {submitted:.2f}s ({self.latency(submit_times)}), "
+            f"settled in {settled:.2f}s ({swept} left to the sweep), "
+            f"{completed} completed, {total - completed} declined",
+        )
@@ -14,6 +14,13 @@ urlpatterns = [
     # Process payment
     path('process/<int:booking_id>/', views.process_payment, name='process_payment'),
     
+    # Waiting page and the status it polls while the gateway settles
+    path('processing/<int:booking_id>/', views.payment_processing, name='payment_processing'),
+    path('status/<int:booking_id>/', views.payment_status, name='payment_status'),
+    
+    # Gateway callbacks
+    path('webhook/', views.payment_webhook, name='payment_webhook'),
+    
     # Payment success page
     path('success/<int:booking_id>/', views.payment_success, name='payment_success'),
     
@@ -26,6 +33,12 @@ urlpatterns = [
     # Payment history for user
     path('history/', views.payment_history, name='payment_history'),
     
+    # Streaming CSV/NDJSON export of the same history
+    path('history/export/', views.payment_export, name='payment_export'),
+    
+    # Daily and monthly earnings for advocates
+    path('earnings/', views.earnings, name='earnings'),
+    
     # Request refund
     path('refund/<int:payment_id>/', views.request_refund, name='request_refund'),
 ]
\ No newline at end of file
@@ -5,11 +5,27 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.utils import timezone
 from django.db.models import Q
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponseBadRequest, JsonResponse, StreamingHttpResponse
+from django.urls import reverse
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from datetime import date, datetime, timedelta
+from itertools import chain
+import csv
+import json
+from advocates.models import Advocate
+from book_my_advocate.pagination import paginate_keyset
 from bookings.models import Booking
+from .earnings import earnings_by_period
+from .gateways import GatewayError, get_gateway
 from .models import Payment
-import uuid
+from .processing import (
+    PaymentError, apply_gateway_result, new_idempotency_key, refund_payment,
+    request_idempotency_key, submit_payment,
+)
 
 @login_required
 def initiate_payment(request, booking_id):
@@ -26,8 +42,13 @@ def initiate_payment(request, booking_id):
         messages.info(request, 'This booking has already been paid for.')
         return redirect('booking_detail', booking_id=booking.id)
     
+    if Payment.objects.filter(booking=booking, status='processing').exists():
+        return redirect('payments:payment_processing', booking_id=booking.id)
+    
     context = {
         'booking': booking,
+        # Resubmitting this page (double clicks, retries) reuses the key
+        'idempotency_key': new_idempotency_key(),
     }
     return render(request, 'payments/initiate_payment.html', context)
 
@@ -43,48 +64,75 @@ def process_payment(request, booking_id):
     
     if request.method == 'POST':
         payment_method = request.POST.get('payment_method')
+        if payment_method not in dict(Payment.PAYMENT_METHOD_CHOICES):
+            messages.error(request, 'Please select a payment method.')
+            return redirect('payments:initiate_payment', booking_id=booking.id)
         
-        # Create or get payment
-        payment, created = Payment.objects.get_or_create(
-            booking=booking,
-            defaults={
-                'amount': booking.total_fee,
-                'payment_method': payment_method,
-                'transaction_id': str(uuid.uuid4()),
-                'status': 'processing'
-            }
-        )
-        
-        # Simulate payment processing
-        # In production, integrate with payment gateway (Razorpay, Stripe, etc.)
         try:
-            # Payment gateway integration would go here
-            # For now, we'll simulate successful payment
-            
-            payment.status = 'completed'
-            payment.payment_date = timezone.now()
-            payment.save()
-            
-            # Update booking
-            booking.payment_status = 'paid'
-            booking.status = 'confirmed'
-            booking.save()
-            
-            messages.success(request, 'Payment completed successfully! Your booking is confirmed.')
-            return redirect('payments:payment_success', booking_id=booking.id)
-            
-        except Exception as e:
-            # Handle payment failure
-            payment.status = 'failed'
-            payment.notes = str(e)
-            payment.save()
-            
-            messages.error(request, 'Payment failed. Please try again.')
+            payment = submit_payment(booking.id, payment_method, request_idempotency_key(request))
+        except PaymentError as e:
+            messages.error(request, f'Payment failed. {e}')
             return redirect('payments:payment_failure', booking_id=booking.id)
+        
+        # The gateway settles the payment in the background
+        return redirect('payments:payment_processing', booking_id=booking.id)
     
     return redirect('payments:initiate_payment', booking_id=booking_id)
 
 
+def _settled_url(payment):
+    """Where to send the client once the payment has left ``processing``."""
+    if payment.status in ('completed', 'refunded'):
+        return reverse('payments:payment_success', args=[payment.booking_id])
+    if payment.status == 'failed':
+        return reverse('payments:payment_failure', args=[payment.booking_id])
+    return None
+
+
+@login_required
+def payment_processing(request, booking_id):
+    """Waiting page that polls payment_status until the gateway answers"""
+    booking = get_object_or_404(Booking, id=booking_id)
+    
+    if booking.client != request.user:
+        messages.error(request, 'Unauthorized access.')
+        return redirect('dashboard')
+    
+    payment = get_object_or_404(Payment, booking=booking)
+    settled_url = _settled_url(payment)
+    if settled_url:
+        return redirect(settled_url)
+    
+    context = {
+        'booking': booking,
+        'payment': payment,
+    }
+    return render(request, 'payments/payment_processing.html', context)
+
+
+@login_required
+def payment_status(request, booking_id):
+    """JSON status of a booking's payment, polled by the processing page"""
+    payment = get_object_or_404(
+        Payment.objects.only('status', 'booking'), booking_id=booking_id, booking__client=request.user
+    )
+    return JsonResponse({'status': payment.status, 'redirect': _settled_url(payment)})
+
+
+@csrf_exempt
+@require_POST
+def payment_webhook(request):
+    """Asynchronous charge results reported by the gateway"""
+    try:
+        transaction_id, result = get_gateway().parse_webhook(request)
+    except GatewayError as e:
+        return HttpResponseBadRequest(str(e))
+    
+    payment = get_object_or_404(Payment, transaction_id=transaction_id)
+    payment = apply_gateway_result(payment.id, result)
+    return JsonResponse({'status': payment.status})
+
+
 @login_required
 def payment_success(request, booking_id):
     """Payment success confirmation page"""
@@ -140,27 +188,133 @@ def payment_details(request, payment_id):
     return render(request, 'payments/payment_details.html', context)
 
 
-@login_required
-def payment_history(request):
-    """View all payments for the logged-in user"""
+PAYMENT_PAGE_SIZE = 25
+# Newest first; ends in id so the keyset cursor is unambiguous
+PAYMENT_HISTORY_ORDERING = ['-created_at', '-id']
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_COLUMNS = [
+    ('id', 'id'),
+    ('transaction_id', 'transaction_id'),
+    ('booking_id', 'booking_id'),
+    ('client', 'booking__client__username'),
+    ('advocate', 'booking__advocate__user__username'),
+    ('amount', 'amount'),
+    ('refund_amount', 'refund_amount'),
+    ('payment_method', 'payment_method'),
+    ('status', 'status'),
+    ('payment_date', 'payment_date'),
+    ('refund_date', 'refund_date'),
+    ('created_at', 'created_at'),
+]
+
+
+def _local_day_start(value):
+    """Aware start of the local day ``value`` (YYYY-MM-DD), or None if it is not a date."""
+    try:
+        day = date.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    return timezone.make_aware(datetime.combine(day, datetime.min.time()))
+
+
+def _visible_payments(request):
+    """Payments the user may see, narrowed by the ?status=&since=&until= filters"""
     if request.user.user_type == 'client':
-        payments = Payment.objects.filter(booking__client=request.user).select_related('booking').order_by('-created_at')
+        payments = Payment.objects.filter(booking__client=request.user)
     elif request.user.user_type == 'advocate':
-        payments = Payment.objects.filter(booking__advocate__user=request.user).select_related('booking').order_by('-created_at')
+        payments = Payment.objects.filter(booking__advocate__user=request.user)
     else:
-        payments = Payment.objects.all().select_related('booking').order_by('-created_at')
+        payments = Payment.objects.all()
     
     # Filter by status if provided
     status = request.GET.get('status')
     if status:
         payments = payments.filter(status=status)
     
+    # Date range on created_at, as whole local days
+    since = _local_day_start(request.GET.get('since'))
+    if since:
+        payments = payments.filter(created_at__gte=since)
+    until = _local_day_start(request.GET.get('until'))
+    if until:
+        payments = payments.filter(created_at__lt=until + timedelta(days=1))
+    return payments
+
+
+@login_required
+def payment_history(request):
+    """View the logged-in user's payments, one keyset page at a time"""
+    page = paginate_keyset(
+        _visible_payments(request), PAYMENT_HISTORY_ORDERING, request.GET.get('cursor'), PAYMENT_PAGE_SIZE
+    )
     context = {
-        'payments': payments,
+        'payments': page,
+        'page': page,
     }
     return render(request, 'payments/payment_history.html', context)
 
 
+class _Echo:
+    """File-like object whose write() hands the line back to the csv writer's caller."""
+    def write(self, value):
+        return value
+
+
+def _export_rows(payments):
+    rows = payments.order_by(*PAYMENT_HISTORY_ORDERING).values_list(*[field for _, field in EXPORT_COLUMNS])
+    # iterator() streams from the database cursor instead of caching every row
+    return rows.iterator(chunk_size=EXPORT_CHUNK_SIZE)
+
+
+@login_required
+def payment_export(request):
+    """Stream the filtered payment history as CSV (default) or NDJSON (?format=ndjson)"""
+    payments = _visible_payments(request)
+    stamp = timezone.localdate().strftime('%Y%m%d')
+    header = [name for name, _ in EXPORT_COLUMNS]
+    
+    if request.GET.get('format') == 'ndjson':
+        lines = (
+            json.dumps(dict(zip(header, row)), cls=DjangoJSONEncoder) + '\n'
+            for row in _export_rows(payments)
+        )
+        response = StreamingHttpResponse(lines, content_type='application/x-ndjson')
+        response['Content-Disposition'] = f'attachment; filename="payments-{stamp}.ndjson"'
+        return response
+    
+    writer = csv.writer(_Echo())
+    lines = chain([writer.writerow(header)], (writer.writerow(row) for row in _export_rows(payments)))
+    response = StreamingHttpResponse(lines, content_type='text/csv')
+    response['Content-Disposition'] = f'attachment; filename="payments-{stamp}.csv"'
+    return response
+
+
+EARNINGS_DAYS = 30
+EARNINGS_MONTHS = 12
+
+
+@login_required
+def earnings(request):
+    """Daily and monthly earnings for the logged-in advocate, read from the rollups"""
+    advocate = get_object_or_404(Advocate, user=request.user)
+    today = timezone.localdate()
+    first_month = today.replace(day=1)
+    for _ in range(EARNINGS_MONTHS - 1):
+        first_month = (first_month - timedelta(days=1)).replace(day=1)
+    
+    daily = earnings_by_period(advocate.id, today - timedelta(days=EARNINGS_DAYS - 1), today)
+    monthly = earnings_by_period(advocate.id, first_month, today, period='month')
+    context = {
+        'daily': reversed(daily),
+        'monthly': reversed(monthly),
+        'total_earned': sum(row['earned'] for row in monthly),
+        'total_refunded': sum(row['refunded'] for row in monthly),
+        'earnings_days': EARNINGS_DAYS,
+        'earnings_months': EARNINGS_MONTHS,
+    }
+    return render(request, 'payments/earnings.html', context)
+
+
 @login_required
 def request_refund(request, payment_id):
     """Request a refund for a payment"""
@@ -183,19 +337,12 @@ def request_refund(request, payment_id):
     if request.method == 'POST':
         refund_reason = request.POST.get('reason', '')
         
-        # Process refund
         # In production, integrate with payment gateway for actual refund
-        payment.status = 'refunded'
-        payment.refund_date = timezone.now()
-        payment.refund_amount = payment.amount
-        payment.notes = f"Refund requested. Reason: {refund_reason}"
-        payment.save()
-        
-        # Update booking
-        payment.booking.payment_status = 'refunded'
-        payment.booking.status = 'cancelled'
-        payment.booking.cancellation_reason = f"Refund requested: {refund_reason}"
-        payment.booking.save()
+        try:
+            refund_payment(payment.id, refund_reason, request_idempotency_key(request))
+        except PaymentError as e:
+            messages.error(request, str(e))
+            return redirect('payments:payment_details', payment_id=payment.id)
         
         messages.success(request, 'Refund request submitted successfully. Amount will be credited within 5-7 business days.')
         return redirect('payments:payment_details', payment_id=payment.id)
@@ -0,0 +1,4 @@
+"""
+Helpers for the apps' tests. Kept outside the project packages so that
+nothing here is importable by the running site.
+"""
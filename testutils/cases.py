@@ -0,0 +1,53 @@
+"""Test case bases shared by the apps' tests."""
+
+import threading
+import time
+
+from django.db import connection
+from django.test import TransactionTestCase, tag
+
+from notifications.fanout import flush
+
+
+class FlushNotificationsMixin:
+    """
+    For TransactionTestCases whose writes queue notifications: lets the
+    queued ones land before the tables are flushed.
+    """
+
+    def tearDown(self):
+        flush()
+        super().tearDown()
+
+
+@tag('benchmark')
+class Benchmark(FlushNotificationsMixin, TransactionTestCase):
+    """
+    Base for the benchmarks. They only run with
+    ``python manage.py test --tag benchmark``, assert on correctness alone
+    and print their timings with ``report``.
+    """
+
+    def run_threads(self, target, count):
+        """Run ``target(seed)`` in ``count`` threads at once; returns the wall time in seconds."""
+        def run(seed):
+            try:
+                target(seed)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=run, args=(seed,)) for seed in range(count)]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return time.perf_counter() - started
+
+    @staticmethod
+    def latency(timings):
+        timings = sorted(timings)
+        return f"p50 {timings[len(timings) // 2] * 1000:.1f}ms, max {timings[-1] * 1000:.1f}ms"
+
+    def report(self, name, text):
+        print(f"\n{name}: {text}")
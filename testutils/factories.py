@@ -0,0 +1,37 @@
+"""Factories shared by the apps' tests."""
+
+from decimal import Decimal
+
+from accounts.models import User
+from advocates.models import Advocate
+from bookings.models import Booking
+
+
+def create_advocate(username, **kwargs):
+    user = User.objects.create_user(
+        username=username, first_name=username.title(), last_name='Advocate', user_type='advocate'
+    )
+    defaults = {
+        'bar_council_id': f'BC-{username}',
+        'experience': '3-5',
+        'consultation_fee': Decimal('500.00'),
+        'court_appearance_fee': Decimal('1500.00'),
+        'bio': 'Practising advocate',
+        'languages': 'English, Hindi',
+        'education': 'LLB',
+        'verified': True,
+    }
+    defaults.update(kwargs)
+    return Advocate.objects.create(user=user, **defaults)
+
+
+def create_booking(advocate, client, booking_date, booking_time, duration=60, **kwargs):
+    defaults = {
+        'service_type': 'consultation', 'case_description': 'Case', 'case_type': 'Civil',
+        'total_fee': advocate.consultation_fee,
+    }
+    defaults.update(kwargs)
+    return Booking.objects.create(
+        advocate=advocate, client=client, booking_date=booking_date,
+        booking_time=booking_time, duration=duration, **defaults
+    )
@@ -0,0 +1,28 @@
+"""The project's test runner."""
+
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+# Each test run gets its own in-process cache instead of the site's
+TEST_CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+
+class TestRunner(DiscoverRunner):
+    """
+    Runs the tests against a local-memory cache and leaves the benchmarks
+    out unless they are asked for with ``--tag benchmark``.
+    """
+
+    def __init__(self, *args, tags=None, exclude_tags=None, **kwargs):
+        if 'benchmark' not in (tags or ()):
+            exclude_tags = {*(exclude_tags or ()), 'benchmark'}
+        super().__init__(*args, tags=tags, exclude_tags=exclude_tags, **kwargs)
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._test_caches = override_settings(CACHES=TEST_CACHES)
+        self._test_caches.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_caches.disable()
+        super().teardown_test_environment(**kwargs)